@@ -1,11 +1,1037 @@
+import difflib
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional, Sequence, Tuple
+
+try:
+	import zstandard as zstd  # type: ignore
+except Exception:  # pragma: no cover
+	zstd = None
+
+try:
+	import pyarrow as pa  # type: ignore
+except Exception:  # pragma: no cover
+	pa = None
+
+try:
+	import pyarrow.dataset as pa_dataset  # type: ignore
+except Exception:  # pragma: no cover
+	pa_dataset = None
+
+try:
+	from scipy.spatial import cKDTree  # type: ignore
+except Exception:  # pragma: no cover
+	cKDTree = None
+
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = EARTH_RADIUS_MILES * math.pi / 180
+
+# Renovation cost per square foot by renovation tier
+RENOVATION_COST_PER_SQFT: Dict[str, float] = {
+	"basic": 25.0,
+	"moderate": 50.0,
+	"high_end": 100.0,
+}
+
+# Low-cardinality listing columns stored as categoricals by normalize_listing_schema
+CATEGORICAL_COLUMNS = ("city", "state", "zip", "status")
+
+
+def _segment_medians(segments: np.ndarray, values: np.ndarray, n_segments: int) -> np.ndarray:
+	"""Compute the median of ``values`` for every segment id in one sorted pass.
+	
+	NaN values are ignored like ``Series.median()``; segments without any
+	non-NaN value get NaN.
+	"""
+	keep = ~np.isnan(values)
+	segments = segments[keep]
+	values = values[keep]
+	order = np.lexsort((values, segments))
+	segments = segments[order]
+	values = values[order]
+	
+	counts = np.bincount(segments, minlength=n_segments)
+	starts = np.cumsum(counts) - counts
+	medians = np.full(n_segments, np.nan)
+	has_values = counts > 0
+	lower = starts[has_values] + (counts[has_values] - 1) // 2
+	upper = starts[has_values] + counts[has_values] // 2
+	medians[has_values] = (values[lower] + values[upper]) / 2
+	return medians
+
+
+def _parse_radius_miles(tags: List[str]) -> Optional[float]:
+	"""Return X from a "radius_miles:X" tag, or None when no radius is requested."""
+	for tag in tags:
+		if tag.startswith("radius_miles:"):
+			value = tag.split(":", 1)[1]
+			try:
+				radius = float(value)
+			except ValueError:
+				raise ValueError(f"Invalid radius tag {tag!r}: expected radius_miles:<miles>")
+			if radius <= 0:
+				raise ValueError(f"Invalid radius tag {tag!r}: radius must be positive")
+			return radius
+	return None
+
+
+def _haversine_miles(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+	"""Great-circle distance in miles between coordinate arrays (degrees)."""
+	lat1 = np.radians(lat1)
+	lat2 = np.radians(lat2)
+	dlat = lat2 - lat1
+	dlon = np.radians(lon2 - lon1)
+	a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+	return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class CompsIndex:
+	"""Comparable-sales index built once per listing DataFrame.
+	
+	Eligible comps are partitioned by location (city, plus zip when
+	``same_zip_only`` is set) and bucketed by whole bedroom/bathroom counts.
+	Each bucket keeps its listings sorted by square footage, so a property's
+	candidate set comes from a few range queries instead of a scan of the
+	whole frame, and the comp medians are computed in batch.
+	
+	With ``radius_miles`` the city partition is replaced by a latitude/longitude
+	grid whose cells are one radius tall; a listing only probes the cells its
+	radius can reach and candidates are then checked by haversine distance.
+	"""
+	
+	def __init__(
+		self,
+		df: pd.DataFrame,
+		same_zip_only: bool = False,
+		exclude_statuses: Sequence[str] = (),
+		radius_miles: Optional[float] = None,
+		sqft_tolerance_pct: float = 0.20,
+		bed_tolerance: int = 1,
+		bath_tolerance: int = 1,
+		max_pairs_per_batch: int = 2_000_000,
+	):
+		"""Partition and sort the comp candidates of ``df``.
+		
+		Args:
+			df: DataFrame with price and squareFeet columns, and optionally
+				city, zip, bedrooms, bathrooms, status, latitude and longitude
+			same_zip_only: Only match comps within the same zip code
+			exclude_statuses: Status values that disqualify a listing as a comp
+			radius_miles: Match comps within this distance instead of by city;
+				ignored when the frame has no latitude/longitude columns
+			sqft_tolerance_pct: Allowed square footage deviation (±20% by default)
+			bed_tolerance: Allowed bedroom deviation
+			bath_tolerance: Allowed bathroom deviation
+			max_pairs_per_batch: Upper bound on (listing, comp) pairs held in
+				memory at once while computing medians
+		"""
+		n = len(df)
+		self.sqft_tolerance_pct = sqft_tolerance_pct
+		self.bed_tolerance = bed_tolerance
+		self.bath_tolerance = bath_tolerance
+		self.max_pairs_per_batch = max_pairs_per_batch
+		
+		self._n = n
+		self._price = df["price"].to_numpy(dtype=float)
+		self._sqft = df["squareFeet"].to_numpy(dtype=float)
+		self._beds = df["bedrooms"].to_numpy(dtype=float) if "bedrooms" in df.columns else None
+		self._baths = df["bathrooms"].to_numpy(dtype=float) if "bathrooms" in df.columns else None
+		
+		# Radius comps need coordinates; without them fall back to city matching
+		if radius_miles is not None and not {"latitude", "longitude"} <= set(df.columns):
+			radius_miles = None
+		self.radius_miles = radius_miles
+		if radius_miles is not None:
+			self._lat = df["latitude"].to_numpy(dtype=float)
+			self._lon = df["longitude"].to_numpy(dtype=float)
+		
+		# Comps never match the listing itself (nor any row sharing its index label)
+		if df.index.is_unique:
+			self._labels = None
+		else:
+			self._labels = pd.factorize(df.index)[0]
+		
+		# Location partition code; -1 means the listing can never match (missing key)
+		location_columns = []
+		if "city" in df.columns and radius_miles is None:
+			location_columns.append("city")
+		if same_zip_only and "zip" in df.columns:
+			location_columns.append("zip")
+		location = np.zeros(n, dtype=np.int64)
+		for column in location_columns:
+			codes, n_codes = _category_codes(df[column])
+			location = np.where((location < 0) | (codes < 0), -1, location * n_codes + codes)
+		
+		valid = (location >= 0) & ~np.isnan(self._sqft)
+		if self._beds is not None:
+			valid &= ~np.isnan(self._beds)
+		if self._baths is not None:
+			valid &= ~np.isnan(self._baths)
+		if radius_miles is not None:
+			valid &= ~np.isnan(self._lat) & ~np.isnan(self._lon)
+		self._valid = valid
+		
+		eligible = valid.copy()
+		if exclude_statuses and "status" in df.columns:
+			eligible &= ~df["status"].isin(list(exclude_statuses)).to_numpy()
+		self._eligible = eligible
+		
+		# A bucket is the tuple of its axis values; each axis lists the offsets
+		# a listing's comps can sit at (None = longitude, which depends on the grid row)
+		self._axes = [location]
+		self._axis_offsets: List[Optional[List[int]]] = [[0]]
+		if radius_miles is not None:
+			self._cell_degrees = radius_miles / MILES_PER_DEGREE_LAT
+			self._axes.append(self._grid_cells(self._lat, valid))
+			self._axes.append(self._grid_cells(self._lon, valid))
+			self._axis_offsets.append([-1, 0, 1])
+			self._axis_offsets.append(None)
+		if self._beds is not None:
+			self._axes.append(self._floor_buckets(self._beds, valid))
+			self._axis_offsets.append(self._tolerance_offsets(bed_tolerance))
+		if self._baths is not None:
+			self._axes.append(self._floor_buckets(self._baths, valid))
+			self._axis_offsets.append(self._tolerance_offsets(bath_tolerance))
+		
+		pool = np.flatnonzero(eligible)
+		pool = pool[np.lexsort([self._sqft[pool]] + [axis[pool] for axis in reversed(self._axes)])]
+		self._pool = pool
+		
+		# Bucket table: one entry per distinct axis tuple among the comp pool
+		bucket_ids = np.zeros(len(pool), dtype=np.int64)
+		if len(pool):
+			changed = np.zeros(len(pool), dtype=bool)
+			for axis in self._axes:
+				column = axis[pool]
+				changed[1:] |= column[1:] != column[:-1]
+			bucket_ids = np.cumsum(changed)
+		bucket_starts = np.flatnonzero(np.r_[True, np.diff(bucket_ids) != 0]) if len(pool) else bucket_ids
+		self._bucket_table = pd.MultiIndex.from_arrays([axis[pool[bucket_starts]] for axis in self._axes])
+		
+		# Pool sorted by (bucket, sqft) encoded as one integer so a bucket-restricted
+		# sqft range becomes a single searchsorted over the whole pool
+		self._sqft_values = np.unique(self._sqft[valid])
+		self._rank_stride = len(self._sqft_values) + 1
+		self._pool_keys = bucket_ids * self._rank_stride + np.searchsorted(self._sqft_values, self._sqft[pool])
+	
+	@classmethod
+	def from_tags(cls, df: pd.DataFrame, tags: List[str]) -> "CompsIndex":
+		"""Build the index compute_comps_estimate uses for ``tags``."""
+		# Statuses that disqualify a listing from being used as a comp
+		exclude_statuses = []
+		if "exclude_pending" in tags:
+			exclude_statuses.append("Pending")
+		if "exclude_sold" in tags:
+			exclude_statuses.append("Sold")
+		return cls(
+			df,
+			same_zip_only="same_zip_only" in tags,
+			exclude_statuses=exclude_statuses,
+			radius_miles=_parse_radius_miles(tags),
+		)
+	
+	@staticmethod
+	def _tolerance_offsets(tolerance: float) -> List[int]:
+		reach = int(math.ceil(tolerance))
+		return list(range(-reach, reach + 1))
+	
+	@staticmethod
+	def _floor_buckets(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+		buckets = np.zeros(len(values), dtype=np.int64)
+		buckets[valid] = np.floor(values[valid]).astype(np.int64)
+		return buckets
+	
+	def _grid_cells(self, degrees: np.ndarray, valid: np.ndarray) -> np.ndarray:
+		cells = np.zeros(len(degrees), dtype=np.int64)
+		cells[valid] = np.floor(degrees[valid] / self._cell_degrees).astype(np.int64)
+		return cells
+	
+	def _longitude_reach(self, lat_cells: np.ndarray) -> np.ndarray:
+		"""Longitude cells within reach of each grid row (cells are narrower near the poles)."""
+		# Most poleward latitude a comp of the row can have
+		edge = np.maximum(np.abs(lat_cells - 1), np.abs(lat_cells + 2)) * self._cell_degrees
+		cos_lat = np.cos(np.radians(np.minimum(edge, 90.0)))
+		half_angle = math.sin(self.radius_miles / (2 * EARTH_RADIUS_MILES))
+		ratio = half_angle / np.maximum(cos_lat, 1e-12)
+		reach_degrees = np.where(ratio >= 1, 180.0, np.degrees(2 * np.arcsin(np.minimum(ratio, 1.0))))
+		return np.ceil(reach_degrees / self._cell_degrees).astype(np.int64)
+	
+	def _axis_offsets_for(self, queries: np.ndarray) -> List[List[int]]:
+		offsets = list(self._axis_offsets)
+		if self.radius_miles is not None:
+			reach = int(self._longitude_reach(self._axes[1][queries]).max()) if len(queries) else 0
+			offsets[2] = list(range(-reach, reach + 1))
+		return offsets
+	
+	def candidate_ranges(self, queries: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+		"""Return one (low, high) pool range per neighbouring bucket offset.
+		
+		Each pair of arrays is aligned with ``queries``; ``self._pool[low:high]``
+		holds the listings of that neighbouring bucket within the sqft tolerance.
+		"""
+		sqft = self._sqft[queries]
+		low_rank = np.searchsorted(self._sqft_values, sqft * (1 - self.sqft_tolerance_pct), side="left")
+		high_rank = np.searchsorted(self._sqft_values, sqft * (1 + self.sqft_tolerance_pct), side="right")
+		if self.radius_miles is not None:
+			longitude_reach = self._longitude_reach(self._axes[1][queries])
+		
+		ranges = []
+		for delta in itertools.product(*self._axis_offsets_for(queries)):
+			neighbour_keys = [axis[queries] + d for axis, d in zip(self._axes, delta)]
+			buckets = self._bucket_table.get_indexer(pd.MultiIndex.from_arrays(neighbour_keys))
+			found = buckets >= 0
+			if self.radius_miles is not None:
+				found &= abs(delta[2]) <= longitude_reach
+			if not found.any():
+				continue
+			base = buckets * self._rank_stride
+			low = np.searchsorted(self._pool_keys, base + low_rank, side="left")
+			high = np.searchsorted(self._pool_keys, base + high_rank, side="left")
+			high = np.where(found, np.maximum(high, low), low)
+			ranges.append((low, high))
+		return ranges
+	
+	def _filter_pairs(self, query_pairs: np.ndarray, comp_pairs: np.ndarray) -> np.ndarray:
+		"""Apply the exact bed/bath/distance tolerances and self-exclusion to candidate pairs."""
+		if self._labels is None:
+			keep = query_pairs != comp_pairs
+		else:
+			keep = self._labels[query_pairs] != self._labels[comp_pairs]
+		if self._beds is not None:
+			query_beds = self._beds[query_pairs]
+			comp_beds = self._beds[comp_pairs]
+			keep &= (comp_beds >= np.maximum(0, query_beds - self.bed_tolerance)) & (comp_beds <= query_beds + self.bed_tolerance)
+		if self._baths is not None:
+			query_baths = self._baths[query_pairs]
+			comp_baths = self._baths[comp_pairs]
+			keep &= (comp_baths >= np.maximum(0, query_baths - self.bath_tolerance)) & (comp_baths <= query_baths + self.bath_tolerance)
+		if self.radius_miles is not None:
+			distance = _haversine_miles(
+				self._lat[query_pairs], self._lon[query_pairs],
+				self._lat[comp_pairs], self._lon[comp_pairs],
+			)
+			keep &= distance <= self.radius_miles
+		return keep
+	
+	def comp_pairs(self, queries: np.ndarray, ranges: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+		"""Return (query slot, comp position) pairs for ``queries``.
+		
+		The query slot is the index into ``queries``, so callers can aggregate
+		per listing with ``np.bincount``.
+		"""
+		if ranges is None:
+			ranges = self.candidate_ranges(queries)
+		slot_parts = []
+		comp_parts = []
+		for low, high in ranges:
+			counts = high - low
+			total = int(counts.sum())
+			if total == 0:
+				continue
+			slots = np.repeat(np.arange(len(queries)), counts)
+			run_starts = np.cumsum(counts) - counts
+			offsets = np.arange(total) - np.repeat(run_starts, counts)
+			slot_parts.append(slots)
+			comp_parts.append(self._pool[np.repeat(low, counts) + offsets])
+		if not slot_parts:
+			empty = np.empty(0, dtype=np.int64)
+			return empty, empty
+		slots = np.concatenate(slot_parts)
+		comps = np.concatenate(comp_parts)
+		keep = self._filter_pairs(queries[slots], comps)
+		return slots[keep], comps[keep]
+	
+	def estimate(self, positions: Optional[np.ndarray] = None, query_chunk_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+		"""Compute the comps estimate and comp count for listings.
+		
+		Args:
+			positions: Row positions to estimate (default: every row)
+			query_chunk_size: Number of listings whose candidate ranges are
+				resolved together
+		
+		Returns:
+			Tuple of (comps_estimate, num_comps) arrays aligned with ``positions``
+			(or the input rows). Listings without comps fall back to their own price.
+		"""
+		if positions is None:
+			positions = np.arange(self._n)
+		positions = np.asarray(positions, dtype=np.int64)
+		estimates = self._price[positions].copy()
+		num_comps = np.zeros(len(positions), dtype=np.int64)
+		
+		query_slots = np.flatnonzero(self._valid[positions])
+		for chunk_start in range(0, len(query_slots), query_chunk_size):
+			chunk_slots = query_slots[chunk_start:chunk_start + query_chunk_size]
+			chunk = positions[chunk_slots]
+			ranges = self.candidate_ranges(chunk)
+			if not ranges:
+				continue
+			# Split the chunk so at most max_pairs_per_batch candidate pairs are materialized
+			candidates = np.cumsum(sum(high - low for low, high in ranges))
+			split = 0
+			while split < len(chunk):
+				already = candidates[split - 1] if split else 0
+				stop = int(np.searchsorted(candidates, already + self.max_pairs_per_batch, side="right"))
+				stop = max(stop, split + 1)
+				sub_ranges = [(low[split:stop], high[split:stop]) for low, high in ranges]
+				sub_chunk = chunk[split:stop]
+				slots, comps = self.comp_pairs(sub_chunk, sub_ranges)
+				if len(slots):
+					counts = np.bincount(slots, minlength=len(sub_chunk))
+					medians = _segment_medians(slots, self._price[comps], len(sub_chunk))
+					matched = counts > 0
+					out_slots = chunk_slots[split:stop][matched]
+					estimates[out_slots] = medians[matched]
+					num_comps[out_slots] = counts[matched]
+				split = stop
+		
+		return estimates, num_comps
+	
+	def estimate_upper_bounds(self, positions: Optional[np.ndarray] = None, query_chunk_size: int = 65536) -> np.ndarray:
+		"""Cheap upper bound on estimate() for each listing, without forming comp pairs.
+		
+		A comps median can't exceed the highest price in the listing's candidate
+		ranges, which a sparse table answers in O(1) per range; listings without
+		comps fall back to their own price.
+		
+		Args:
+			positions: Row positions to bound (default: every row)
+			query_chunk_size: Number of listings whose candidate ranges are
+				resolved together
+		
+		Returns:
+			Array aligned with ``positions`` (-inf where the estimate is NaN)
+		"""
+		if positions is None:
+			positions = np.arange(self._n)
+		positions = np.asarray(positions, dtype=np.int64)
+		bounds = np.full(len(positions), -np.inf)
+		
+		# levels[j][i] = max pool price over pool[i:i + 2**j] (NaN prices never win)
+		levels = [np.nan_to_num(self._price[self._pool], nan=-np.inf)]
+		while 2 ** len(levels) <= len(self._pool):
+			half = 2 ** (len(levels) - 1)
+			levels.append(np.maximum(levels[-1][:-half], levels[-1][half:]))
+		
+		query_slots = np.flatnonzero(self._valid[positions])
+		for chunk_start in range(0, len(query_slots), query_chunk_size):
+			chunk_slots = query_slots[chunk_start:chunk_start + query_chunk_size]
+			for low, high in self.candidate_ranges(positions[chunk_slots]):
+				nonempty = np.flatnonzero(high > low)
+				low, high = low[nonempty], high[nonempty]
+				level = np.frexp((high - low).astype(float))[1] - 1
+				for j in np.unique(level):
+					at = level == j
+					span = np.maximum(levels[j][low[at]], levels[j][high[at] - 2 ** j])
+					slots = chunk_slots[nonempty[at]]
+					bounds[slots] = np.maximum(bounds[slots], span)
+		return np.fmax(self._price[positions], bounds)
+	
+	def dependents(self, comp_positions: np.ndarray) -> np.ndarray:
+		"""Return positions of listings whose comps set includes any of ``comp_positions``."""
+		queries = np.flatnonzero(self._valid)
+		hit = np.zeros(self._n, dtype=bool)
+		for comp in np.asarray(comp_positions, dtype=np.int64):
+			if not self._eligible[comp]:
+				continue
+			sqft = self._sqft[queries]
+			in_range = (
+				(self._sqft[comp] >= sqft * (1 - self.sqft_tolerance_pct))
+				& (self._sqft[comp] <= sqft * (1 + self.sqft_tolerance_pct))
+				& (self._axes[0][queries] == self._axes[0][comp])
+			)
+			candidates = queries[in_range]
+			keep = self._filter_pairs(candidates, np.full(len(candidates), comp))
+			hit[candidates[keep]] = True
+		return np.flatnonzero(hit)
+
+
+class _KdTree:
+	"""NumPy k-d tree used when scipy is not installed.
+	
+	Each level splits every node at the median of its widest dimension, so
+	level ``l`` holds ``2**l`` nodes over contiguous ranges of the reordered
+	points, down to leaves of at most ``leaf_size``. A batch query first
+	descends to a node with at least k points to get an upper bound on each
+	query's k-th neighbour distance, then walks the tree level by level as
+	flat (query, node) pairs, dropping nodes whose bounding box is beyond
+	that bound, and only compares the query with points in surviving leaves.
+	"""
+	
+	def __init__(self, points: np.ndarray, leaf_size: int = 32):
+		n = len(points)
+		order = np.arange(n)
+		bounds = [np.array([0, n])]
+		while (bounds[-1][1:] - bounds[-1][:-1]).max() > leaf_size:
+			parent = bounds[-1]
+			child = np.empty(2 * len(parent) - 1, dtype=np.int64)
+			child[::2] = parent
+			for node in range(len(parent) - 1):
+				low, high = parent[node], parent[node + 1]
+				middle = (low + high) // 2
+				members = order[low:high]
+				values = points[members]
+				axis = int(np.argmax(values.max(axis=0) - values.min(axis=0)))
+				order[low:high] = members[np.argpartition(values[:, axis], middle - low)]
+				child[2 * node + 1] = middle
+			bounds.append(child)
+		self._order = order
+		# Reordered points plus one at infinity that pads ragged ranges
+		self._points = np.vstack([points[order], np.full((1, points.shape[1]), np.inf)])
+		self._bounds = bounds
+		self._lower = [np.minimum.reduceat(self._points[:n], level[:-1], axis=0) for level in bounds]
+		self._upper = [np.maximum.reduceat(self._points[:n], level[:-1], axis=0) for level in bounds]
+	
+	def _box_squared(self, level: int, nodes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+		gap = np.maximum(self._lower[level][nodes] - queries, queries - self._upper[level][nodes])
+		return (np.maximum(gap, 0) ** 2).sum(axis=1)
+	
+	def _node_points(self, level: int, nodes: np.ndarray) -> np.ndarray:
+		# Reordered positions of each node's points, padded with the point at infinity
+		low, high = self._bounds[level][nodes], self._bounds[level][nodes + 1]
+		positions = low[:, None] + np.arange((high - low).max(initial=0))
+		return np.where(positions < high[:, None], positions, len(self._points) - 1)
+	
+	def query(self, queries: np.ndarray, k: int, max_block_cells: int = 4_000_000) -> Tuple[np.ndarray, np.ndarray]:
+		"""Return (distances, indices) of the ``k`` nearest points, each (len(queries), k), nearest first."""
+		distances = np.empty((len(queries), k))
+		indices = np.empty((len(queries), k), dtype=np.int64)
+		sizes = [(level[1:] - level[:-1]).min() for level in self._bounds]
+		# The parent of the smallest node holding k points gives a tighter bound
+		bound_level = max(0, max(level for level, size in enumerate(sizes) if size >= k) - 1)
+		block = max(1, max_block_cells // (16 * (sizes[-1] + 1) * queries.shape[1]))
+		for start in range(0, len(queries), block):
+			chunk = queries[start:start + block]
+			# Upper bound: k-th nearest point in the node reached by taking the nearer child at each level
+			nodes = np.zeros(len(chunk), dtype=np.int64)
+			for level in range(1, bound_level + 1):
+				left = 2 * nodes
+				nodes = left + (self._box_squared(level, left + 1, chunk) < self._box_squared(level, left, chunk))
+			squared = ((self._points[self._node_points(bound_level, nodes)] - chunk[:, None, :]) ** 2).sum(axis=2)
+			bound = np.partition(squared, k - 1, axis=1)[:, k - 1]
+			# Walk down as (query, node) pairs, pruning boxes beyond the bound
+			pairs = np.arange(len(chunk))
+			nodes = np.zeros(len(chunk), dtype=np.int64)
+			for level in range(1, len(self._bounds)):
+				pairs = np.repeat(pairs, 2)
+				nodes = 2 * np.repeat(nodes, 2) + np.tile([0, 1], len(nodes))
+				near = self._box_squared(level, nodes, chunk[pairs]) <= bound[pairs]
+				pairs, nodes = pairs[near], nodes[near]
+			candidates = self._node_points(len(self._bounds) - 1, nodes)
+			squared = ((self._points[candidates] - chunk[pairs][:, None, :]) ** 2).sum(axis=2)
+			pairs = np.repeat(pairs, candidates.shape[1])
+			candidates, squared = candidates.ravel(), squared.ravel()
+			near = squared <= bound[pairs]
+			pairs, candidates, squared = pairs[near], candidates[near], squared[near]
+			# Every query keeps at least k candidates; take its k nearest
+			ranked = np.argsort(squared, kind="stable")
+			ranked = ranked[np.argsort(pairs[ranked], kind="stable")]
+			pairs, candidates, squared = pairs[ranked], candidates[ranked], squared[ranked]
+			rank = np.arange(len(pairs)) - np.searchsorted(pairs, pairs)
+			top = rank < k
+			distances[start + pairs[top], rank[top]] = np.sqrt(squared[top])
+			indices[start + pairs[top], rank[top]] = self._order[candidates[top]]
+		return distances, indices
+
+
+class _NeighbourSearch:
+	"""Nearest-neighbour queries over one point set: scipy's cKDTree when
+	available, otherwise _KdTree."""
+	
+	def __init__(self, points: np.ndarray):
+		self.points = points
+		self._tree = cKDTree(points) if cKDTree is not None else _KdTree(points)
+	
+	def query(self, queries: np.ndarray, n_neighbours: int) -> Tuple[np.ndarray, np.ndarray]:
+		"""Return (distances, indices), each (len(queries), n_neighbours), nearest first."""
+		distances, indices = self._tree.query(queries, k=n_neighbours)
+		return distances.reshape(len(queries), n_neighbours), indices.reshape(len(queries), n_neighbours)
+
+
+class KnnCompsIndex:
+	"""Similarity-weighted k-nearest-neighbour comps.
+	
+	Listings are points in a normalized feature space: log square footage
+	scaled so the box filter's ±20% is one unit, bedrooms, bathrooms and, when
+	the frame has coordinates, position in miles divided by ``miles_scale``.
+	One search tree is built per comp partition (city, plus zip with
+	same_zip_only) and queried for all of its listings at once. A listing's
+	estimate is the inverse-distance weighted mean price of its k nearest
+	comps. Partitions with fewer than ``min_comps`` comps borrow from the
+	listing's state, then from the whole market, so every listing gets at
+	least ``min_comps`` comps whenever the market has that many.
+	"""
+	
+	def __init__(
+		self,
+		df: pd.DataFrame,
+		k: int = 10,
+		min_comps: int = 5,
+		same_zip_only: bool = False,
+		exclude_statuses: Sequence[str] = (),
+		miles_scale: float = 1.0,
+		sqft_tolerance_pct: float = 0.20,
+	):
+		"""Compute features and partition codes for ``df``.
+		
+		Args:
+			df: DataFrame with price and squareFeet columns, and optionally
+				city, state, zip, bedrooms, bathrooms, status, latitude and longitude
+			k: Number of neighbours averaged per listing
+			min_comps: Minimum comps before borrowing from a wider partition
+			same_zip_only: Partition by zip code within each city
+			exclude_statuses: Status values that disqualify a listing as a comp
+			miles_scale: Distance in miles that counts as much as one bedroom
+			sqft_tolerance_pct: Square footage ratio that counts as one unit
+		"""
+		if k < 1 or min_comps < 1:
+			raise ValueError("k and min_comps must be at least 1")
+		n = len(df)
+		self.k = k
+		self.min_comps = min(min_comps, k)
+		self._n = n
+		self._price = df["price"].to_numpy(dtype=float)
+		
+		sqft = df["squareFeet"].to_numpy(dtype=float)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			features = [np.where(sqft > 0, np.log(sqft), np.nan) / math.log(1 + sqft_tolerance_pct)]
+		for column in ("bedrooms", "bathrooms"):
+			if column in df.columns:
+				features.append(df[column].to_numpy(dtype=float))
+		if {"latitude", "longitude"} <= set(df.columns):
+			lat = df["latitude"].to_numpy(dtype=float)
+			lon = df["longitude"].to_numpy(dtype=float)
+			features.append(lat * MILES_PER_DEGREE_LAT / miles_scale)
+			features.append(lon * MILES_PER_DEGREE_LAT * np.cos(np.radians(lat)) / miles_scale)
+		self._features = np.column_stack(features)
+		self._valid = np.isfinite(self._features).all(axis=1)
+		
+		eligible = self._valid & ~np.isnan(self._price)
+		if exclude_statuses and "status" in df.columns:
+			eligible &= ~df["status"].isin(list(exclude_statuses)).to_numpy()
+		self._eligible = eligible
+		self._labels = None if df.index.is_unique else pd.factorize(df.index)[0]
+		
+		# Partition codes per level, narrowest first (-1 = level unusable for the row)
+		location = np.zeros(n, dtype=np.int64)
+		location_columns = [column for column in ("city",) if column in df.columns]
+		if same_zip_only and "zip" in df.columns:
+			location_columns.append("zip")
+		for column in location_columns:
+			codes, n_codes = _category_codes(df[column])
+			location = np.where((location < 0) | (codes < 0), -1, location * n_codes + codes)
+		self._levels = [location]
+		if "state" in df.columns:
+			self._levels.append(_category_codes(df["state"])[0])
+		self._levels.append(np.zeros(n, dtype=np.int64))
+		self._searches: Dict[Tuple[int, int], Tuple[_NeighbourSearch, np.ndarray]] = {}
+	
+	@classmethod
+	def from_tags(cls, df: pd.DataFrame, tags: List[str], config: Optional[Dict[str, Any]] = None) -> "KnnCompsIndex":
+		"""Build the index compute_comps_estimate uses for "knn_comps"."""
+		config = config or {}
+		exclude_statuses = []
+		if "exclude_pending" in tags:
+			exclude_statuses.append("Pending")
+		if "exclude_sold" in tags:
+			exclude_statuses.append("Sold")
+		return cls(
+			df,
+			k=config.get("knn_k", 10),
+			min_comps=config.get("knn_min_comps", 5),
+			same_zip_only="same_zip_only" in tags,
+			exclude_statuses=exclude_statuses,
+			miles_scale=config.get("knn_miles_scale", 1.0),
+		)
+	
+	def _assign_pools(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""Pick each listing's comp pool: (level, code) of the narrowest pool with enough comps."""
+		levels = np.full(len(positions), len(self._levels) - 1, dtype=np.int64)
+		chosen = np.zeros(len(positions), dtype=bool)
+		for level, codes in enumerate(self._levels[:-1]):
+			valid_codes = codes >= 0
+			sizes = np.bincount(codes[self._eligible & valid_codes], minlength=int(codes.max(initial=-1)) + 1)
+			query_codes = codes[positions]
+			available = np.where(query_codes >= 0, sizes[np.maximum(query_codes, 0)], 0)
+			available = available - self._eligible[positions]  # never a comp of itself
+			take = ~chosen & (query_codes >= 0) & (available >= self.min_comps)
+			levels[take] = level
+			chosen |= take
+		codes = np.stack(self._levels)[levels, positions]
+		return levels, codes
+	
+	def _search(self, level: int, code: int) -> Tuple[_NeighbourSearch, np.ndarray]:
+		key = (level, code)
+		if key not in self._searches:
+			members = np.flatnonzero(self._eligible & (self._levels[level] == code))
+			self._searches[key] = (_NeighbourSearch(self._features[members]), members)
+		return self._searches[key]
+	
+	def estimate(self, positions: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+		"""Compute the kNN comps estimate and comp count for listings.
+		
+		Args:
+			positions: Row positions to estimate (default: every row)
+		
+		Returns:
+			Tuple of (comps_estimate, num_comps) arrays aligned with ``positions``.
+			Listings without usable features or comps fall back to their own price.
+		"""
+		if positions is None:
+			positions = np.arange(self._n)
+		positions = np.asarray(positions, dtype=np.int64)
+		estimates = self._price[positions].copy()
+		num_comps = np.zeros(len(positions), dtype=np.int64)
+		
+		slots = np.flatnonzero(self._valid[positions])
+		levels, codes = self._assign_pools(positions[slots])
+		for (level, code), group in pd.Series(np.arange(len(slots))).groupby([levels, codes]):
+			group_slots = slots[group.to_numpy()]
+			queries = positions[group_slots]
+			search, members = self._search(int(level), int(code))
+			if not len(members):
+				continue
+			# One extra neighbour covers the listing itself
+			n_neighbours = min(self.k + 1, len(members))
+			distances, neighbours = search.query(self._features[queries], n_neighbours)
+			neighbours = members[neighbours]
+			if self._labels is None:
+				keep = neighbours != queries[:, None]
+			else:
+				keep = self._labels[neighbours] != self._labels[queries][:, None]
+			# First k kept neighbours of each listing
+			keep &= np.cumsum(keep, axis=1) <= self.k
+			weights = np.where(keep, 1.0 / (1.0 + distances), 0.0)
+			counts = keep.sum(axis=1)
+			total = weights.sum(axis=1)
+			matched = counts > 0
+			weighted = (weights * np.where(keep, self._price[neighbours], 0.0)).sum(axis=1)
+			estimates[group_slots[matched]] = weighted[matched] / total[matched]
+			num_comps[group_slots] = counts
+		return estimates, num_comps
+	
+	def estimate_upper_bounds(self, positions: Optional[np.ndarray] = None) -> np.ndarray:
+		"""Upper bound on estimate(): a weighted mean never exceeds its pool's highest price."""
+		if positions is None:
+			positions = np.arange(self._n)
+		positions = np.asarray(positions, dtype=np.int64)
+		bounds = np.full(len(positions), -np.inf)
+		slots = np.flatnonzero(self._valid[positions])
+		levels, codes = self._assign_pools(positions[slots])
+		for level in np.unique(levels):
+			level_codes = self._levels[level]
+			pool = self._eligible & (level_codes >= 0)
+			highest = np.full(int(level_codes.max(initial=-1)) + 1, -np.inf)
+			np.maximum.at(highest, level_codes[pool], self._price[pool])
+			at = levels == level
+			bounds[slots[at]] = highest[codes[at]]
+		return np.fmax(self._price[positions], bounds)
+
+
+def _comps_index_for(df: pd.DataFrame, tags: List[str], config: Optional[Dict[str, Any]] = None) -> Any:
+	"""Comps index for ``tags``: KnnCompsIndex with "knn_comps", else CompsIndex."""
+	if "knn_comps" in tags:
+		return KnnCompsIndex.from_tags(df, tags, config)
+	return CompsIndex.from_tags(df, tags)
+
+
+def normalize_listing_schema(df: pd.DataFrame, arrow_strings: bool = False) -> pd.DataFrame:
+	"""Return a compact copy of a listing frame that the compute methods run on directly.
+	
+	Location and status columns become categoricals (group-bys and comps
+	partitions then work on their integer codes). Integer-valued numeric
+	columns are downcast to int32; columns with missing or fractional values
+	keep float64, so every computed column is identical to the uncompacted
+	result.
+	
+	Args:
+		df: DataFrame with property listings
+		arrow_strings: Store the remaining text columns (addresses, URLs, ...)
+			as pyarrow-backed strings instead of Python objects; requires pyarrow
+		
+	Returns:
+		New DataFrame with the same index, columns and values
+	"""
+	if arrow_strings and pa is None:
+		raise ImportError("arrow_strings=True requires pyarrow")
+	compact = {}
+	for column in df.columns:
+		values = df[column]
+		if column in CATEGORICAL_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+			values = values.astype("category")
+		elif pd.api.types.is_bool_dtype(values.dtype):
+			pass
+		elif pd.api.types.is_numeric_dtype(values.dtype) and isinstance(values.dtype, np.dtype):
+			data = values.to_numpy()
+			if data.dtype.kind == "f" and len(data) and np.isfinite(data).all() and (data == np.round(data)).all():
+				data = data.astype(np.int64)
+			# int32 rather than narrower types: room counts are multiplied by config costs
+			int32 = np.iinfo(np.int32)
+			if data.dtype.kind in "iu" and data.dtype.itemsize > 4 and len(data) and data.min() >= int32.min and data.max() <= int32.max:
+				data = data.astype(np.int32)
+			values = pd.Series(data, index=df.index, name=column)
+		elif arrow_strings and values.dtype == object:
+			values = values.astype(pd.ArrowDtype(pa.string()))
+		compact[column] = values
+	return pd.DataFrame(compact, index=df.index, columns=df.columns)
+
+
+def _category_codes(values: pd.Series) -> Tuple[np.ndarray, int]:
+	"""Integer codes (-1 = missing) and category count, reusing categorical codes when present."""
+	if isinstance(values.dtype, pd.CategoricalDtype):
+		return values.cat.codes.to_numpy(dtype=np.int64), len(values.cat.categories)
+	codes, uniques = pd.factorize(values)
+	return codes, len(uniques)
+
+
+def _map_location_values(cities: Any, states: Any, values: pd.Series, fallback: float) -> np.ndarray:
+	"""Vectorized lookup of per-(city, state) ``values``; ``fallback`` where a location has none."""
+	result = np.full(len(cities), fallback, dtype=float)
+	if len(values):
+		positions = values.index.get_indexer(pd.MultiIndex.from_arrays([cities, states]))
+		found = positions >= 0
+		result[found] = values.to_numpy(dtype=float)[positions[found]]
+	return result
+
+
+class LocationQuantileSketch:
+	"""Mergeable per-(city, state) quantile sketches with bounded relative error.
+	
+	Values are counted in logarithmic buckets (DDSketch-style), so any
+	quantile comes back within ``relative_accuracy`` of the true order
+	statistic. Sketches built on different shards or days merge by adding
+	bucket counts, and the whole state is one count table that serializes
+	to JSON.
+	"""
+	
+	# Separates positive buckets (above), zero (0) and negative buckets (below)
+	_BUCKET_OFFSET = 2 ** 40
+	
+	def __init__(self, relative_accuracy: float = 0.01, counts: Optional[pd.Series] = None):
+		"""
+		Args:
+			relative_accuracy: Maximum relative error of returned quantiles
+			counts: Bucket counts indexed by (city, state, bucket); empty by default
+		"""
+		if not 0 < relative_accuracy < 1:
+			raise ValueError(f"relative_accuracy must be in (0, 1), got {relative_accuracy}")
+		self.relative_accuracy = relative_accuracy
+		self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+		self._log_gamma = math.log(self._gamma)
+		if counts is None:
+			counts = pd.Series(
+				np.empty(0, dtype=np.int64),
+				index=pd.MultiIndex.from_arrays([[], [], []], names=["city", "state", "bucket"]),
+			)
+		self.counts = counts
+	
+	@classmethod
+	def from_values(cls, cities: Any, states: Any, values: Any, relative_accuracy: float = 0.01) -> "LocationQuantileSketch":
+		"""Build a sketch from aligned city, state and value arrays."""
+		sketch = cls(relative_accuracy)
+		sketch.update(cities, states, values)
+		return sketch
+	
+	def _buckets(self, values: np.ndarray) -> np.ndarray:
+		buckets = np.zeros(len(values), dtype=np.int64)
+		positive = values > 0
+		negative = values < 0
+		buckets[positive] = self._BUCKET_OFFSET + np.ceil(np.log(values[positive]) / self._log_gamma).astype(np.int64)
+		buckets[negative] = -(self._BUCKET_OFFSET + np.ceil(np.log(-values[negative]) / self._log_gamma).astype(np.int64))
+		return buckets
+	
+	def _bucket_values(self, buckets: np.ndarray) -> np.ndarray:
+		# Midpoint (in relative terms) of (gamma**(k-1), gamma**k]
+		magnitude = np.abs(buckets) - self._BUCKET_OFFSET
+		values = 2 * np.power(self._gamma, magnitude.astype(float)) / (self._gamma + 1)
+		return np.where(buckets == 0, 0.0, np.sign(buckets) * values)
+	
+	def update(self, cities: Any, states: Any, values: Any) -> None:
+		"""Add values (NaN/infinite values and missing locations are ignored)."""
+		cities = np.asarray(cities, dtype=object)
+		states = np.asarray(states, dtype=object)
+		values = np.asarray(values, dtype=float)
+		keep = np.isfinite(values) & ~pd.isna(cities) & ~pd.isna(states)
+		added = pd.DataFrame({
+			"city": cities[keep],
+			"state": states[keep],
+			"bucket": self._buckets(values[keep]),
+		}).groupby(["city", "state", "bucket"]).size()
+		self.counts = self._combine([self.counts, added])
+	
+	@staticmethod
+	def _combine(counts: List[pd.Series]) -> pd.Series:
+		counts = [part for part in counts if len(part)]
+		if not counts:
+			return LocationQuantileSketch().counts
+		return pd.concat(counts).groupby(level=["city", "state", "bucket"]).sum().astype(np.int64)
+	
+	def merge(self, *others: "LocationQuantileSketch") -> "LocationQuantileSketch":
+		"""Return a sketch of the union of this sketch's data and ``others``'."""
+		for other in others:
+			if other.relative_accuracy != self.relative_accuracy:
+				raise ValueError("Cannot merge sketches with different relative_accuracy")
+		counts = self._combine([self.counts] + [other.counts for other in others])
+		return LocationQuantileSketch(self.relative_accuracy, counts)
+	
+	def _rank_values(self, counts: pd.Series, levels: List[str], q: float) -> pd.Series:
+		counts = counts.sort_index()
+		groups = counts.groupby(level=levels, sort=False)
+		cumulative = groups.cumsum()
+		target = np.floor(q * (groups.transform("sum") - 1))
+		reached = counts[cumulative > target]
+		first = reached.groupby(level=levels, sort=False).head(1)
+		buckets = first.index.get_level_values("bucket").to_numpy(dtype=np.int64)
+		return pd.Series(self._bucket_values(buckets), index=first.index.droplevel("bucket"))
+	
+	def quantiles(self, q: float = 0.5) -> pd.Series:
+		"""Quantile ``q`` per location, as a Series indexed by (city, state)."""
+		if not len(self.counts):
+			return pd.Series(np.empty(0), index=pd.MultiIndex.from_arrays([[], []], names=["city", "state"]))
+		return self._rank_values(self.counts, ["city", "state"], q)
+	
+	def medians(self) -> pd.Series:
+		"""Median per location, as a Series indexed by (city, state).
+		
+		For an even count this approximates the lower middle value, where the
+		exact path averages the two middle values.
+		"""
+		return self.quantiles(0.5)
+	
+	def overall_quantile(self, q: float = 0.5) -> float:
+		"""Quantile ``q`` over every location combined."""
+		if not len(self.counts):
+			return float("nan")
+		counts = self.counts.groupby(level="bucket").sum()
+		counts.index = pd.MultiIndex.from_arrays(
+			[np.zeros(len(counts), dtype=np.int64), counts.index], names=["all", "bucket"],
+		)
+		return float(self._rank_values(counts, ["all"], q).iloc[0])
+	
+	def to_dict(self) -> Dict[str, Any]:
+		"""JSON-serializable state."""
+		return {
+			"relative_accuracy": self.relative_accuracy,
+			"counts": [
+				[city, state, int(bucket), int(count)]
+				for (city, state, bucket), count in self.counts.items()
+			],
+		}
+	
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "LocationQuantileSketch":
+		"""Rebuild a sketch saved with to_dict."""
+		rows = data["counts"]
+		if not rows:
+			return cls(data["relative_accuracy"])
+		cities, states, buckets, counts = zip(*rows)
+		index = pd.MultiIndex.from_arrays(
+			[list(cities), list(states), np.asarray(buckets, dtype=np.int64)], names=["city", "state", "bucket"],
+		)
+		return cls(data["relative_accuracy"], pd.Series(np.asarray(counts, dtype=np.int64), index=index))
+
+
+# A step record sink: any callable taking the record dict emitted per step
+StepSink = Callable[[Dict[str, Any]], None]
+
+
+class InstrumentationReport:
+	"""In-memory sink collecting one record per analysis step.
+	
+	Records hold step, wall_seconds, cpu_seconds, rows_in, rows_out and
+	cached, plus peak_bytes/retained_bytes/frame_bytes when memory is tracked.
+	"""
+	
+	def __init__(self):
+		self.records: List[Dict[str, Any]] = []
+	
+	def __call__(self, record: Dict[str, Any]) -> None:
+		self.records.append(record)
+	
+	def __deepcopy__(self, memo: Dict[int, Any]) -> "InstrumentationReport":
+		# pandas deep-copies attrs on every derived frame; records are never mutated
+		report = InstrumentationReport()
+		report.records = list(self.records)
+		return report
+	
+	@property
+	def total_wall_seconds(self) -> float:
+		return sum(record["wall_seconds"] for record in self.records)
+	
+	def to_frame(self) -> pd.DataFrame:
+		"""Records as a DataFrame, one row per step."""
+		return pd.DataFrame(self.records)
+	
+	def to_jsonl(self, path: str) -> None:
+		"""Append the records to a JSON lines file."""
+		with open(path, "a") as f:
+			for record in self.records:
+				f.write(json.dumps(record) + "\n")
+
+
+class LoggingSink:
+	"""Sink logging one line per step."""
+	
+	def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+		self.logger = logger or logging.getLogger("fixandflip")
+		self.level = level
+	
+	def __call__(self, record: Dict[str, Any]) -> None:
+		details = " ".join(f"{key}={value}" for key, value in record.items() if key != "step")
+		self.logger.log(self.level, "step %s %s", record["step"], details)
+
+
+class JsonLinesSink:
+	"""Sink appending each step record to a JSON lines file as it finishes."""
+	
+	def __init__(self, path: str, **fields: Any):
+		"""
+		Args:
+			path: File to append to
+			**fields: Extra fields written on every line (e.g. run_id="nightly-2024-06-01")
+		"""
+		self.path = path
+		self.fields = fields
+	
+	def __call__(self, record: Dict[str, Any]) -> None:
+		with open(self.path, "a") as f:
+			f.write(json.dumps({**self.fields, **record}) + "\n")
 
 
 class FixAndFlipProfile:
 	"""Profile class for fix-and-flip property analysis with tag-driven methods."""
 	
-	def __init__(self, property_df: pd.DataFrame, config: Optional[Dict[str, Any]] = None):
+	def __init__(
+		self,
+		property_df: pd.DataFrame,
+		config: Optional[Dict[str, Any]] = None,
+		copy_free: bool = False,
+		track_memory: bool = False,
+		compact_schema: bool = False,
+		sinks: Sequence[StepSink] = (),
+	):
 		"""Initialize the profile with property data and optional configuration.
 		
 		Args:
@@ -15,11 +1041,100 @@ class FixAndFlipProfile:
 				- realtor_commission: commission rate (default 0.03 for 3%)
 				- arp_weight_ppsf: weight for PPSF in ARP calculation
 				- arp_weight_comps: weight for comps in ARP calculation
+			copy_free: Attach each step's new columns to one shared frame instead
+				of copying the whole frame per step. The input's existing column
+				data is shared, not duplicated.
+			track_memory: Record peak traced memory for each step in memory_report
+			compact_schema: Run on normalize_listing_schema(property_df)
+				(categorical locations/status, int32 numerics) instead of a copy
+			sinks: Callables receiving a timing record for each step (see
+				InstrumentationReport, LoggingSink, JsonLinesSink)
 		"""
-		self.property_df = property_df.copy()
+		self.copy_free = copy_free
+		if compact_schema:
+			# normalize_listing_schema already builds a new frame
+			self.property_df = normalize_listing_schema(property_df)
+		else:
+			self.property_df = property_df.copy(deep=not copy_free)
 		self.config = config or {}
 		# Store computed results as we add columns
 		self._results = {}
+		self.track_memory = track_memory
+		self.memory_report: List[Dict[str, Any]] = []
+		self.sinks = list(sinks)
+		# Overall PPSF median used for listings whose location has no median (and
+		# for every listing, over the non-excluded ones, without city/state
+		# columns), and precomputed {(city, state): median PPSF}; set these when
+		# property_df is only a subset of a larger dataset
+		self.ppsf_fallback_median: Optional[float] = None
+		self.location_ppsf_medians: Optional[Dict[Tuple[Any, Any], float]] = None
+		# Approximate per-location PPSF distributions; when set (e.g. merged from
+		# shards), medians come from it instead of an exact group-by
+		self.ppsf_sketch: Optional[LocationQuantileSketch] = None
+	
+	def _working_frame(self) -> pd.DataFrame:
+		"""Return the frame a compute step adds its columns to."""
+		if self.copy_free:
+			return self.property_df
+		return self.property_df.copy()
+	
+	@contextmanager
+	def measure_step(self, step: str) -> Iterator[Optional[Dict[str, Any]]]:
+		"""Record wall/CPU time, row counts and (optionally) memory for ``step``.
+		
+		The record is yielded so callers can annotate it (e.g. cached=True),
+		then sent to every sink; with track_memory it also gets peak_bytes,
+		retained_bytes and frame_bytes and is appended to memory_report. Yields
+		None and does nothing when there are no sinks and memory isn't tracked.
+		"""
+		if not self.track_memory and not self.sinks:
+			yield None
+			return
+		record: Dict[str, Any] = {"step": step, "rows_in": len(self.property_df), "cached": False}
+		started = False
+		if self.track_memory:
+			started = not tracemalloc.is_tracing()
+			if started:
+				tracemalloc.start()
+			tracemalloc.reset_peak()
+			baseline, _ = tracemalloc.get_traced_memory()
+		wall_start = time.perf_counter()
+		cpu_start = time.process_time()
+		try:
+			yield record
+		finally:
+			record["wall_seconds"] = time.perf_counter() - wall_start
+			record["cpu_seconds"] = time.process_time() - cpu_start
+			record["rows_out"] = len(self.property_df)
+			if self.track_memory:
+				current, peak = tracemalloc.get_traced_memory()
+				if started:
+					tracemalloc.stop()
+				record["peak_bytes"] = peak - baseline
+				record["retained_bytes"] = current - baseline
+				record["frame_bytes"] = int(self.property_df.memory_usage(index=True, deep=False).sum())
+				self.memory_report.append(record)
+			for sink in self.sinks:
+				sink(record)
+	
+	def execute(
+		self,
+		plan: "CompiledPlan",
+		cache: Optional["AnalysisCache"] = None,
+		fingerprint: Optional[str] = None,
+	) -> pd.DataFrame:
+		"""Run a compiled plan on this profile, using the plan's resolved config.
+		
+		Args:
+			plan: Plan from compile_plan
+			cache: Optional AnalysisCache for step outputs
+			fingerprint: Precomputed fingerprint of the input frame
+			
+		Returns:
+			DataFrame with the plan's columns added
+		"""
+		self.config = plan.config_dict
+		return plan.plan.execute(self, list(plan.tags), cache=cache, fingerprint=fingerprint)
 	
 	def compute_70_percent_method(self, tags: List[str]) -> pd.DataFrame:
 		"""Compute maximum offer using 70% rule: (ARP * 0.70) - renovation_cost.
@@ -32,14 +1147,15 @@ class FixAndFlipProfile:
 		Returns:
 			DataFrame with added columns: max_offer_70_percent, adjusted_asking_price
 		"""
-		df = self.property_df.copy()
+		df = self._working_frame()
 		
-		# Ensure required columns exist (ARP and renovation_cost should be computed first)
+		# Ensure ARP is computed
 		if "arp" not in df.columns:
-			# If ARP not computed yet, use price as placeholder (should call compute_arp first)
-			df["arp"] = df.get("price", 0)
+			df = self.compute_arp(tags)
+		
+		# Ensure renovation cost is computed
 		if "renovation_cost" not in df.columns:
-			df["renovation_cost"] = 0
+			df = self.compute_renovation_cost(tags)
 		
 		# Check for buying_from_realtor sub-tag
 		if "buying_from_realtor" in tags:
@@ -64,6 +1180,8 @@ class FixAndFlipProfile:
 		"""Compute price-per-square-foot estimates by city/state.
 		
 		Calculates median PPSF by location and estimates value based on square footage.
+		With the "approximate_ppsf" tag (or a ppsf_sketch set on the profile), the
+		medians come from a LocationQuantileSketch instead of an exact group-by.
 		
 		Args:
 			tags: List of tags that may include modifiers like "exclude_pending"
@@ -71,29 +1189,45 @@ class FixAndFlipProfile:
 		Returns:
 			DataFrame with added columns: ppsf, median_ppsf_by_location, ppsf_estimate
 		"""
-		df = self.property_df.copy()
+		df = self._working_frame()
 		
 		# Calculate PPSF for each property
 		df["ppsf"] = df["price"] / df["squareFeet"].replace(0, 1)  # Avoid division by zero
 		
-		# Filter out pending/sold if tag is present
-		filter_df = df.copy()
+		# Filter out pending/sold if tag is present (a row mask, so the frame isn't copied)
+		include = pd.Series(True, index=df.index)
 		if "exclude_pending" in tags:
-			filter_df = filter_df[filter_df.get("status", "") != "Pending"]
+			include &= df.get("status", "") != "Pending"
 		if "exclude_sold" in tags:
-			filter_df = filter_df[filter_df.get("status", "") != "Sold"]
+			include &= df.get("status", "") != "Sold"
+		filtered_ppsf = df["ppsf"][include]
 		
 		# Group by city and state to compute median PPSF
 		if "city" in df.columns and "state" in df.columns:
-			median_ppsf = filter_df.groupby(["city", "state"])["ppsf"].median().to_dict()
-			# Map median PPSF to each property
-			df["median_ppsf_by_location"] = df.apply(
-				lambda row: median_ppsf.get((row["city"], row["state"]), df["ppsf"].median()),
-				axis=1
-			)
+			if self.location_ppsf_medians is not None:
+				median_ppsf = pd.Series(self.location_ppsf_medians, dtype=float)
+			elif self.ppsf_sketch is not None or "approximate_ppsf" in tags:
+				# Approximate medians from a mergeable sketch (built here unless supplied)
+				if self.ppsf_sketch is None:
+					self.ppsf_sketch = LocationQuantileSketch.from_values(
+						df["city"][include], df["state"][include], filtered_ppsf,
+						relative_accuracy=self.config.get("ppsf_sketch_accuracy", 0.01),
+					)
+				median_ppsf = self.ppsf_sketch.medians()
+			else:
+				median_ppsf = filtered_ppsf.groupby([df["city"][include], df["state"][include]], observed=True).median()
+			# Locations without a median fall back to the overall PPSF median
+			fallback = self.ppsf_fallback_median
+			if fallback is None:
+				fallback = df["ppsf"].median()
+			# Map median PPSF to each property (a vectorized join on city/state)
+			df["median_ppsf_by_location"] = _map_location_values(df["city"], df["state"], median_ppsf, fallback)
 		else:
 			# Fallback to overall median
-			df["median_ppsf_by_location"] = filter_df["ppsf"].median()
+			fallback = self.ppsf_fallback_median
+			if fallback is None:
+				fallback = filtered_ppsf.median()
+			df["median_ppsf_by_location"] = fallback
 		
 		# Estimate value based on square footage and median PPSF
 		df["ppsf_estimate"] = df["squareFeet"] * df["median_ppsf_by_location"]
@@ -106,69 +1240,22 @@ class FixAndFlipProfile:
 		"""Compute comparable sales estimates using similar properties.
 		
 		Filters comparable properties by city, similar square footage, bedrooms, bathrooms.
+		With a "radius_miles:X" tag and latitude/longitude columns, comps are matched
+		within X miles (haversine) instead of by city. With "knn_comps", each
+		listing gets a distance-weighted estimate from its nearest neighbours
+		instead (see KnnCompsIndex; config knn_k, knn_min_comps, knn_miles_scale).
 		
 		Args:
-			tags: List of tags that may include "same_zip_only" or "radius_miles:X"
+			tags: List of tags that may include "same_zip_only", "radius_miles:X" or "knn_comps"
 			
 		Returns:
 			DataFrame with added columns: comps_estimate, num_comps, comp_median_price
 		"""
-		df = self.property_df.copy()
-		
-		# Tolerance parameters
-		sqft_tolerance_pct = 0.20  # ±20% square footage
-		bed_tolerance = 1  # ±1 bedroom
-		bath_tolerance = 1  # ±1 bathroom
+		df = self._working_frame()
 		
-		comps_estimates = []
-		num_comps_list = []
-		
-		for idx, row in df.iterrows():
-			# Filter comparable properties (exclude current property)
-			comps = df[df.index != idx].copy()
-			
-			# Filter by city if available
-			if "city" in df.columns:
-				comps = comps[comps["city"] == row["city"]]
-			
-			# Filter by zip if tag is present
-			if "same_zip_only" in tags and "zip" in df.columns:
-				comps = comps[comps["zip"] == row["zip"]]
-			
-			# Filter by similar square footage (±20%)
-			sqft_min = row["squareFeet"] * (1 - sqft_tolerance_pct)
-			sqft_max = row["squareFeet"] * (1 + sqft_tolerance_pct)
-			comps = comps[(comps["squareFeet"] >= sqft_min) & (comps["squareFeet"] <= sqft_max)]
-			
-			# Filter by similar bedrooms (±1)
-			if "bedrooms" in df.columns:
-				bed_min = max(0, row["bedrooms"] - bed_tolerance)
-				bed_max = row["bedrooms"] + bed_tolerance
-				comps = comps[(comps["bedrooms"] >= bed_min) & (comps["bedrooms"] <= bed_max)]
-			
-			# Filter by similar bathrooms (±1)
-			if "bathrooms" in df.columns:
-				bath_min = max(0, row["bathrooms"] - bath_tolerance)
-				bath_max = row["bathrooms"] + bath_tolerance
-				comps = comps[(comps["bathrooms"] >= bath_min) & (comps["bathrooms"] <= bath_max)]
-			
-			# Exclude pending/sold if tag present
-			if "exclude_pending" in tags and "status" in comps.columns:
-				comps = comps[comps["status"] != "Pending"]
-			if "exclude_sold" in tags and "status" in comps.columns:
-				comps = comps[comps["status"] != "Sold"]
-			
-			# Calculate estimate from comps (median price of comparable properties)
-			if len(comps) > 0:
-				comps_estimate = comps["price"].median()
-				num_comps = len(comps)
-			else:
-				# Fallback to property's own price if no comps found
-				comps_estimate = row["price"]
-				num_comps = 0
-			
-			comps_estimates.append(comps_estimate)
-			num_comps_list.append(num_comps)
+		# Partition/sort the listings once, then range-query every property's comps
+		comps_index = _comps_index_for(df, tags, self.config)
+		comps_estimates, num_comps_list = comps_index.estimate()
 		
 		df["comps_estimate"] = comps_estimates
 		df["num_comps"] = num_comps_list
@@ -187,7 +1274,7 @@ class FixAndFlipProfile:
 		Returns:
 			DataFrame with added column: arp
 		"""
-		df = self.property_df.copy()
+		df = self._working_frame()
 		
 		# Ensure PPSF and comps estimates exist (compute if needed)
 		if "ppsf_estimate" not in df.columns:
@@ -224,16 +1311,16 @@ class FixAndFlipProfile:
 		Returns:
 			DataFrame with added columns: renovation_cost, renovation_cost_per_sqft
 		"""
-		df = self.property_df.copy()
+		df = self._working_frame()
 		
 		# Base cost per square foot (typical renovation range: $20-75/sqft)
-		base_cost_per_sqft = 50.0  # Default moderate renovation
+		base_cost_per_sqft = RENOVATION_COST_PER_SQFT["moderate"]  # Default moderate renovation
 		
 		# Adjust based on tags
 		if "high_end_renovation" in tags:
-			base_cost_per_sqft = 100.0  # Luxury renovation
+			base_cost_per_sqft = RENOVATION_COST_PER_SQFT["high_end"]  # Luxury renovation
 		elif "basic_renovation" in tags:
-			base_cost_per_sqft = 25.0  # Minimal updates
+			base_cost_per_sqft = RENOVATION_COST_PER_SQFT["basic"]  # Minimal updates
 		
 		# Calculate base renovation cost
 		df["renovation_cost_per_sqft"] = base_cost_per_sqft
@@ -276,7 +1363,7 @@ class FixAndFlipProfile:
 		Returns:
 			DataFrame with added columns: roi, total_investment, profit, roi_percentage
 		"""
-		df = self.property_df.copy()
+		df = self._working_frame()
 		
 		# Ensure ARP is computed
 		if "arp" not in df.columns:
@@ -313,80 +1400,2039 @@ class FixAndFlipProfile:
 		return df
 
 
+@dataclass(frozen=True)
+class AnalysisStep:
+	"""One column producer in the fix-and-flip analysis graph."""
+	name: str
+	method: str
+	produces: Tuple[str, ...]
+	requires: Tuple[str, ...] = ()
+	# Steps that must run first when they are part of the plan, without being pulled in
+	runs_after: Tuple[str, ...] = ()
+	# Modifier tags (a trailing ":" matches a prefix) and config keys the step reads
+	modifier_tags: Tuple[str, ...] = ()
+	config_keys: Tuple[str, ...] = ()
+	
+	def relevant_tags(self, tags: List[str]) -> Tuple[str, ...]:
+		"""Return the sorted subset of ``tags`` that can change this step's output."""
+		return tuple(sorted({
+			tag for tag in tags
+			for modifier in self.modifier_tags
+			if tag == modifier or (modifier.endswith(":") and tag.startswith(modifier))
+		}))
+	
+	def relevant_config(self, config: Dict[str, Any]) -> Tuple[Tuple[str, Any], ...]:
+		"""Return the (key, value) config pairs this step reads, sorted by key."""
+		return tuple(sorted((key, config[key]) for key in self.config_keys if key in config))
+
+
+ANALYSIS_STEPS: Tuple[AnalysisStep, ...] = (
+	AnalysisStep(
+		name="ppsf",
+		method="compute_ppsf_estimate",
+		produces=("ppsf", "median_ppsf_by_location", "ppsf_estimate"),
+		modifier_tags=("exclude_pending", "exclude_sold", "approximate_ppsf"),
+		config_keys=("ppsf_sketch_accuracy",),
+	),
+	AnalysisStep(
+		name="comps",
+		method="compute_comps_estimate",
+		produces=("comps_estimate", "num_comps", "comp_median_price"),
+		modifier_tags=("same_zip_only", "exclude_pending", "exclude_sold", "radius_miles:", "knn_comps"),
+		config_keys=("knn_k", "knn_min_comps", "knn_miles_scale"),
+	),
+	AnalysisStep(
+		name="arp",
+		method="compute_arp",
+		produces=("arp",),
+		requires=("ppsf_estimate", "comps_estimate"),
+		config_keys=("arp_weight_ppsf", "arp_weight_comps"),
+	),
+	AnalysisStep(
+		name="renovation",
+		method="compute_renovation_cost",
+		produces=("renovation_cost", "renovation_cost_per_sqft", "permit_cost"),
+		modifier_tags=("high_end_renovation", "basic_renovation", "include_permit_costs", "itemize_room_costs"),
+		config_keys=("permit_cost_base", "permit_cost_per_sqft", "bedroom_renovation_cost", "bathroom_renovation_cost"),
+	),
+	AnalysisStep(
+		name="70_percent",
+		method="compute_70_percent_method",
+		produces=("adjusted_asking_price", "realtor_commission_cost", "max_offer_70_percent", "profit_potential_70_percent"),
+		requires=("arp", "renovation_cost"),
+		modifier_tags=("buying_from_realtor",),
+		config_keys=("realtor_commission",),
+	),
+	AnalysisStep(
+		name="roi",
+		method="compute_roi",
+		produces=("closing_costs", "holding_costs", "other_costs", "total_investment", "profit", "roi", "roi_percentage"),
+		requires=("arp", "renovation_cost"),
+		# ROI uses the commission-adjusted price when the 70% step computes it
+		runs_after=("70_percent",),
+		config_keys=("closing_cost_rate", "holding_cost_months", "monthly_holding_cost"),
+	),
+)
+
+# Tags that request a step's output
+TAG_TARGETS: Dict[str, Tuple[str, ...]] = {
+	"ppsf_analysis": ("ppsf",),
+	"price_per_sqft": ("ppsf",),
+	"comp_analysis": ("comps",),
+	"comps": ("comps",),
+	"arp_estimate": ("arp",),
+	"arp": ("arp",),
+	"renovation_cost": ("renovation",),
+	"repairing_properties": ("renovation",),
+	"70_percent_method": ("70_percent",),
+	"roi_calc": ("roi",),
+	"roi": ("roi",),
+}
+
+
+class AnalysisPlan:
+	"""Dependency-ordered set of analysis steps for a tag list.
+	
+	Requested steps pull in the producers of the columns they consume (unless
+	those columns are already present in the input), every producer appears
+	once, and steps run in topological order.
+	"""
+	
+	def __init__(self, steps: List[AnalysisStep], reasons: Dict[str, List[str]]):
+		self.steps = steps
+		self._reasons = reasons
+	
+	@classmethod
+	def from_tags(cls, tags: List[str], available_columns: Sequence[str] = ()) -> "AnalysisPlan":
+		"""Build the plan for ``tags``.
+		
+		Args:
+			tags: Analysis tags like ["arp_estimate", "roi_calc"]
+			available_columns: Columns the input frame already has; dependencies
+				on these are treated as satisfied
+			
+		Returns:
+			AnalysisPlan with its steps in execution order
+		"""
+		by_name = {step.name: step for step in ANALYSIS_STEPS}
+		producer_of = {column: step.name for step in ANALYSIS_STEPS for column in step.produces}
+		available = set(available_columns)
+		
+		reasons: Dict[str, List[str]] = {}
+		pending: List[str] = []
+		for tag in tags:
+			for name in TAG_TARGETS.get(tag, ()):
+				reasons.setdefault(name, []).append(f"tag {tag!r}")
+				pending.append(name)
+		
+		# Pull in producers of missing inputs (depth-first over the requires edges)
+		while pending:
+			step = by_name[pending.pop()]
+			for column in step.requires:
+				if column in available:
+					continue
+				producer = producer_of[column]
+				if producer not in reasons:
+					pending.append(producer)
+				reasons.setdefault(producer, [])
+				reason = f"{step.name} needs {column!r}"
+				if reason not in reasons[producer]:
+					reasons[producer].append(reason)
+		
+		# Kahn's algorithm; ties keep the ANALYSIS_STEPS order so plans are stable
+		selected = [step for step in ANALYSIS_STEPS if step.name in reasons]
+		depends_on = {
+			step.name: {
+				producer_of[column] for column in step.requires
+				if column not in available
+			} | {name for name in step.runs_after if name in reasons}
+			for step in selected
+		}
+		ordered: List[AnalysisStep] = []
+		done = set()
+		while len(ordered) < len(selected):
+			ready = [step for step in selected if step.name not in done and depends_on[step.name] <= done]
+			if not ready:
+				raise ValueError("Analysis steps have a dependency cycle")
+			ordered.append(ready[0])
+			done.add(ready[0].name)
+		return cls(ordered, reasons)
+	
+	def explain(self) -> str:
+		"""Describe which steps will run, in order, and why."""
+		if not self.steps:
+			return "No analysis steps requested."
+		lines = []
+		for i, step in enumerate(self.steps, 1):
+			why = "; ".join(self._reasons[step.name])
+			lines.append(f"{i}. {step.name} ({step.method}) -> {', '.join(step.produces)} [{why}]")
+		return "\n".join(lines)
+	
+	def execute(
+		self,
+		profile: "FixAndFlipProfile",
+		tags: List[str],
+		cache: Optional["AnalysisCache"] = None,
+		fingerprint: Optional[str] = None,
+	) -> pd.DataFrame:
+		"""Run each planned step once on ``profile`` and return its final frame.
+		
+		With a cache, each step's output columns are looked up by the input
+		fingerprint plus the tags/config read by the steps run so far, and
+		computed (then stored) only on a miss.
+		"""
+		if cache is not None and fingerprint is None:
+			fingerprint = fingerprint_frame(profile.property_df)
+		for i, step in enumerate(self.steps):
+			with profile.measure_step(step.name) as record:
+				if cache is None:
+					profile.property_df = getattr(profile, step.method)(tags)
+					continue
+				key = AnalysisCache.step_key(fingerprint, self.steps[:i + 1], tags, profile.config)
+				cached = cache.get(key)
+				if cached is not None:
+					if record is not None:
+						record["cached"] = True
+					df = profile._working_frame()
+					for column in cached.columns:
+						df[column] = cached[column].to_numpy()
+					profile.property_df = df
+					continue
+				before = set(profile.property_df.columns)
+				df = getattr(profile, step.method)(tags)
+				produced = [column for column in df.columns if column not in before or column in step.produces]
+				cache.put(key, df[produced])
+				profile.property_df = df
+		return profile.property_df
+
+
+# Default of every config key the analysis steps read
+CONFIG_DEFAULTS: Dict[str, Any] = {
+	"ppsf_sketch_accuracy": 0.01,
+	"knn_k": 10,
+	"knn_min_comps": 5,
+	"knn_miles_scale": 1.0,
+	"arp_weight_ppsf": 0.5,
+	"arp_weight_comps": 0.5,
+	"permit_cost_base": 5000,
+	"permit_cost_per_sqft": 2.0,
+	"bedroom_renovation_cost": 5000,
+	"bathroom_renovation_cost": 10000,
+	"realtor_commission": 0.03,
+	"closing_cost_rate": 0.03,
+	"holding_cost_months": 6,
+	"monthly_holding_cost": 1000,
+}
+
+# Tags older callers pass that select nothing on their own ("renovation"
+# used to gate the repair steps alongside "repairing_properties")
+LEGACY_TAGS = frozenset({"renovation"})
+
+# Every tag a plan accepts; "radius_miles:X" is validated separately
+KNOWN_TAGS = frozenset(TAG_TARGETS) | LEGACY_TAGS | frozenset(
+	modifier for step in ANALYSIS_STEPS for modifier in step.modifier_tags if not modifier.endswith(":")
+)
+
+
+@dataclass(frozen=True)
+class CompiledPlan:
+	"""Validated, immutable analysis plan for one tag set and config.
+	
+	Built by compile_plan. Tags are deduplicated and sorted, and config holds
+	every known key with defaults filled in, so equal requests compile to
+	equal (and equally hashed) plans that can key caches or be shared across
+	requests. Run it with FixAndFlipProfile.execute or pass it as the tags
+	of run_fix_and_flip_analysis.
+	"""
+	tags: Tuple[str, ...]
+	config: Tuple[Tuple[str, Any], ...]
+	steps: Tuple[AnalysisStep, ...]
+	available_columns: Tuple[str, ...]
+	plan: "AnalysisPlan" = field(compare=False, repr=False)
+	
+	@property
+	def config_dict(self) -> Dict[str, Any]:
+		return dict(self.config)
+	
+	def explain(self) -> str:
+		"""Describe which steps will run, in order, and why."""
+		return self.plan.explain()
+
+
+def _validate_tags(tags: Sequence[str]) -> None:
+	unknown = []
+	for tag in tags:
+		if tag.startswith("radius_miles:"):
+			_parse_radius_miles([tag])
+		elif tag not in KNOWN_TAGS:
+			unknown.append(tag)
+	if unknown:
+		hints = []
+		for tag in unknown:
+			close = difflib.get_close_matches(tag, KNOWN_TAGS, n=1)
+			hints.append(f"{tag!r}" + (f" (did you mean {close[0]!r}?)" if close else ""))
+		raise ValueError(f"Unknown analysis tags: {', '.join(hints)}")
+
+
+def _validate_config(config: Dict[str, Any], strict: bool = True) -> Dict[str, Any]:
+	# Returns the known keys; unknown ones raise, or warn and are dropped when not strict
+	known = {}
+	for key, value in config.items():
+		if key not in CONFIG_DEFAULTS:
+			close = difflib.get_close_matches(key, CONFIG_DEFAULTS, n=1)
+			message = f"Unknown config key {key!r}" + (f" (did you mean {close[0]!r}?)" if close else "")
+			if strict:
+				raise ValueError(message)
+			warnings.warn(f"{message}; ignored", stacklevel=4)
+			continue
+		known[key] = value
+		if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+			raise ValueError(f"Config {key!r} must be a number, got {value!r}")
+	if not 0 <= config.get("realtor_commission", 0) < 1:
+		raise ValueError("realtor_commission must be in [0, 1)")
+	for key in ("knn_k", "knn_min_comps"):
+		if key in config and (int(config[key]) != config[key] or config[key] < 1):
+			raise ValueError(f"{key} must be a positive integer")
+	return known
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_plan(tags: Tuple[str, ...], config: Tuple[Tuple[str, Any], ...], available_columns: Tuple[str, ...]) -> CompiledPlan:
+	plan = AnalysisPlan.from_tags(list(tags), available_columns)
+	return CompiledPlan(tags, config, tuple(plan.steps), available_columns, plan)
+
+
+def compile_plan(
+	tags: Sequence[str],
+	config: Optional[Dict[str, Any]] = None,
+	available_columns: Sequence[str] = (),
+	strict_config: bool = True,
+) -> CompiledPlan:
+	"""Validate ``tags`` and ``config`` once and return the reusable plan.
+	
+	Args:
+		tags: Analysis and modifier tags
+		config: Optional configuration; non-numeric values are rejected
+		available_columns: Columns the input frames already have (see AnalysisPlan.from_tags)
+		strict_config: Reject config keys not in CONFIG_DEFAULTS; when False
+			they only raise a warning and are left out of the plan
+		
+	Returns:
+		CompiledPlan; identical requests return the same cached object
+		
+	Raises:
+		ValueError: For unknown tags (with the closest known tag), unknown
+			config keys (when strict_config) or invalid config values
+	"""
+	_validate_tags(tags)
+	config = _validate_config(dict(config or {}), strict_config)
+	resolved = tuple(sorted({**CONFIG_DEFAULTS, **config}.items()))
+	return _compile_plan(tuple(sorted(set(tags))), resolved, tuple(available_columns))
+
+
 def run_fix_and_flip_analysis(
 	properties_df: pd.DataFrame,
-	tags: List[str],
-	config: Optional[Dict[str, Any]] = None
+	tags: Any,
+	config: Optional[Dict[str, Any]] = None,
+	copy_free: bool = False,
+	track_memory: bool = False,
+	cache: Optional["AnalysisCache"] = None,
+	compact_schema: bool = False,
+	instrument: bool = False,
+	sinks: Sequence[StepSink] = (),
 ) -> pd.DataFrame:
-	"""External conditional logic that calls FixAndFlipProfile methods based on tags.
+	"""Run the FixAndFlipProfile methods requested by ``tags``.
 	
-	This function contains if/elif statements outside the class that determine
-	which methods to call based on tag combinations.
+	Tags are compiled into a plan (see compile_plan): each requested step
+	pulls in the steps producing the columns it needs, and every step runs
+	exactly once in dependency order. Use ``compile_plan(tags).explain()`` to
+	see which steps a tag set triggers.
 	
 	Args:
 		properties_df: DataFrame with property listings
-		tags: List of tags like ["repairing_properties", "70_percent_method", "buying_from_realtor"]
+		tags: List of tags like ["repairing_properties", "70_percent_method", "buying_from_realtor"],
+			or a CompiledPlan (then ``config`` must be None)
 		config: Optional configuration dictionary
+		copy_free: Append each step's columns to one shared frame instead of
+			copying the frame per step (see FixAndFlipProfile)
+		track_memory: Record per-step peak memory in ``result.attrs["memory_report"]``
+		cache: Optional AnalysisCache; whole results and individual step outputs
+			are reused when the input data, tags and config match
+		compact_schema: Normalize the input with normalize_listing_schema first
+		instrument: Collect per-step wall/CPU time and row counts in an
+			InstrumentationReport at ``result.attrs["instrumentation"]`` (with
+			memory figures too when track_memory is set)
+		sinks: Extra step record sinks (LoggingSink, JsonLinesSink, ...);
+			passing any also enables ``instrument``
 		
 	Returns:
 		DataFrame with computed analysis columns added based on which tags were active
+		
+	Raises:
+		ValueError: For unknown tags or invalid config values (see compile_plan)
 	"""
-	profile = FixAndFlipProfile(properties_df, config)
-	df = profile.property_df.copy()
-	
-	# External conditional logic based on tags
-	# Repair/renovation related analyses
-	if "repairing_properties" in tags or "renovation" in tags:
-		# Compute renovation costs first (needed for other calculations)
-		if "renovation_cost" in tags or "repairing_properties" in tags:
-			df = profile.compute_renovation_cost(tags)
-			profile.property_df = df
-		
-		# Compute ARP (after repair value) if requested
-		if "arp_estimate" in tags or "arp" in tags:
-			df = profile.compute_arp(tags)
-			profile.property_df = df
-		
-		# 70% method if requested
-		if "70_percent_method" in tags:
-			df = profile.compute_70_percent_method(tags)
-			profile.property_df = df
-		
-		# ROI calculation if requested
-		if "roi_calc" in tags or "roi" in tags:
-			df = profile.compute_roi(tags)
-			profile.property_df = df
-	
-	# Standalone analysis methods (can run independently)
-	if "ppsf_analysis" in tags or "price_per_sqft" in tags:
-		df = profile.compute_ppsf_estimate(tags)
-		profile.property_df = df
+	if isinstance(tags, CompiledPlan):
+		if config is not None:
+			raise ValueError("Pass config to compile_plan, not with a CompiledPlan")
+		compiled = tags
+	else:
+		# Unknown config keys only warn here; callers have always passed extras
+		compiled = compile_plan(tags, config, properties_df.columns, strict_config=False)
 	
-	if "comp_analysis" in tags or "comps" in tags:
-		df = profile.compute_comps_estimate(tags)
-		profile.property_df = df
+	report = InstrumentationReport() if instrument or sinks else None
+	sinks = [report, *sinks] if report is not None else []
+	wall_start, cpu_start = time.perf_counter(), time.process_time()
 	
-	if "arp_estimate" in tags or "arp" in tags:
-		# Only compute if not already computed above
-		if "arp" not in df.columns:
-			df = profile.compute_arp(tags)
-			profile.property_df = df
+	fingerprint = None
+	if cache is not None:
+		fingerprint = fingerprint_frame(properties_df)
+		if compact_schema:
+			# Compacted results carry different dtypes
+			fingerprint = _cache_key(fingerprint, "compact_schema")
+		run_key = AnalysisCache.run_key(fingerprint, list(compiled.tags), compiled.config_dict)
+		cached = cache.get(run_key)
+		if cached is not None:
+			df = cached.copy()
+			if report is not None:
+				record = {
+					"step": "run",
+					"rows_in": len(properties_df),
+					"cached": True,
+					"wall_seconds": time.perf_counter() - wall_start,
+					"cpu_seconds": time.process_time() - cpu_start,
+					"rows_out": len(df),
+				}
+				for sink in sinks:
+					sink(record)
+				df.attrs["instrumentation"] = report
+			return df
 	
-	if "renovation_cost" in tags:
-		# Only compute if not already computed above
-		if "renovation_cost" not in df.columns:
-			df = profile.compute_renovation_cost(tags)
-			profile.property_df = df
+	profile = FixAndFlipProfile(
+		properties_df, copy_free=copy_free, track_memory=track_memory, compact_schema=compact_schema,
+		sinks=sinks,
+	)
+	df = profile.execute(compiled, cache=cache, fingerprint=fingerprint)
+	if cache is not None:
+		cache.put(run_key, df.copy())
+	if track_memory:
+		df.attrs["memory_report"] = profile.memory_report
+	if report is not None:
+		df.attrs["instrumentation"] = report
+	return df
+
+
+def fingerprint_frame(df: pd.DataFrame) -> str:
+	"""Cheap content fingerprint of a DataFrame (values, index, column names and dtypes)."""
+	digest = hashlib.sha256()
+	digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode("utf-8"))
+	try:
+		row_hashes = pd.util.hash_pandas_object(df, index=True)
+	except TypeError:
+		# Unhashable cell values (lists/dicts from LLM extraction) are hashed by repr
+		row_hashes = pd.util.hash_pandas_object(df.astype(str), index=True)
+	digest.update(row_hashes.to_numpy().tobytes())
+	return digest.hexdigest()
+
+
+def _cache_key(*parts: Any) -> str:
+	return hashlib.sha256(json.dumps(parts, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+	"""Two-tier cache of analysis results keyed by data fingerprint, tags and config.
+	
+	The memory tier is an LRU bounded by the total size of the cached frames;
+	the optional disk tier keeps one Parquet file per entry (pickle when
+	pyarrow isn't installed) so results survive process restarts.
+	"""
+	
+	def __init__(self, max_bytes: int = 512 * 1024 * 1024, disk_dir: Optional[str] = None):
+		"""Create an empty cache.
+		
+		Args:
+			max_bytes: Memory budget for the LRU tier
+			disk_dir: Directory for the on-disk tier (disabled when None)
+		"""
+		self.max_bytes = max_bytes
+		self.disk_dir = disk_dir
+		if disk_dir:
+			os.makedirs(disk_dir, exist_ok=True)
+		self._entries: "OrderedDict[str, Tuple[pd.DataFrame, int]]" = OrderedDict()
+		self._bytes = 0
+		self.stats: Dict[str, int] = {
+			"memory_hits": 0,
+			"disk_hits": 0,
+			"misses": 0,
+			"evictions": 0,
+		}
+	
+	@staticmethod
+	def run_key(fingerprint: str, tags: List[str], config: Optional[Dict[str, Any]]) -> str:
+		"""Key for a whole run_fix_and_flip_analysis result."""
+		return _cache_key("run", fingerprint, sorted(set(tags)), config or {})
+	
+	@staticmethod
+	def step_key(fingerprint: str, steps: Sequence[AnalysisStep], tags: List[str], config: Optional[Dict[str, Any]]) -> str:
+		"""Key for the output of the last of ``steps`` (earlier steps ran before it)."""
+		config = config or {}
+		chain = [(step.name, step.relevant_tags(tags), step.relevant_config(config)) for step in steps]
+		return _cache_key("step", fingerprint, chain)
+	
+	def _disk_path(self, key: str) -> str:
+		return os.path.join(self.disk_dir, key + (".parquet" if pa is not None else ".pkl"))
+	
+	def get(self, key: str) -> Optional[pd.DataFrame]:
+		"""Return the cached frame for ``key`` (promoting disk hits to memory), or None."""
+		entry = self._entries.get(key)
+		if entry is not None:
+			self._entries.move_to_end(key)
+			self.stats["memory_hits"] += 1
+			return entry[0]
+		if self.disk_dir and os.path.exists(self._disk_path(key)):
+			path = self._disk_path(key)
+			df = pd.read_parquet(path) if pa is not None else pd.read_pickle(path)
+			self.stats["disk_hits"] += 1
+			self._remember(key, df)
+			return df
+		self.stats["misses"] += 1
+		return None
+	
+	def put(self, key: str, df: pd.DataFrame) -> None:
+		"""Store ``df`` under ``key`` in memory and, when enabled, on disk."""
+		self._remember(key, df)
+		if self.disk_dir:
+			path = self._disk_path(key)
+			# Write then rename so readers never see a partial file
+			tmp_path = f"{path}.{os.getpid()}.tmp"
+			if pa is not None:
+				df.to_parquet(tmp_path)
+			else:
+				df.to_pickle(tmp_path)
+			os.replace(tmp_path, path)
+	
+	def _remember(self, key: str, df: pd.DataFrame) -> None:
+		size = int(df.memory_usage(index=True, deep=True).sum())
+		if key in self._entries:
+			self._bytes -= self._entries.pop(key)[1]
+		if size > self.max_bytes:
+			return
+		self._entries[key] = (df, size)
+		self._bytes += size
+		while self._bytes > self.max_bytes:
+			_, (_, evicted_size) = self._entries.popitem(last=False)
+			self._bytes -= evicted_size
+			self.stats["evictions"] += 1
+	
+	@property
+	def memory_bytes(self) -> int:
+		return self._bytes
+	
+	def clear(self) -> None:
+		"""Drop the memory tier (the disk tier is left in place)."""
+		self._entries.clear()
+		self._bytes = 0
+
+
+# Columns the compute_* steps read from the input frame
+ANALYSIS_INPUT_COLUMNS = (
+	"price", "squareFeet", "bedrooms", "bathrooms",
+	"city", "state", "zip", "status", "latitude", "longitude",
+)
+
+# Per-process state of pool workers: shared-memory blocks and the arrays viewing them
+_SHARED_FRAME: Dict[str, Any] = {}
+
+
+class SharedColumns:
+	"""Columns of a DataFrame copied once into shared memory for pool workers.
+	
+	Numeric columns are shared as-is; other columns are shared as factorized
+	codes with their (small) uniques sent to each worker once, so shards are
+	never pickled as DataFrames.
+	"""
+	
+	def __init__(self, df: pd.DataFrame, columns: Sequence[str]):
+		self._blocks: List[shared_memory.SharedMemory] = []
+		self.specs: List[Tuple[str, str, Tuple[int, ...], str, Optional[np.ndarray]]] = []
+		try:
+			for column in columns:
+				values = df[column]
+				if isinstance(values.dtype, np.dtype) and values.dtype.kind in "iufb":
+					array = values.to_numpy()
+					uniques = None
+				else:
+					array, uniques = pd.factorize(values)
+					uniques = np.asarray(uniques, dtype=object)
+				self._share(column, array, uniques)
+			# Non-unique index labels matter for comps self-exclusion
+			if not df.index.is_unique:
+				self._share("__index__", pd.factorize(df.index)[0], None)
+		except Exception:
+			self.close()
+			raise
+	
+	def _share(self, column: str, array: np.ndarray, uniques: Optional[np.ndarray]) -> None:
+		block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+		self._blocks.append(block)
+		np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+		self.specs.append((column, block.name, array.shape, array.dtype.str, uniques))
+	
+	def close(self) -> None:
+		for block in self._blocks:
+			block.close()
+			block.unlink()
+		self._blocks = []
+
+
+def _attach_shared_columns(specs: List[Tuple[str, str, Tuple[int, ...], str, Optional[np.ndarray]]]) -> None:
+	"""Pool initializer: map the parent's shared-memory columns into this worker."""
+	_SHARED_FRAME.clear()
+	blocks = []
+	arrays = {}
+	for column, name, shape, dtype, uniques in specs:
+		block = shared_memory.SharedMemory(name=name)
+		blocks.append(block)
+		arrays[column] = (np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf), uniques)
+	_SHARED_FRAME["blocks"] = blocks
+	_SHARED_FRAME["arrays"] = arrays
+
+
+def _shared_rows(positions: np.ndarray) -> pd.DataFrame:
+	"""Materialize the given rows of the worker's shared columns as a DataFrame."""
+	data = {}
+	index = None
+	for column, (array, uniques) in _SHARED_FRAME["arrays"].items():
+		values = array[positions]
+		if column == "__index__":
+			index = values
+			continue
+		if uniques is not None:
+			codes = values
+			values = np.empty(len(codes), dtype=object)
+			values[codes < 0] = np.nan
+			values[codes >= 0] = uniques[codes[codes >= 0]]
+		data[column] = values
+	return pd.DataFrame(data, index=index)
+
+
+def _score_shard(
+	positions: np.ndarray,
+	plan: "AnalysisPlan",
+	tags: List[str],
+	config: Optional[Dict[str, Any]],
+	fallback_median: float,
+) -> Tuple[np.ndarray, List[str], Dict[str, np.ndarray]]:
+	"""Run ``plan`` on one shard and return only the columns it produced."""
+	frame = _shared_rows(positions)
+	shipped = set(frame.columns)
+	profile = FixAndFlipProfile(frame, config, copy_free=True)
+	profile.ppsf_fallback_median = fallback_median
+	result = plan.execute(profile, tags)
+	declared = {column for step in plan.steps for column in step.produces}
+	produced = [column for column in result.columns if column not in shipped or column in declared]
+	return positions, produced, {column: result[column].to_numpy() for column in produced}
+
+
+def _city_shards(df: pd.DataFrame, num_shards: int) -> List[np.ndarray]:
+	"""Split row positions into shards of whole cities, balanced by row count."""
+	codes = _category_codes(df["city"])[0]
+	order = np.argsort(codes, kind="stable")
+	unique_codes, starts, sizes = np.unique(codes[order], return_index=True, return_counts=True)
+	shard_rows: List[List[np.ndarray]] = [[] for _ in range(num_shards)]
+	shard_sizes = np.zeros(num_shards, dtype=np.int64)
+	# Largest cities first, each to the currently smallest shard
+	for i in np.argsort(-sizes, kind="stable"):
+		target = int(np.argmin(shard_sizes))
+		shard_rows[target].append(order[starts[i]:starts[i] + sizes[i]])
+		shard_sizes[target] += sizes[i]
+	return [np.sort(np.concatenate(rows)) for rows in shard_rows if rows]
+
+
+def run_fix_and_flip_analysis_parallel(
+	properties_df: pd.DataFrame,
+	tags: List[str],
+	config: Optional[Dict[str, Any]] = None,
+	workers: Optional[int] = None,
+	copy_free: bool = False,
+) -> pd.DataFrame:
+	"""Run the fix-and-flip analysis on a process pool, sharded by city.
+	
+	PPSF medians (per city/state) and comps (per city) never cross a city, so
+	each shard holds whole cities. The analysis input columns are placed in
+	shared memory once; workers return only the columns they compute, which
+	are merged back in the original row order. Results match
+	run_fix_and_flip_analysis exactly.
+	
+	Falls back to the serial path for a single worker, for "radius_miles:X"
+	and "knn_comps" comps (which cross cities) and for frames without
+	city/state columns.
+	
+	Args:
+		properties_df: DataFrame with property listings
+		tags: List of analysis tags, as for run_fix_and_flip_analysis
+		config: Optional configuration dictionary
+		workers: Number of worker processes (default: CPU count)
+		copy_free: Attach the result columns to a shallow copy of the input
+		
+	Returns:
+		DataFrame with computed analysis columns added
+		
+	Raises:
+		ValueError: For unknown tags or invalid config values (see compile_plan)
+	"""
+	workers = workers or os.cpu_count() or 1
+	# Validated exactly like the serial path, so both accept and reject the same input
+	compiled = compile_plan(tags, config, properties_df.columns, strict_config=False)
+	plan = compiled.plan
+	if (
+		workers <= 1
+		or not plan.steps
+		or len(properties_df) == 0
+		or _parse_radius_miles(tags) is not None
+		or "knn_comps" in tags
+		or not {"city", "state"} <= set(properties_df.columns)
+	):
+		return run_fix_and_flip_analysis(properties_df, compiled, copy_free=copy_free)
+	
+	# Ship the raw inputs plus any precomputed columns the planned steps may reuse
+	produced_columns = [column for step in ANALYSIS_STEPS for column in step.produces]
+	shipped = [
+		column for column in dict.fromkeys(ANALYSIS_INPUT_COLUMNS + tuple(produced_columns))
+		if column in properties_df.columns
+	]
+	
+	# The frame-wide PPSF median is the fallback for listings without a location median
+	ppsf = properties_df["price"] / properties_df["squareFeet"].replace(0, 1)
+	fallback_median = ppsf.median()
+	
+	shards = _city_shards(properties_df, workers * 4)
+	shared = SharedColumns(properties_df, shipped)
+	try:
+		with ProcessPoolExecutor(
+			max_workers=min(workers, len(shards)),
+			initializer=_attach_shared_columns,
+			initargs=(shared.specs,),
+		) as pool:
+			futures = [
+				pool.submit(_score_shard, positions, plan, tags, compiled.config_dict, fallback_median)
+				for positions in shards
+			]
+			shard_results = [future.result() for future in futures]
+	finally:
+		shared.close()
+	
+	result = properties_df.copy(deep=not copy_free)
+	n = len(result)
+	for column in shard_results[0][1]:
+		dtype = np.result_type(*(columns[column].dtype for _, _, columns in shard_results))
+		merged = np.empty(n, dtype=dtype)
+		for positions, _, columns in shard_results:
+			merged[positions] = columns[column]
+		result[column] = merged
+	return result
+
+
+class IncrementalAnalysis:
+	"""Persistent analysis state that re-scores only listings affected by changes.
+	
+	Holds the current listings keyed by id, their scored results, the
+	per-location PPSF medians and one comps index per city (one for the whole
+	market with "radius_miles:X"). ``apply`` inserts, updates and deletes
+	listings, then re-scores only the changed listings, listings whose comps
+	set could include an old or new version of a changed listing, and listings
+	whose location median (or the overall fallback median) moved. The results
+	equal a full run_fix_and_flip_analysis over the current listings.
+	"""
+	
+	def __init__(
+		self,
+		properties_df: pd.DataFrame,
+		tags: List[str],
+		config: Optional[Dict[str, Any]] = None,
+		id_column: str = "listingId",
+	):
+		"""Score ``properties_df`` once and keep the state needed for updates.
+		
+		Args:
+			properties_df: DataFrame with property listings and a unique id column
+			tags: Analysis tags, as for run_fix_and_flip_analysis
+			config: Optional configuration dictionary
+			id_column: Column holding the listing id
+		"""
+		if not properties_df[id_column].is_unique:
+			raise ValueError(f"{id_column} values must be unique")
+		self.tags = list(tags)
+		self.config = config or {}
+		self.id_column = id_column
+		self.plan = AnalysisPlan.from_tags(self.tags, properties_df.columns)
+		if "knn_comps" in self.tags:
+			raise ValueError("knn_comps can borrow comps market-wide; use run_fix_and_flip_analysis")
+		self._radius_miles = _parse_radius_miles(self.tags)
+		self._exclude_statuses = [
+			status for tag, status in (("exclude_pending", "Pending"), ("exclude_sold", "Sold"))
+			if tag in self.tags
+		]
+		self._input_columns = list(properties_df.columns)
+		
+		self.listings = properties_df.set_index(properties_df[id_column].rename(None))
+		self.results = run_fix_and_flip_analysis(self.listings, self.tags, self.config, copy_free=True)
+		self._location_medians = self._compute_location_medians(self.listings)
+		self._fallback_median = self._overall_ppsf_median()
+		self._comps_indexes: Dict[Any, Tuple[CompsIndex, pd.Index]] = {}
+	
+	def _ppsf(self, df: pd.DataFrame) -> pd.Series:
+		return df["price"] / df["squareFeet"].replace(0, 1)
+	
+	def _median_rows(self, df: pd.DataFrame) -> pd.Series:
+		"""Mask of rows counted in the location PPSF medians."""
+		include = pd.Series(True, index=df.index)
+		for status in self._exclude_statuses:
+			include &= df.get("status", "") != status
+		return include
+	
+	def _compute_location_medians(self, df: pd.DataFrame) -> Dict[Tuple[Any, Any], float]:
+		if not {"city", "state"} <= set(df.columns):
+			return {}
+		include = self._median_rows(df)
+		return self._ppsf(df)[include].groupby([df["city"][include], df["state"][include]], observed=True).median().to_dict()
+	
+	def _overall_ppsf_median(self) -> float:
+		"""The fallback median compute_ppsf_estimate would take over all listings."""
+		if {"city", "state"} <= set(self.listings.columns):
+			return self._ppsf(self.listings).median()
+		# Without locations every listing gets the median of the non-excluded ones
+		return self._ppsf(self.listings)[self._median_rows(self.listings)].median()
+	
+	def _comps_scope(self, row: pd.Series) -> Any:
+		"""Key of the comps index a listing belongs to (None: no comps possible)."""
+		if self._radius_miles is not None or "city" not in self.listings.columns:
+			return "__all__"
+		return None if pd.isna(row["city"]) else row["city"]
+	
+	def _comps_index(self, scope: Any) -> Tuple[CompsIndex, pd.Index]:
+		"""Return the (cached) comps index of one scope and the listing ids it covers."""
+		if scope not in self._comps_indexes:
+			if scope == "__all__":
+				members = self.listings
+			else:
+				members = self.listings[self.listings["city"] == scope]
+			index = CompsIndex(
+				members.reset_index(drop=True),
+				same_zip_only="same_zip_only" in self.tags,
+				exclude_statuses=self._exclude_statuses,
+				radius_miles=self._radius_miles,
+			)
+			self._comps_indexes[scope] = (index, members.index)
+		return self._comps_indexes[scope]
+	
+	def _comps_dependents(self, rows: pd.DataFrame) -> set:
+		"""Ids of listings whose comps set includes any of ``rows`` (current state)."""
+		affected = set()
+		for scope, group in rows.groupby(rows.apply(self._comps_scope, axis=1), dropna=True):
+			index, ids = self._comps_index(scope)
+			positions = ids.get_indexer(group.index)
+			affected.update(ids[index.dependents(positions[positions >= 0])])
+		return affected
+	
+	def apply(
+		self,
+		upserts: Optional[pd.DataFrame] = None,
+		deletes: Sequence[Any] = (),
+	) -> pd.DataFrame:
+		"""Insert/update/delete listings and re-score the affected ones.
+		
+		Args:
+			upserts: New or changed listings (full rows, with the id column)
+			deletes: Ids of listings to remove
+			
+		Returns:
+			Result rows that were re-scored, indexed by listing id
+		"""
+		upserts = upserts if upserts is not None else self.listings.iloc[:0]
+		upserts = upserts.set_index(upserts[self.id_column].rename(None)).reindex(columns=self._input_columns)
+		upserts = upserts[~upserts.index.duplicated(keep="last")]
+		
+		# Only rows whose values actually change count as updates
+		existing = upserts.index.intersection(self.listings.index)
+		unchanged = [
+			listing_id for listing_id in existing
+			if self.listings.loc[listing_id].equals(upserts.loc[listing_id])
+		]
+		upserts = upserts.drop(index=unchanged)
+		deletes = self.listings.index.intersection(pd.Index(list(deletes)).difference(upserts.index))
+		replaced = upserts.index.intersection(self.listings.index).append(deletes)
+		if len(upserts) == 0 and len(deletes) == 0:
+			return self.results.iloc[:0]
+		
+		old_rows = self.listings.loc[replaced]
+		affected = set(upserts.index)
+		comps_planned = any(step.name == "comps" for step in self.plan.steps)
+		ppsf_planned = any(step.name == "ppsf" for step in self.plan.steps)
+		
+		# Listings that had an old version among their comps
+		if comps_planned:
+			affected |= self._comps_dependents(old_rows)
+		
+		self.listings = pd.concat([self.listings.drop(index=replaced), upserts])
+		self.results = self.results.drop(index=replaced)
+		
+		# Rebuild the comps indexes of touched scopes, then find listings that gain a comp
+		if comps_planned:
+			for rows in (old_rows, upserts):
+				for _, row in rows.iterrows():
+					self._comps_indexes.pop(self._comps_scope(row), None)
+			affected |= self._comps_dependents(upserts)
+		
+		has_location = {"city", "state"} <= set(self.listings.columns)
+		if ppsf_planned and has_location:
+			touched = pd.concat([old_rows, upserts])[["city", "state"]].dropna().drop_duplicates()
+			for city, state in touched.itertuples(index=False):
+				in_location = (self.listings["city"] == city) & (self.listings["state"] == state)
+				location_rows = self.listings[in_location]
+				new_medians = self._compute_location_medians(location_rows)
+				old_median = self._location_medians.pop((city, state), None)
+				new_median = new_medians.get((city, state))
+				self._location_medians.update(new_medians)
+				if not _same_value(old_median, new_median):
+					affected.update(location_rows.index)
+		if ppsf_planned:
+			fallback = self._overall_ppsf_median()
+			if not _same_value(fallback, self._fallback_median):
+				if has_location:
+					keys = pd.MultiIndex.from_arrays([self.listings["city"], self.listings["state"]])
+					uses_fallback = ~keys.isin(list(self._location_medians.keys()))
+					affected.update(self.listings.index[uses_fallback])
+				else:
+					affected.update(self.listings.index)
+			self._fallback_median = fallback
+		
+		affected_ids = self.listings.index.intersection(pd.Index(list(affected)))
+		rescored = self._score(affected_ids)
+		self.results = pd.concat([self.results.drop(index=affected_ids.intersection(self.results.index)), rescored])
+		return rescored
+	
+	def _score(self, ids: pd.Index) -> pd.DataFrame:
+		"""Score the given listings against the full current state."""
+		profile = FixAndFlipProfile(self.listings.loc[ids], self.config, copy_free=True)
+		profile.ppsf_fallback_median = self._fallback_median
+		profile.location_ppsf_medians = self._location_medians
+		for step in self.plan.steps:
+			if step.name == "comps":
+				profile.property_df = self._score_comps(profile.property_df)
+			else:
+				profile.property_df = getattr(profile, step.method)(self.tags)
+		return profile.property_df
+	
+	def _score_comps(self, df: pd.DataFrame) -> pd.DataFrame:
+		comps_estimate = df["price"].to_numpy(dtype=float).copy()
+		num_comps = np.zeros(len(df), dtype=np.int64)
+		scopes = df.apply(self._comps_scope, axis=1) if len(df) else pd.Series(dtype=object)
+		for scope, group in df.groupby(scopes, dropna=True):
+			index, ids = self._comps_index(scope)
+			slots = df.index.get_indexer(group.index)
+			estimates, counts = index.estimate(ids.get_indexer(group.index))
+			comps_estimate[slots] = estimates
+			num_comps[slots] = counts
+		df["comps_estimate"] = comps_estimate
+		df["num_comps"] = num_comps
+		df["comp_median_price"] = df["comps_estimate"]
+		return df
+
+
+def _same_value(a: Optional[float], b: Optional[float]) -> bool:
+	"""Equality for optional medians that treats NaN as equal to NaN."""
+	if a is None or b is None:
+		return a is None and b is None
+	return a == b or (pd.isna(a) and pd.isna(b))
+
+
+# Parameters a scenario sweep can vary, with the defaults the compute_* steps use
+SWEEP_PARAMETERS: Dict[str, Any] = {
+	"realtor_commission": 0.03,
+	"arp_weight_ppsf": 0.5,
+	"arp_weight_comps": 0.5,
+	"renovation_tier": "moderate",
+	"holding_cost_months": 6,
+	"closing_cost_rate": 0.03,
+}
+
+
+@dataclass
+class ScenarioSweep:
+	"""Result of sweep_scenarios: one (scenarios x listings) array per metric."""
+	scenarios: pd.DataFrame
+	index: pd.Index
+	metrics: Dict[str, np.ndarray]
+	
+	def __getitem__(self, metric: str) -> np.ndarray:
+		return self.metrics[metric]
+	
+	def to_tidy(self) -> pd.DataFrame:
+		"""Long format: one row per (scenario, listing) with parameters and metrics."""
+		n_scenarios, n_listings = len(self.scenarios), len(self.index)
+		scenario_ids = np.repeat(np.arange(n_scenarios), n_listings)
+		tidy = self.scenarios.iloc[scenario_ids].reset_index(names="scenario")
+		tidy.insert(1, "listing", np.tile(np.asarray(self.index), n_scenarios))
+		for metric, values in self.metrics.items():
+			tidy[metric] = np.asarray(values).reshape(-1)
+		return tidy
+
+
+def sweep_scenarios(
+	properties_df: pd.DataFrame,
+	grid: Dict[str, Sequence[Any]],
+	tags: Optional[List[str]] = None,
+	config: Optional[Dict[str, Any]] = None,
+	metrics: Sequence[str] = ("max_offer_70_percent", "profit", "roi"),
+	dtype: Any = np.float64,
+	max_cells_per_block: int = 8_000_000,
+	out_dir: Optional[str] = None,
+	cache: Optional[AnalysisCache] = None,
+) -> ScenarioSweep:
+	"""Evaluate the 70% rule, profit and ROI for every combination of ``grid``.
+	
+	PPSF and comps estimates don't depend on these parameters, so they are
+	computed once; every scenario is then evaluated with broadcasted NumPy
+	arithmetic over blocks of scenarios. Each cell equals what
+	run_fix_and_flip_analysis returns for ["arp", "70_percent_method",
+	"roi_calc", "buying_from_realtor"] with the scenario's config.
+	
+	Args:
+		properties_df: DataFrame with property listings
+		grid: Values to sweep, keyed by any of SWEEP_PARAMETERS; renovation_tier
+			is one of "basic", "moderate", "high_end"
+		tags: Modifier tags applied to every scenario (e.g. "exclude_pending",
+			"include_permit_costs"); without "buying_from_realtor" and a
+			realtor_commission grid, no commission is applied
+		config: Base configuration for parameters that aren't swept
+		metrics: Metrics to return, from max_offer_70_percent, profit and roi
+		dtype: Output dtype (float32 halves memory for very large sweeps)
+		max_cells_per_block: Scenario x listing cells evaluated per NumPy pass
+		out_dir: Write metrics to .npy memmaps in this directory instead of RAM
+		cache: Optional AnalysisCache for the PPSF/comps pass
+		
+	Returns:
+		ScenarioSweep with the scenario table and (n_scenarios, n_listings) arrays
+	"""
+	tags = list(tags or [])
+	config = dict(config or {})
+	unknown = set(grid) - set(SWEEP_PARAMETERS)
+	if unknown:
+		raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+	unknown = set(metrics) - {"max_offer_70_percent", "profit", "roi"}
+	if unknown:
+		raise ValueError(f"Unknown sweep metrics: {sorted(unknown)}")
+	
+	# Scenario table: cartesian product of the swept values, defaults elsewhere
+	defaults = {key: config.get(key, default) for key, default in SWEEP_PARAMETERS.items()}
+	if "realtor_commission" not in grid and "buying_from_realtor" not in tags:
+		defaults["realtor_commission"] = 0.0
+	for tag, tier in (("high_end_renovation", "high_end"), ("basic_renovation", "basic")):
+		if tag in tags:
+			defaults["renovation_tier"] = tier
+			break
+	names = list(grid)
+	combos = list(itertools.product(*(list(grid[name]) for name in names))) or [()]
+	scenarios = pd.DataFrame(combos, columns=names)
+	for key, value in defaults.items():
+		if key not in scenarios.columns:
+			scenarios[key] = value
+	scenarios = scenarios[list(SWEEP_PARAMETERS)]
+	bad_tiers = set(scenarios["renovation_tier"]) - set(RENOVATION_COST_PER_SQFT)
+	if bad_tiers:
+		raise ValueError(f"Unknown renovation tiers: {sorted(bad_tiers)}")
+	
+	# Config-independent pass: PPSF and comps estimates plus fixed renovation extras
+	base = run_fix_and_flip_analysis(
+		properties_df,
+		[tag for tag in tags if tag not in ("high_end_renovation", "basic_renovation")] + ["ppsf_analysis", "comp_analysis"],
+		config,
+		copy_free=True,
+		cache=cache,
+	)
+	price = base["price"].to_numpy(dtype=float)
+	sqft = base["squareFeet"].to_numpy(dtype=float)
+	ppsf_estimate = base["ppsf_estimate"].to_numpy(dtype=float)
+	comps_estimate = base["comps_estimate"].to_numpy(dtype=float)
+	extras = np.zeros(len(base))
+	if "include_permit_costs" in tags:
+		extras = extras + (config.get("permit_cost_base", 5000) + sqft * config.get("permit_cost_per_sqft", 2.0))
+	if "itemize_room_costs" in tags:
+		if "bedrooms" in base.columns:
+			extras = extras + base["bedrooms"].to_numpy(dtype=float) * config.get("bedroom_renovation_cost", 5000)
+		if "bathrooms" in base.columns:
+			extras = extras + base["bathrooms"].to_numpy(dtype=float) * config.get("bathroom_renovation_cost", 10000)
+	monthly_holding_cost = config.get("monthly_holding_cost", 1000)
+	
+	# Per-scenario parameter columns, shaped (n_scenarios, 1) for broadcasting
+	weight_ppsf = scenarios["arp_weight_ppsf"].to_numpy(dtype=float)
+	weight_comps = scenarios["arp_weight_comps"].to_numpy(dtype=float)
+	total_weight = weight_ppsf + weight_comps
+	positive = total_weight > 0
+	weight_ppsf = np.where(positive, weight_ppsf / np.where(positive, total_weight, 1), 0.5)[:, None]
+	weight_comps = np.where(positive, weight_comps / np.where(positive, total_weight, 1), 0.5)[:, None]
+	tier_rate = scenarios["renovation_tier"].map(RENOVATION_COST_PER_SQFT).to_numpy(dtype=float)[:, None]
+	commission = scenarios["realtor_commission"].to_numpy(dtype=float)[:, None]
+	closing_rate = scenarios["closing_cost_rate"].to_numpy(dtype=float)[:, None]
+	holding_costs = (scenarios["holding_cost_months"].to_numpy(dtype=float) * monthly_holding_cost)[:, None]
+	
+	n_scenarios, n_listings = len(scenarios), len(base)
+	outputs: Dict[str, np.ndarray] = {}
+	for metric in metrics:
+		if out_dir:
+			os.makedirs(out_dir, exist_ok=True)
+			outputs[metric] = np.lib.format.open_memmap(
+				os.path.join(out_dir, f"{metric}.npy"), mode="w+", dtype=dtype, shape=(n_scenarios, n_listings),
+			)
+		else:
+			outputs[metric] = np.empty((n_scenarios, n_listings), dtype=dtype)
+	
+	block = max(1, max_cells_per_block // max(1, n_listings))
+	for start in range(0, n_scenarios, block):
+		rows = slice(start, start + block)
+		# Same operation order as compute_arp/renovation/70_percent/roi
+		arp = (weight_ppsf[rows] * ppsf_estimate) + (weight_comps[rows] * comps_estimate)
+		renovation_cost = sqft * tier_rate[rows] + extras
+		adjusted_price = price / (1 - commission[rows])
+		commission_cost = adjusted_price - price
+		if "max_offer_70_percent" in outputs:
+			outputs["max_offer_70_percent"][rows] = (arp * 0.70) - renovation_cost - commission_cost
+		if "profit" in outputs or "roi" in outputs:
+			other_costs = adjusted_price * closing_rate[rows] + holding_costs[rows]
+			total_investment = adjusted_price + renovation_cost + other_costs
+			profit = arp - total_investment
+			if "profit" in outputs:
+				outputs["profit"][rows] = profit
+			if "roi" in outputs:
+				outputs["roi"][rows] = (profit / np.where(total_investment == 0, 1, total_investment)) * 100
+	
+	return ScenarioSweep(scenarios=scenarios, index=base.index, metrics=outputs)
+
+
+# Ranking metric -> (tag whose step produces it, result column)
+RANKING_METRICS: Dict[str, Tuple[str, str]] = {
+	"roi": ("roi_calc", "roi"),
+	"profit": ("roi_calc", "profit"),
+	"spread": ("70_percent_method", "spread"),
+}
+
+
+def rank_deals(
+	properties_df: pd.DataFrame,
+	tags: List[str],
+	k: int = 100,
+	metric: str = "roi",
+	config: Optional[Dict[str, Any]] = None,
+	cities: Optional[Sequence[Any]] = None,
+	min_price: Optional[float] = None,
+	max_price: Optional[float] = None,
+	batch_size: int = 1024,
+) -> pd.DataFrame:
+	"""Return the top ``k`` listings by ROI, profit or offer spread.
+	
+	The city/price filters are applied before any comps work, and comps are
+	only computed for listings that can still reach the top k: each candidate
+	is first scored with CompsIndex.estimate_upper_bounds in place of its comps
+	estimate (every metric grows with ARP), then candidates are evaluated
+	exactly in descending bound order until the next bound falls below the
+	current k-th best value. PPSF medians still come from every listing.
+	
+	Args:
+		properties_df: DataFrame with property listings
+		tags: Analysis and modifier tags, as for run_fix_and_flip_analysis
+		k: Number of listings to return
+		metric: "roi", "profit" or "spread" (max_offer_70_percent - price)
+		config: Optional configuration dictionary
+		cities: Only rank listings in these cities
+		min_price: Only rank listings priced at least this much
+		max_price: Only rank listings priced at most this much
+		batch_size: Candidates whose comps are computed together
+		
+	Returns:
+		Scored rows of the top listings, best first (ties keep input order),
+		equal to the head of the full analysis sorted by ``metric``. Listings
+		with a NaN metric are never ranked. ``attrs["ranking"]`` reports how
+		many candidates were pruned before their comps were computed.
+		
+	Raises:
+		ValueError: For an unknown metric, unknown tags or invalid config
+			values (see compile_plan)
+	"""
+	if metric not in RANKING_METRICS:
+		raise ValueError(f"Unknown ranking metric: {metric!r}")
+	metric_tag, metric_column = RANKING_METRICS[metric]
+	compiled = compile_plan(tags, config, properties_df.columns, strict_config=False)
+	config = compiled.config_dict
+	
+	# PPSF medians are location-wide, so that step runs on every listing
+	profile = FixAndFlipProfile(properties_df, config, copy_free=True)
+	df = profile.property_df
+	if "ppsf_estimate" not in df.columns:
+		df = profile.compute_ppsf_estimate(tags)
 	
-	if "roi_calc" in tags or "roi" in tags:
-		# Only compute if not already computed above
-		if "roi" not in df.columns:
-			df = profile.compute_roi(tags)
-			profile.property_df = df
+	# Cheap filters first
+	keep = np.ones(len(df), dtype=bool)
+	if cities is not None and "city" in df.columns:
+		keep &= df["city"].isin(list(cities)).to_numpy()
+	if min_price is not None:
+		keep &= (df["price"] >= min_price).to_numpy()
+	if max_price is not None:
+		keep &= (df["price"] <= max_price).to_numpy()
+	candidates = np.flatnonzero(keep)
 	
+	# Remaining steps run per batch with ppsf/comps estimates already attached
+	score_tags = [
+		tag for tag in tags
+		if not set(TAG_TARGETS.get(tag, ())) & {"ppsf", "comps"}
+	] + [metric_tag]
+	score_columns = list(df.columns) + [column for column in ("comps_estimate", "num_comps", "comp_median_price") if column not in df.columns]
+	plan = compile_plan(score_tags, config, score_columns).plan
+	
+	def score(positions: np.ndarray, comps_estimate: np.ndarray, num_comps: np.ndarray) -> pd.DataFrame:
+		rows = df.iloc[positions].copy()
+		if "comps_estimate" not in df.columns:
+			rows["comps_estimate"] = comps_estimate
+			rows["num_comps"] = num_comps
+			rows["comp_median_price"] = rows["comps_estimate"]
+		scored = plan.execute(FixAndFlipProfile(rows, config, copy_free=True), score_tags)
+		if metric == "spread":
+			scored["spread"] = scored["max_offer_70_percent"] - scored["price"]
+		return scored
+	
+	def metric_values(scored: pd.DataFrame, bound: bool = False) -> np.ndarray:
+		values = scored[metric_column].to_numpy(dtype=float)
+		if bound and metric == "roi":
+			# ROI falls as ARP rises when total investment is negative
+			values = np.where(scored["total_investment"].to_numpy(dtype=float) < 0, np.inf, values)
+		return np.where(np.isnan(values), -np.inf, values)
+	
+	comps_index = None if "comps_estimate" in df.columns else _comps_index_for(df, tags, config)
+	if comps_index is None or len(candidates) <= k:
+		order = candidates
+		bounds = np.full(len(candidates), np.inf)
+	else:
+		bounds_frame = score(candidates, comps_index.estimate_upper_bounds(candidates), np.zeros(len(candidates), dtype=np.int64))
+		bounds = metric_values(bounds_frame, bound=True)
+		ranked = np.argsort(-bounds, kind="stable")
+		order, bounds = candidates[ranked], bounds[ranked]
+	
+	best_positions = np.empty(0, dtype=np.int64)
+	best_values = np.empty(0)
+	evaluated = 0
+	while evaluated < len(order):
+		# Nothing left can beat (or tie) the current k-th best
+		if len(best_values) >= k and bounds[evaluated] < best_values.min():
+			break
+		batch = order[evaluated:evaluated + max(batch_size, k)]
+		evaluated += len(batch)
+		if comps_index is not None:
+			estimates, num_comps = comps_index.estimate(batch)
+		else:
+			estimates = num_comps = None
+		values = metric_values(score(batch, estimates, num_comps))
+		positions = np.concatenate([best_positions, batch[values > -np.inf]])
+		values = np.concatenate([best_values, values[values > -np.inf]])
+		if len(values) > k:
+			# Partial selection, keeping every tie with the k-th value
+			kth = np.partition(-values, k - 1)[k - 1]
+			within = -values <= kth
+			positions, values = positions[within], values[within]
+		best_positions, best_values = positions, values
+	
+	# Best first; ties in input order
+	winners = np.lexsort([best_positions, -best_values])[:k]
+	winners = np.sort(best_positions[winners]) if len(winners) else winners
+	if comps_index is not None:
+		estimates, num_comps = comps_index.estimate(winners)
+	else:
+		estimates = num_comps = None
+	result = score(winners, estimates, num_comps)
+	result = result.iloc[np.lexsort([np.arange(len(result)), -metric_values(result)])]
+	result.attrs["ranking"] = {
+		"candidates": int(len(candidates)),
+		"evaluated": int(evaluated),
+		"pruned": int(len(order) - evaluated),
+	}
+	return result
+
+
+class MarketIndex:
+	"""Prebuilt, serializable market data for scoring one listing at a time.
+	
+	Holds the per-(city, state) PPSF medians with their fallback, and the
+	comp pool of every location partition as NumPy arrays sorted by square
+	footage, so score_listing needs neither pandas nor the full pipeline.
+	"""
+	
+	# Tags baked into the index (they change medians or the comp pool)
+	INDEX_TAGS = ("exclude_pending", "exclude_sold", "same_zip_only")
+	
+	def __init__(
+		self,
+		tags: Sequence[str],
+		location_medians: Dict[Tuple[Any, Any], float],
+		fallback_median: float,
+		comps: Dict[Tuple[Any, ...], Dict[str, np.ndarray]],
+		location_columns: Sequence[str],
+		has_rooms: Tuple[bool, bool],
+		sqft_tolerance_pct: float = 0.20,
+		bed_tolerance: int = 1,
+		bath_tolerance: int = 1,
+		id_column: str = "listingId",
+	):
+		self.tags = tuple(tags)
+		self.location_medians = location_medians
+		self.fallback_median = fallback_median
+		self.comps = comps
+		self.location_columns = tuple(location_columns)
+		self.has_rooms = has_rooms
+		self.sqft_tolerance_pct = sqft_tolerance_pct
+		self.bed_tolerance = bed_tolerance
+		self.bath_tolerance = bath_tolerance
+		self.id_column = id_column
+	
+	@classmethod
+	def from_frame(cls, properties_df: pd.DataFrame, tags: Sequence[str] = (), id_column: str = "listingId") -> "MarketIndex":
+		"""Build the index from a listing frame.
+		
+		Args:
+			properties_df: DataFrame with property listings
+			tags: Modifier tags the medians and comp pool follow ("exclude_pending",
+				"exclude_sold", "same_zip_only"); radius comps aren't supported
+			id_column: Listing id column; a scored listing never counts itself as a comp
+			
+		Returns:
+			MarketIndex matching what run_fix_and_flip_analysis computes for ``tags``
+		"""
+		if _parse_radius_miles(list(tags)) is not None or "knn_comps" in tags:
+			raise ValueError("MarketIndex does not support radius_miles or knn_comps comps")
+		tags = tuple(tag for tag in cls.INDEX_TAGS if tag in tags)
+		df = properties_df
+		ppsf = df["price"] / df["squareFeet"].replace(0, 1)
+		status = df["status"] if "status" in df.columns else pd.Series("", index=df.index)
+		excluded = [status_value for tag, status_value in (("exclude_pending", "Pending"), ("exclude_sold", "Sold")) if tag in tags]
+		include = ~status.isin(excluded)
+		
+		location_medians: Dict[Tuple[Any, Any], float] = {}
+		if "city" in df.columns and "state" in df.columns:
+			location_medians = ppsf[include].groupby([df["city"][include], df["state"][include]], observed=True).median().to_dict()
+			fallback_median = float(ppsf.median())
+		else:
+			fallback_median = float(ppsf[include].median())
+		
+		# Comp pool per location partition, as CompsIndex partitions it
+		location_columns = [column for column in ("city",) if column in df.columns]
+		if "same_zip_only" in tags and "zip" in df.columns:
+			location_columns.append("zip")
+		has_rooms = ("bedrooms" in df.columns, "bathrooms" in df.columns)
+		pool = include.to_numpy() & df["squareFeet"].notna().to_numpy()
+		for column, present in zip(("bedrooms", "bathrooms"), has_rooms):
+			if present:
+				pool &= df[column].notna().to_numpy()
+		for column in location_columns:
+			pool &= df[column].notna().to_numpy()
+		pool_df = df[pool]
+		comps: Dict[Tuple[Any, ...], Dict[str, np.ndarray]] = {}
+		groups = pool_df.groupby(location_columns, observed=True, sort=False) if location_columns else [((), pool_df)]
+		for key, group in groups:
+			group = group.sort_values("squareFeet", kind="stable")
+			comps[_location_key(key)] = {
+				"sqft": group["squareFeet"].to_numpy(dtype=float),
+				"bedrooms": group["bedrooms"].to_numpy(dtype=float) if has_rooms[0] else None,
+				"bathrooms": group["bathrooms"].to_numpy(dtype=float) if has_rooms[1] else None,
+				"price": group["price"].to_numpy(dtype=float),
+				"ids": group[id_column].astype(str).to_numpy(dtype=object) if id_column in group.columns else None,
+			}
+		return cls(tags, location_medians, fallback_median, comps, location_columns, has_rooms, id_column=id_column)
+	
+	def comps_estimate(self, listing: Dict[str, Any]) -> Tuple[float, int]:
+		"""Median comp price and comp count for one listing (own price when it has no comps)."""
+		price = _as_float(listing.get("price"))
+		sqft = _as_float(listing.get("squareFeet"))
+		key = tuple(listing.get(column) for column in self.location_columns)
+		if math.isnan(sqft) or any(value is None or value != value for value in key):
+			return price, 0
+		rooms = []
+		for column, present, tolerance in zip(("bedrooms", "bathrooms"), self.has_rooms, (self.bed_tolerance, self.bath_tolerance)):
+			if present:
+				value = _as_float(listing.get(column))
+				if math.isnan(value):
+					return price, 0
+				rooms.append((column, value, tolerance))
+		pool = self.comps.get(key)
+		if pool is None:
+			return price, 0
+		low = np.searchsorted(pool["sqft"], sqft * (1 - self.sqft_tolerance_pct), side="left")
+		high = np.searchsorted(pool["sqft"], sqft * (1 + self.sqft_tolerance_pct), side="right")
+		keep = np.ones(high - low, dtype=bool)
+		for column, value, tolerance in rooms:
+			values = pool[column][low:high]
+			keep &= (values >= max(0, value - tolerance)) & (values <= value + tolerance)
+		listing_id = listing.get(self.id_column)
+		if listing_id is not None and pool["ids"] is not None:
+			keep &= pool["ids"][low:high] != str(listing_id)
+		count = int(keep.sum())
+		if not count:
+			return price, 0
+		prices = np.sort(pool["price"][low:high][keep])
+		prices = prices[~np.isnan(prices)]
+		if not len(prices):
+			return float("nan"), count
+		return float((prices[(len(prices) - 1) // 2] + prices[len(prices) // 2]) / 2), count
+	
+	def ppsf_median(self, listing: Dict[str, Any]) -> float:
+		"""Location PPSF median for one listing, or the fallback median."""
+		if not self.location_medians:
+			return self.fallback_median
+		return self.location_medians.get((listing.get("city"), listing.get("state")), self.fallback_median)
+	
+	def to_dict(self) -> Dict[str, Any]:
+		"""JSON-serializable state."""
+		return {
+			"tags": list(self.tags),
+			"location_medians": [[city, state, median] for (city, state), median in self.location_medians.items()],
+			"fallback_median": self.fallback_median,
+			"location_columns": list(self.location_columns),
+			"has_rooms": list(self.has_rooms),
+			"tolerances": [self.sqft_tolerance_pct, self.bed_tolerance, self.bath_tolerance],
+			"id_column": self.id_column,
+			"comps": [
+				[list(key), {name: None if values is None else values.tolist() for name, values in pool.items()}]
+				for key, pool in self.comps.items()
+			],
+		}
+	
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "MarketIndex":
+		"""Rebuild an index saved with to_dict."""
+		comps = {}
+		for key, pool in data["comps"]:
+			comps[tuple(key)] = {
+				name: None if values is None else np.asarray(values, dtype=object if name == "ids" else float)
+				for name, values in pool.items()
+			}
+		sqft_tolerance_pct, bed_tolerance, bath_tolerance = data["tolerances"]
+		return cls(
+			data["tags"],
+			{(city, state): median for city, state, median in data["location_medians"]},
+			data["fallback_median"],
+			comps,
+			data["location_columns"],
+			tuple(data["has_rooms"]),
+			sqft_tolerance_pct,
+			bed_tolerance,
+			bath_tolerance,
+			# Indexes saved before the id column was stored always used listingId
+			id_column=data.get("id_column", "listingId"),
+		)
+	
+	def save(self, path: str) -> None:
+		"""Write the index as JSON (gzip-compressed when ``path`` ends in .gz)."""
+		opener = gzip.open if path.endswith(".gz") else open
+		with opener(path, "wt") as f:
+			json.dump(self.to_dict(), f)
+	
+	@classmethod
+	def load(cls, path: str) -> "MarketIndex":
+		"""Read an index written by save."""
+		opener = gzip.open if path.endswith(".gz") else open
+		with opener(path, "rt") as f:
+			return cls.from_dict(json.load(f))
+
+
+def _location_key(key: Any) -> Tuple[Any, ...]:
+	return key if isinstance(key, tuple) else (key,)
+
+
+def _as_float(value: Any) -> float:
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return float("nan")
+
+
+def score_listing(
+	listing: Dict[str, Any],
+	tags: List[str],
+	config: Optional[Dict[str, Any]] = None,
+	*,
+	market_index: MarketIndex,
+) -> Dict[str, Any]:
+	"""Score one listing against a prebuilt MarketIndex, without pandas.
+	
+	Computes the same values run_fix_and_flip_analysis produces for
+	``tags + ["70_percent_method", "roi_calc"]`` when the listing is part of
+	the frame the index was built from.
+	
+	Args:
+		listing: Listing record with price, squareFeet, bedrooms, bathrooms,
+			city, state (and zip and the index's id column when available)
+		tags: Modifier tags such as "buying_from_realtor" or "include_permit_costs";
+			comps/PPSF modifiers must match the tags the index was built with
+		config: Optional configuration dictionary
+		market_index: Index built with MarketIndex.from_frame
+		
+	Returns:
+		Dict with ppsf_estimate, comps_estimate, num_comps, arp, renovation_cost,
+		adjusted_asking_price, realtor_commission_cost, max_offer_70_percent,
+		total_investment, profit and roi
+	"""
+	config = config or {}
+	index_tags = tuple(tag for tag in MarketIndex.INDEX_TAGS if tag in tags)
+	if index_tags != market_index.tags:
+		raise ValueError(f"Tags {list(index_tags)} don't match the market index tags {list(market_index.tags)}")
+	price = _as_float(listing.get("price"))
+	sqft = _as_float(listing.get("squareFeet"))
+	
+	# ARP (compute_ppsf_estimate, compute_comps_estimate, compute_arp)
+	ppsf_estimate = sqft * market_index.ppsf_median(listing)
+	comps_estimate, num_comps = market_index.comps_estimate(listing)
+	weight_ppsf = config.get("arp_weight_ppsf", 0.5)
+	weight_comps = config.get("arp_weight_comps", 0.5)
+	total_weight = weight_ppsf + weight_comps
+	if total_weight > 0:
+		weight_ppsf /= total_weight
+		weight_comps /= total_weight
+	else:
+		weight_ppsf = 0.5
+		weight_comps = 0.5
+	arp = (weight_ppsf * ppsf_estimate) + (weight_comps * comps_estimate)
+	
+	# Renovation cost (compute_renovation_cost)
+	base_cost_per_sqft = RENOVATION_COST_PER_SQFT["moderate"]
+	if "high_end_renovation" in tags:
+		base_cost_per_sqft = RENOVATION_COST_PER_SQFT["high_end"]
+	elif "basic_renovation" in tags:
+		base_cost_per_sqft = RENOVATION_COST_PER_SQFT["basic"]
+	renovation_cost = sqft * base_cost_per_sqft
+	if "include_permit_costs" in tags:
+		renovation_cost += config.get("permit_cost_base", 5000) + (sqft * config.get("permit_cost_per_sqft", 2.0))
+	if "itemize_room_costs" in tags:
+		if "bedrooms" in listing:
+			renovation_cost += _as_float(listing["bedrooms"]) * config.get("bedroom_renovation_cost", 5000)
+		if "bathrooms" in listing:
+			renovation_cost += _as_float(listing["bathrooms"]) * config.get("bathroom_renovation_cost", 10000)
+	
+	# 70% rule (compute_70_percent_method)
+	if "buying_from_realtor" in tags:
+		adjusted_asking_price = price / (1 - config.get("realtor_commission", 0.03))
+		realtor_commission_cost = adjusted_asking_price - price
+	else:
+		adjusted_asking_price = price
+		realtor_commission_cost = 0
+	max_offer = (arp * 0.70) - renovation_cost - realtor_commission_cost
+	
+	# ROI (compute_roi)
+	closing_costs = adjusted_asking_price * config.get("closing_cost_rate", 0.03)
+	holding_costs = config.get("holding_cost_months", 6) * config.get("monthly_holding_cost", 1000)
+	total_investment = adjusted_asking_price + renovation_cost + (closing_costs + holding_costs)
+	profit = arp - total_investment
+	roi = (profit / (total_investment if total_investment != 0 else 1)) * 100
+	
+	return {
+		"ppsf_estimate": ppsf_estimate,
+		"comps_estimate": comps_estimate,
+		"num_comps": num_comps,
+		"arp": arp,
+		"renovation_cost": renovation_cost,
+		"adjusted_asking_price": adjusted_asking_price,
+		"realtor_commission_cost": realtor_commission_cost,
+		"max_offer_70_percent": max_offer,
+		"total_investment": total_investment,
+		"profit": profit,
+		"roi": roi,
+	}
+
+
+def serve_market_index(market_index: MarketIndex, host: str = "127.0.0.1", port: int = 8080) -> None:
+	"""Serve score_listing over local HTTP/JSON until interrupted.
+	
+	POST /score with {"listing": {...}, "tags": [...], "config": {...}} returns
+	the score_listing dict; GET /health returns {"status": "ok"}.
+	"""
+	from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+	
+	class ScoreHandler(BaseHTTPRequestHandler):
+		def _reply(self, status: int, body: Dict[str, Any]) -> None:
+			payload = json.dumps(body).encode()
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(payload)))
+			self.end_headers()
+			self.wfile.write(payload)
+		
+		def do_GET(self) -> None:
+			if self.path == "/health":
+				self._reply(200, {"status": "ok"})
+			else:
+				self._reply(404, {"error": "not found"})
+		
+		def do_POST(self) -> None:
+			if self.path != "/score":
+				self._reply(404, {"error": "not found"})
+				return
+			try:
+				request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+				result = score_listing(
+					request["listing"], request.get("tags", []), request.get("config"), market_index=market_index,
+				)
+			except (KeyError, TypeError, ValueError) as e:
+				self._reply(400, {"error": str(e)})
+				return
+			# JSON has no NaN; missing estimates become null
+			self._reply(200, {key: None if isinstance(value, float) and math.isnan(value) else value for key, value in result.items()})
+		
+		def log_message(self, format: str, *args: Any) -> None:
+			pass
+	
+	server = ThreadingHTTPServer((host, port), ScoreHandler)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+
+
+# Hive partition columns of results written by write_analysis_parquet
+RESULT_PARTITION_COLUMNS = ("state", "city", "run_date")
+
+# Comparison operators accepted by read_analysis_parquet filters
+_FILTER_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+	"==": lambda field, value: field == value,
+	"=": lambda field, value: field == value,
+	"!=": lambda field, value: field != value,
+	"<": lambda field, value: field < value,
+	"<=": lambda field, value: field <= value,
+	">": lambda field, value: field > value,
+	">=": lambda field, value: field >= value,
+	"in": lambda field, value: field.isin(list(value)),
+	"not in": lambda field, value: ~field.isin(list(value)),
+}
+
+
+def write_analysis_parquet(
+	df: pd.DataFrame,
+	root: str,
+	run_date: Any = None,
+	sort_by: Sequence[str] = ("price",),
+	row_group_rows: int = 64_000,
+	compression: str = "zstd",
+) -> None:
+	"""Persist analysis results as a Hive-partitioned Parquet dataset.
+	
+	Files are laid out as ``root/state=TX/city=Austin/run_date=2026-01-31/``.
+	Within each partition rows are sorted by ``sort_by`` and cut into row
+	groups of at most ``row_group_rows``, each with min/max statistics, so
+	read_analysis_parquet can skip row groups outside a filtered range.
+	Writing a run date again replaces that date's partitions.
+	
+	Args:
+		df: Output of run_fix_and_flip_analysis (or any frame with state and city)
+		root: Dataset directory (created when missing)
+		run_date: Date of the run (date, datetime or "YYYY-MM-DD"; default today)
+		sort_by: Columns to sort rows by within a partition (missing ones are skipped)
+		row_group_rows: Maximum rows per row group
+		compression: Parquet compression codec
+		
+	Raises:
+		ImportError: When pyarrow isn't installed
+	"""
+	if pa_dataset is None:
+		raise ImportError("write_analysis_parquet requires pyarrow")
+	if run_date is None:
+		run_date = time.strftime("%Y-%m-%d")
+	elif hasattr(run_date, "isoformat"):
+		run_date = run_date.isoformat()[:10]
+	
+	# Partition values are written as strings; missing locations get Hive's default partition
+	out = df.reset_index(drop=True)
+	for column in RESULT_PARTITION_COLUMNS[:-1]:
+		out[column] = out[column].astype("string")
+	out["run_date"] = str(run_date)
+	order = list(RESULT_PARTITION_COLUMNS[:-1]) + [column for column in sort_by if column in out.columns]
+	out = out.sort_values(order, kind="stable", na_position="last", ignore_index=True)
+	
+	table = pa.Table.from_pandas(out, preserve_index=False)
+	partitioning = pa_dataset.partitioning(
+		pa.schema([(column, pa.string()) for column in RESULT_PARTITION_COLUMNS]), flavor="hive",
+	)
+	file_format = pa_dataset.ParquetFileFormat()
+	pa_dataset.write_dataset(
+		table,
+		root,
+		format=file_format,
+		file_options=file_format.make_write_options(compression=compression, write_statistics=True),
+		partitioning=partitioning,
+		basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+		max_rows_per_group=row_group_rows,
+		min_rows_per_group=min(row_group_rows, 1024),
+		existing_data_behavior="delete_matching",
+	)
+
+
+def _parse_filter(text: str) -> Tuple[str, str, Any]:
+	"""Split a filter such as ``"roi > 20"`` or ``"state == 'TX'"`` into (column, op, value)."""
+	for op in ("not in", ">=", "<=", "!=", "==", " in ", ">", "<", "="):
+		column, found, value = text.partition(op)
+		if found and column.strip():
+			break
+	else:
+		raise ValueError(f"Cannot parse filter {text!r}: expected '<column> <op> <value>'")
+	value = value.strip()
+	if op.strip() in ("in", "not in"):
+		return column.strip(), op.strip(), tuple(_parse_literal(item) for item in value.strip("()[]").split(",") if item.strip())
+	return column.strip(), op, _parse_literal(value)
+
+
+def _parse_literal(text: str) -> Any:
+	text = text.strip()
+	if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+		return text[1:-1]
+	try:
+		return float(text)
+	except ValueError:
+		return text
+
+
+def _filter_expression(filters: Sequence[Any]) -> Any:
+	"""AND of ``filters`` (strings or (column, op, value) tuples) as a pyarrow dataset expression."""
+	expression = None
+	for item in filters:
+		column, op, value = _parse_filter(item) if isinstance(item, str) else item
+		if op not in _FILTER_OPERATORS:
+			raise ValueError(f"Unsupported filter operator {op!r} in {item!r}")
+		# Partition columns are strings, so compare them against the value's text
+		if column in RESULT_PARTITION_COLUMNS:
+			value = [str(v) for v in value] if op in ("in", "not in") else str(value)
+		term = _FILTER_OPERATORS[op](pa_dataset.field(column), value)
+		expression = term if expression is None else expression & term
+	return expression
+
+
+def read_analysis_parquet(
+	root: str,
+	filters: Optional[Sequence[Any]] = None,
+	columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+	"""Read analysis results written by write_analysis_parquet, pushing filters down.
+	
+	Filters on partition columns (state, city, run_date) prune whole
+	directories; filters on other columns are checked against row-group
+	statistics, so only row groups that can match are decoded.
+	
+	Args:
+		root: Dataset directory
+		filters: Conditions that must all hold, as strings ("roi > 20",
+			"state == 'TX'", "city in (Austin, Dallas)") or (column, op, value) tuples
+		columns: Columns to load (default all)
+		
+	Returns:
+		DataFrame of the matching rows
+		
+	Raises:
+		ImportError: When pyarrow isn't installed
+		ValueError: For unparseable filters or unsupported operators
+	"""
+	if pa_dataset is None:
+		raise ImportError("read_analysis_parquet requires pyarrow")
+	partitioning = pa_dataset.partitioning(
+		pa.schema([(column, pa.string()) for column in RESULT_PARTITION_COLUMNS]), flavor="hive",
+	)
+	dataset = pa_dataset.dataset(root, format="parquet", partitioning=partitioning)
+	expression = _filter_expression(filters) if filters else None
+	table = dataset.to_table(columns=list(columns) if columns is not None else None, filter=expression)
+	return table.to_pandas()
+
+
+# Scraper worker record fields -> FixAndFlipProfile columns
+WORKER_FIELD_MAP: Dict[str, str] = {
+	"listing_id": "listingId",
+	"beds": "bedrooms",
+	"baths": "bathrooms",
+	"sqft": "squareFeet",
+	"address_city": "city",
+	"address_state": "state",
+	"address_zip": "zip",
+	"listing_status": "status",
+}
+
+NUMERIC_COLUMNS = ("price", "squareFeet", "bedrooms", "bathrooms", "latitude", "longitude")
+
+PART_SUFFIXES = (".ndjson", ".ndjson.gz", ".ndjson.zst")
+
+
+def normalize_worker_records(df: pd.DataFrame) -> pd.DataFrame:
+	"""Rename scraper worker fields to profile columns and coerce numeric fields.
+	
+	Args:
+		df: Records as written by the scraper worker (beds, baths, sqft, address_city, ...)
+		
+	Returns:
+		DataFrame with listingId, price, squareFeet, bedrooms, bathrooms, city,
+		state, zip and status columns (missing fields become NaN)
+	"""
+	df = df.rename(columns={k: v for k, v in WORKER_FIELD_MAP.items() if k in df.columns})
+	for column in ("listingId", "price", "squareFeet", "bedrooms", "bathrooms", "city", "state", "zip", "status"):
+		if column not in df.columns:
+			df[column] = np.nan
+	for column in NUMERIC_COLUMNS:
+		if column in df.columns and df[column].dtype == object:
+			# LLM extraction may return prices like "$350,000"
+			cleaned = df[column].astype(str).str.replace(r"[$,\s]", "", regex=True)
+			df[column] = pd.to_numeric(cleaned, errors="coerce")
+		elif column in df.columns:
+			df[column] = pd.to_numeric(df[column], errors="coerce")
 	return df
 
 
+def iter_part_files(paths: Any) -> Iterator[str]:
+	"""Yield NDJSON part files (plain, .gz or .zst) under files or directories.
+	
+	Directories are walked recursively in sorted order, so a local mirror of the
+	worker's ``<prefix>/<day>/part-*.ndjson.zst`` layout is read day by day.
+	"""
+	if isinstance(paths, (str, os.PathLike)):
+		paths = [paths]
+	for path in paths:
+		path = os.fspath(path)
+		if os.path.isdir(path):
+			for root, dirs, files in os.walk(path):
+				dirs.sort()
+				for name in sorted(files):
+					if name.endswith(PART_SUFFIXES):
+						yield os.path.join(root, name)
+		else:
+			yield path
+
+
+@functools.lru_cache(maxsize=16)
+def _load_zstd_dictionary(path: str) -> Any:
+	with open(path, "rb") as f:
+		return zstd.ZstdCompressionDict(f.read())
+
+
+def _zstd_dictionary_for(path: str, dict_id: int) -> Any:
+	"""Find the dictionary a part was compressed with in ``_dictionaries/`` next to it or above it."""
+	directory = os.path.dirname(os.path.abspath(path))
+	while True:
+		candidate = os.path.join(directory, "_dictionaries", f"{dict_id}.zdict")
+		if os.path.exists(candidate):
+			return _load_zstd_dictionary(candidate)
+		parent = os.path.dirname(directory)
+		if parent == directory:
+			raise FileNotFoundError(f"{path} needs zstd dictionary {dict_id} (_dictionaries/{dict_id}.zdict)")
+		directory = parent
+
+
+def _open_part(path: str) -> io.TextIOBase:
+	if path.endswith(".zst"):
+		if zstd is None:
+			raise ImportError("zstandard is required to read .zst parts")
+		with open(path, "rb") as f:
+			dict_id = zstd.get_frame_parameters(f.read(18)).dict_id
+		dictionary = _zstd_dictionary_for(path, dict_id) if dict_id else None
+		raw = zstd.ZstdDecompressor(dict_data=dictionary).stream_reader(open(path, "rb"), closefd=True)
+		return io.TextIOWrapper(raw, encoding="utf-8")
+	if path.endswith(".gz"):
+		return gzip.open(path, "rt", encoding="utf-8")
+	return open(path, "r", encoding="utf-8")
+
+
+def iter_record_chunks(paths: Any, chunk_rows: int = 50_000) -> Iterator[pd.DataFrame]:
+	"""Stream worker part files as normalized DataFrame chunks of at most chunk_rows.
+	
+	Heartbeat records (written for listing pages that haven't changed since
+	their last scrape) are skipped.
+	"""
+	records: List[Dict[str, Any]] = []
+	for path in iter_part_files(paths):
+		with _open_part(path) as fh:
+			for line in fh:
+				line = line.strip()
+				if not line:
+					continue
+				record = json.loads(line)
+				if record.get("record_type") == "heartbeat":
+					continue
+				records.append(record)
+				if len(records) >= chunk_rows:
+					yield normalize_worker_records(pd.DataFrame.from_records(records))
+					records = []
+	if records:
+		yield normalize_worker_records(pd.DataFrame.from_records(records))
+
+
+def _partition_of(values: pd.Series, num_partitions: int) -> np.ndarray:
+	return (pd.util.hash_pandas_object(values, index=False).to_numpy() % num_partitions).astype(np.int64)
+
+
+def _latest_per_listing(df: pd.DataFrame) -> pd.DataFrame:
+	"""Keep the latest record (by ``ts``, then input order) per listingId; rows without an id are all kept."""
+	if "ts" in df.columns:
+		df = df.sort_values("ts", kind="stable")
+	has_id = df["listingId"].notna()
+	return pd.concat([
+		df[has_id].drop_duplicates("listingId", keep="last"),
+		df[~has_id],
+	])
+
+
+def _read_pickles(path: str) -> Iterator[Any]:
+	if not os.path.exists(path):
+		return
+	with open(path, "rb") as fh:
+		while True:
+			try:
+				yield pickle.load(fh)
+			except EOFError:
+				return
+
+
+def _external_order_statistic(
+	read_values: Callable[[], Iterator[np.ndarray]],
+	rank: int,
+	low: float,
+	high: float,
+	max_in_memory: int,
+	bins: int = 1024,
+) -> float:
+	"""Exact ``rank``-th smallest value of a re-readable stream, narrowing by histogram."""
+	while True:
+		below = 0
+		inside = 0
+		for values in read_values():
+			below += int(np.count_nonzero(values < low))
+			inside += int(np.count_nonzero((values >= low) & (values <= high)))
+		if inside <= max_in_memory or low == high:
+			selected = np.concatenate([
+				values[(values >= low) & (values <= high)] for values in read_values()
+			])
+			return float(np.partition(selected, rank - below)[rank - below])
+		edges = np.linspace(low, high, bins + 1)
+		counts = np.zeros(bins, dtype=np.int64)
+		for values in read_values():
+			counts += np.histogram(values[(values >= low) & (values <= high)], bins=edges)[0]
+		bin_index = int(np.searchsorted(np.cumsum(counts), rank - below, side="right"))
+		new_low, new_high = float(edges[bin_index]), float(edges[bin_index + 1])
+		if (new_low, new_high) == (low, high):
+			max_in_memory = inside
+		low, high = new_low, new_high
+
+
+def _external_median(read_values: Callable[[], Iterator[np.ndarray]], max_in_memory: int = 1_000_000) -> float:
+	"""Exact median (NaN ignored, like ``Series.median()``) of a re-readable value stream."""
+	count = 0
+	low = math.inf
+	high = -math.inf
+	for values in read_values():
+		if len(values):
+			count += len(values)
+			low = min(low, float(values.min()))
+			high = max(high, float(values.max()))
+	if count == 0:
+		return math.nan
+	lower = _external_order_statistic(read_values, (count - 1) // 2, low, high, max_in_memory)
+	if count % 2:
+		return lower
+	upper = _external_order_statistic(read_values, count // 2, low, high, max_in_memory)
+	return (lower + upper) / 2
+
+
+def stream_fix_and_flip_analysis(
+	part_paths: Any,
+	tags: List[str],
+	output_path: str,
+	config: Optional[Dict[str, Any]] = None,
+	chunk_rows: int = 50_000,
+	num_partitions: int = 64,
+	spill_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""Run the fix-and-flip analysis over worker NDJSON parts without loading them at once.
+	
+	Pass one streams the parts in chunks, keeps the latest record (by ``ts``)
+	per listing, and spills listings into partitions by city, collecting the
+	PPSF values for the overall fallback median. Each chunk is reduced to
+	its latest record per listing before it is spilled, and each listing
+	partition is reduced one spilled piece at a time, so a listing scraped
+	on every day read costs one row, not one per day. Pass two scores one
+	city partition at a time (PPSF medians and comps never cross a city) and
+	appends the results to ``output_path`` as NDJSON. Memory is bounded by the
+	chunk size and the distinct listings in the largest partition, not by
+	the number of days read.
+	
+	Args:
+		part_paths: Part files or directories (e.g. a local mirror of the S3 records prefix)
+		tags: Analysis tags, as for run_fix_and_flip_analysis ("radius_miles:X" and "knn_comps" are not supported)
+		output_path: NDJSON file the scored listings are written to
+		config: Optional configuration dictionary
+		chunk_rows: Records per chunk read from the parts
+		num_partitions: Number of on-disk partitions listings are spread over
+		spill_dir: Directory for intermediate partitions (a temporary directory by default)
+		
+	Returns:
+		Summary dict with records_read, listings_scored and partitions
+	"""
+	if _parse_radius_miles(tags) is not None or "knn_comps" in tags:
+		raise ValueError("radius_miles and knn_comps comps cross city partitions and are not supported when streaming")
+	
+	with tempfile.TemporaryDirectory(dir=spill_dir) as work_dir:
+		def spill_path(stage: str, partition: int) -> str:
+			return os.path.join(work_dir, f"{stage}-{partition:04d}.pkl")
+		
+		def spill(stage: str, df: pd.DataFrame, keys: pd.Series) -> None:
+			partitions = _partition_of(keys, num_partitions)
+			for partition in np.unique(partitions):
+				with open(spill_path(stage, int(partition)), "ab") as fh:
+					pickle.dump(df[partitions == partition], fh, protocol=pickle.HIGHEST_PROTOCOL)
+		
+		# Pass one: spill by listing so every copy of a listing lands in one partition
+		records_read = 0
+		for chunk in iter_record_chunks(part_paths, chunk_rows):
+			records_read += len(chunk)
+			chunk = _latest_per_listing(chunk)
+			spill("listing", chunk, chunk["listingId"].astype(str))
+		
+		# Keep the latest record per listing, then re-spill by city and collect PPSF values
+		ppsf_path = os.path.join(work_dir, "ppsf.pkl")
+		with open(ppsf_path, "ab") as ppsf_fh:
+			for partition in range(num_partitions):
+				listings = None
+				for piece in _read_pickles(spill_path("listing", partition)):
+					# Later pieces go last, so equal timestamps still resolve to the last record read
+					listings = _latest_per_listing(piece if listings is None else pd.concat([listings, piece], ignore_index=True))
+				if listings is None:
+					continue
+				ppsf = (listings["price"] / listings["squareFeet"].replace(0, 1)).to_numpy(dtype=float)
+				pickle.dump(ppsf[~np.isnan(ppsf)], ppsf_fh, protocol=pickle.HIGHEST_PROTOCOL)
+				spill("city", listings, listings["city"])
+				os.remove(spill_path("listing", partition))
+		
+		fallback_median = _external_median(lambda: _read_pickles(ppsf_path))
+		
+		# Pass two: score one city partition at a time
+		plan = AnalysisPlan.from_tags(tags, normalize_worker_records(pd.DataFrame()).columns)
+		listings_scored = 0
+		partitions_scored = 0
+		with open(output_path, "w", encoding="utf-8") as out:
+			for partition in range(num_partitions):
+				pieces = list(_read_pickles(spill_path("city", partition)))
+				if not pieces:
+					continue
+				profile = FixAndFlipProfile(pd.concat(pieces, ignore_index=True), config, copy_free=True)
+				profile.ppsf_fallback_median = fallback_median
+				result = plan.execute(profile, tags)
+				text = result.to_json(orient="records", lines=True)
+				out.write(text if text.endswith("\n") else text + "\n")
+				listings_scored += len(result)
+				partitions_scored += 1
+				os.remove(spill_path("city", partition))
+	
+	return {
+		"records_read": records_read,
+		"listings_scored": listings_scored,
+		"partitions": partitions_scored,
+	}
+
+
 # Example usage:
 if __name__ == "__main__":
 	# Create sample property DataFrame
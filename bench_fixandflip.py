@@ -0,0 +1,275 @@
+"""Benchmarks for Fixandflip.py on seeded synthetic markets.
+
+Times and memory-profiles every compute_* step and a set of
+run_fix_and_flip_analysis tag combinations, and writes the results as JSON
+so runs can be compared across commits:
+
+	python bench_fixandflip.py --sizes 1k,10k --output bench.json
+	python bench_fixandflip.py --sizes 1k,10k --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from Fixandflip import ANALYSIS_STEPS, AnalysisPlan, FixAndFlipProfile, MarketIndex, run_fix_and_flip_analysis, score_listing
+
+
+# run_fix_and_flip_analysis tag combinations benchmarked at every size
+TAG_COMBINATIONS: Dict[str, List[str]] = {
+	"ppsf": ["ppsf_analysis"],
+	"comps": ["comp_analysis"],
+	"comps_same_zip": ["comp_analysis", "same_zip_only", "exclude_pending"],
+	"comps_radius": ["comp_analysis", "radius_miles:2"],
+	"full": ["arp", "70_percent_method", "roi_calc", "buying_from_realtor", "include_permit_costs"],
+	"full_filtered": [
+		"arp", "70_percent_method", "roi_calc", "buying_from_realtor",
+		"exclude_pending", "exclude_sold", "itemize_room_costs", "high_end_renovation",
+	],
+}
+
+# score_listing latency target (milliseconds, 99th percentile)
+SCORE_P99_TARGET_MS = 5.0
+
+STATES = ("TX", "FL", "CA", "AZ", "GA", "NC", "OH", "CO")
+
+
+def generate_listings(n_rows: int, seed: int = 0, n_cities: Optional[int] = None) -> pd.DataFrame:
+	"""Generate a seeded synthetic market with realistic listing distributions.
+	
+	City sizes follow a Zipf-like law, each city has its own price level and
+	a handful of zip codes around it; square footage is log-normal, bedrooms
+	and bathrooms follow square footage, and prices are sqft x local PPSF
+	with noise. About 10% of listings are Pending and 8% Sold.
+	
+	Args:
+		n_rows: Number of listings
+		seed: Random seed; the same (n_rows, seed) always gives the same frame
+		n_cities: Number of cities (default scales with n_rows)
+	
+	Returns:
+		DataFrame with listingId, price, squareFeet, bedrooms, bathrooms, city,
+		state, zip, status, latitude and longitude columns
+	"""
+	rng = np.random.default_rng(seed)
+	if n_cities is None:
+		n_cities = int(np.clip(np.sqrt(n_rows) / 2, 5, 2000))
+	
+	# City sizes ~ 1/rank, each city with a price level, state and center
+	weights = 1.0 / np.arange(1, n_cities + 1)
+	city = rng.choice(n_cities, size=n_rows, p=weights / weights.sum())
+	city_ppsf = rng.lognormal(np.log(180), 0.45, n_cities)
+	city_state = rng.choice(len(STATES), n_cities)
+	city_lat = rng.uniform(26, 47, n_cities)
+	city_lon = rng.uniform(-122, -75, n_cities)
+	
+	# Zip codes: up to 12 per city, each shifting the local price level
+	zips_per_city = rng.integers(2, 13, n_cities)
+	zip_slot = (rng.random(n_rows) * zips_per_city[city]).astype(np.int64)
+	zip_code = city * 12 + zip_slot
+	zip_factor = rng.lognormal(0, 0.15, n_cities * 12)
+	
+	sqft = np.clip(rng.lognormal(np.log(1700), 0.4, n_rows), 400, 9000).round(-1)
+	bedrooms = np.clip(np.round(sqft / 600 + rng.normal(0, 0.7, n_rows)), 1, 7)
+	bathrooms = np.clip(np.round((bedrooms * 0.6 + rng.normal(0, 0.4, n_rows)) * 2) / 2, 1, 5)
+	ppsf = city_ppsf[city] * zip_factor[zip_code] * rng.lognormal(0, 0.2, n_rows)
+	price = (sqft * ppsf).round(-3)
+	
+	return pd.DataFrame({
+		"listingId": np.arange(n_rows).astype(str),
+		"price": price,
+		"squareFeet": sqft,
+		"bedrooms": bedrooms,
+		"bathrooms": bathrooms,
+		"city": np.char.add("City ", city.astype(str)),
+		"state": np.asarray(STATES)[city_state[city]],
+		"zip": np.char.zfill((10000 + zip_code).astype(str), 5),
+		"status": rng.choice(["Active", "Pending", "Sold"], n_rows, p=[0.82, 0.10, 0.08]),
+		"latitude": city_lat[city] + rng.normal(0, 0.08, n_rows),
+		"longitude": city_lon[city] + rng.normal(0, 0.1, n_rows),
+	})
+
+
+def _measure(func, repeat: int) -> Dict[str, float]:
+	"""Best-of-``repeat`` wall time, then peak traced memory from one extra run."""
+	times = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - started)
+	tracemalloc.start()
+	try:
+		func()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return {"seconds": min(times), "peak_bytes": peak}
+
+
+def bench_steps(df: pd.DataFrame, repeat: int, only: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Benchmark each compute_* step alone, on a frame that already has its inputs."""
+	results = []
+	for step in ANALYSIS_STEPS:
+		if only and only not in f"step:{step.name}":
+			continue
+		# Modifier tags are covered by TAG_COMBINATIONS; steps run with defaults here
+		tags: List[str] = []
+		prepared = df
+		if step.requires:
+			plan = AnalysisPlan.from_tags([_STEP_TAGS[name] for name in _producers_of(step)])
+			prepared = plan.execute(FixAndFlipProfile(df), tags)
+		method = step.method
+		
+		def run() -> None:
+			getattr(FixAndFlipProfile(prepared, copy_free=True), method)(tags)
+		
+		results.append({"benchmark": f"step:{step.name}", **_measure(run, repeat)})
+	return results
+
+
+# One tag that requests each step on its own
+_STEP_TAGS: Dict[str, str] = {
+	"ppsf": "ppsf_analysis",
+	"comps": "comp_analysis",
+	"arp": "arp",
+	"renovation": "renovation_cost",
+	"70_percent": "70_percent_method",
+	"roi": "roi_calc",
+}
+
+
+def _producers_of(step) -> List[str]:
+	"""Names of the steps producing ``step``'s required columns."""
+	return [other.name for other in ANALYSIS_STEPS if set(other.produces) & set(step.requires)]
+
+
+def bench_tag_combinations(df: pd.DataFrame, repeat: int, only: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Benchmark full run_fix_and_flip_analysis calls for TAG_COMBINATIONS."""
+	results = []
+	for name, tags in TAG_COMBINATIONS.items():
+		if only and only not in f"run:{name}":
+			continue
+		def run() -> None:
+			run_fix_and_flip_analysis(df, tags)
+		
+		results.append({"benchmark": f"run:{name}", **_measure(run, repeat)})
+	return results
+
+
+def bench_score_listing(df: pd.DataFrame, queries: int = 2000, only: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Measure single-listing score_listing latency against a prebuilt MarketIndex."""
+	if only and only not in "score_listing":
+		return []
+	tags = ["exclude_pending", "buying_from_realtor"]
+	market_index = MarketIndex.from_frame(df, tags)
+	listings = df.sample(min(queries, len(df)), random_state=0).to_dict("records")
+	latencies = []
+	for listing in listings:
+		started = time.perf_counter()
+		score_listing(listing, tags, market_index=market_index)
+		latencies.append(time.perf_counter() - started)
+	p99_ms = float(np.percentile(latencies, 99) * 1000)
+	return [{
+		"benchmark": "score_listing",
+		"seconds": float(np.mean(latencies)),
+		"peak_bytes": 0,
+		"p50_ms": float(np.percentile(latencies, 50) * 1000),
+		"p99_ms": p99_ms,
+		"within_target": p99_ms <= SCORE_P99_TARGET_MS,
+	}]
+
+
+def _parse_size(text: str) -> int:
+	text = text.strip().lower()
+	multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+	return int(float(text.rstrip("km")) * multiplier)
+
+
+def _git_commit() -> Optional[str]:
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"],
+			capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+		).stdout.strip()
+	except Exception:
+		return None
+
+
+def run_benchmarks(sizes: Sequence[int], seed: int = 0, repeat: int = 3, only: Optional[str] = None) -> Dict[str, Any]:
+	"""Run every benchmark at every size.
+	
+	Args:
+		sizes: Synthetic market sizes (rows)
+		seed: Generator seed
+		repeat: Timing repetitions per benchmark (best is kept)
+		only: Substring filter on benchmark names
+	
+	Returns:
+		Dict with run metadata and one result entry per (size, benchmark)
+	"""
+	results = []
+	for size in sizes:
+		df = generate_listings(size, seed=seed)
+		entries = bench_steps(df, repeat, only) + bench_tag_combinations(df, repeat, only) + bench_score_listing(df, only=only)
+		for entry in entries:
+			entry = {"rows": size, **entry}
+			results.append(entry)
+			line = f"{size:>9,} {entry['benchmark']:<22} {entry['seconds']:9.3f}s {entry['peak_bytes'] / 2**20:9.1f} MiB"
+			if "p99_ms" in entry:
+				line += f"  p50 {entry['p50_ms']:.3f} ms  p99 {entry['p99_ms']:.3f} ms (target {SCORE_P99_TARGET_MS} ms)"
+			print(line, flush=True)
+	return {
+		"commit": _git_commit(),
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"pandas": pd.__version__,
+		"seed": seed,
+		"repeat": repeat,
+		"results": results,
+	}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> None:
+	"""Print time and memory ratios (current / baseline) for matching benchmarks."""
+	before = {(r["rows"], r["benchmark"]): r for r in baseline["results"]}
+	print(f"\ncompared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+	for result in current["results"]:
+		old = before.get((result["rows"], result["benchmark"]))
+		if old is None:
+			continue
+		time_ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("nan")
+		memory_ratio = result["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] else float("nan")
+		print(f"{result['rows']:>9,} {result['benchmark']:<22} time x{time_ratio:6.2f}  memory x{memory_ratio:6.2f}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--sizes", default="1k,10k,100k,1m", help="comma-separated row counts (e.g. 1k,10k,100k,1m)")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--repeat", type=int, default=3, help="timing repetitions; the best is kept")
+	parser.add_argument("--only", help="only run benchmarks whose name contains this")
+	parser.add_argument("--output", help="write results as JSON to this path")
+	parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+	args = parser.parse_args(argv)
+	
+	report = run_benchmarks([_parse_size(size) for size in args.sizes.split(",")], args.seed, args.repeat, args.only)
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	if args.compare:
+		with open(args.compare) as f:
+			compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1 @@
+# Lets tests import Fixandflip when pytest runs from the repository root
@@ -0,0 +1,118 @@
+"""Equivalence check and pages/sec benchmark for worker.extract.
+
+Scans every page with both the fast extractor and the BeautifulSoup
+reference, fails on the first difference, then reports throughput (pages
+the fast scan hands to BeautifulSoup count at BeautifulSoup speed):
+
+    python bench_extract.py                              # synthetic pages
+    python bench_extract.py --html-dir tests/fixtures/   # saved *.html fixtures
+"""
+
+import argparse
+import json
+import pathlib
+import random
+import sys
+import time
+from typing import Callable, List
+
+from worker.extract import UnsupportedMarkup, loads_json, scan, scan_page, scan_page_soup
+
+
+def synthetic_page(rng: random.Random, listings: int = 40) -> str:
+    """A search/detail-like page with the constructs the fast scan must handle like html.parser."""
+    ld = {
+        "@type": "SingleFamilyResidence",
+        "name": f"{rng.randint(1, 9999)} Main St",
+        "address": {"streetAddress": "1 Main St", "addressLocality": "Austin", "addressRegion": "TX", "postalCode": "78701"},
+        "floorSize": {"value": rng.randint(600, 5000)},
+        "numberOfRooms": rng.randint(1, 6),
+    }
+    parts = [
+        "<!DOCTYPE html><html><head>",
+        f"<TITLE>Homes for sale &amp; rent &#8211; page {rng.randint(1, 50)} </TITLE>",
+        f'<script type="application/ld+json">{json.dumps(ld)}</script>',
+        f"<script type='application/ld+json'>[{json.dumps(ld)}]</script>",
+        '<script type="application/ld+json"></script>',
+        '<script type="application/ld+json">{"price": NaN}</script>',
+        '<script>var s = "<a href=\'https://www.realtor.com/realestateandhomes-detail/in-script_1\'>";</script>',
+        "<style>a[href] > b { color: red }</style>",
+        '<!-- <a href="https://www.realtor.com/realestateandhomes-detail/commented_2">x</a> -->',
+        '<!-- <script type="application/ld+json">{"name": "commented"}</script> -->',
+        "</head><body>",
+        "<svg><title>icon</title></svg>",
+    ]
+    for i in range(listings):
+        listing_id = rng.randint(10**9, 10**10)
+        href = f"https://www.realtor.com/realestateandhomes-detail/{i}-Oak-Ave_Austin_TX_78701_M{listing_id}"
+        quote = rng.choice(['"', "'", ""])
+        parts.append(
+            f'<div class="card" data-x="a > b"><A class="link" data-q="{"&quot;"}" HREF={quote}{href}?a=1&amp;b=2{quote}>'
+            f"<span>{rng.randint(100, 999)},000</span></A></div>"
+        )
+        parts.append('<a name="anchor">no href</a><a href="">empty</a><a href="/relative/path">rel</a>')
+        parts.append("<p>" + "lorem ipsum dolor sit amet " * rng.randint(5, 30) + "</p>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def _pages_per_second(func: Callable[[str], object], pages: List[str], min_seconds: float = 1.0) -> float:
+    done, started = 0, time.perf_counter()
+    while True:
+        for page in pages:
+            func(page)
+        done += len(pages)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return done / elapsed
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--html-dir", help="directory of saved *.html pages to use as fixtures")
+    parser.add_argument("--pages", type=int, default=50, help="synthetic pages to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.html_dir:
+        pages = [path.read_text(encoding="utf-8", errors="replace") for path in sorted(pathlib.Path(args.html_dir).glob("*.html"))]
+    else:
+        rng = random.Random(args.seed)
+        pages = [synthetic_page(rng) for _ in range(args.pages)]
+    if not pages:
+        print("no pages", file=sys.stderr)
+        return 1
+
+    fallbacks = 0
+    for number, page in enumerate(pages):
+        try:
+            fast = scan_page(page)
+        except UnsupportedMarkup:
+            fallbacks += 1
+            continue
+        soup = scan_page_soup(page)
+        if fast != soup:
+            print(f"page {number}: fast scan differs\n  fast: {fast}\n  soup: {soup}", file=sys.stderr)
+            return 1
+        for block in fast.ld_json:
+            try:
+                expected = json.loads(block or "{}")
+            except ValueError:
+                continue
+            # Compare serialized: NaN never equals itself
+            if json.dumps(loads_json(block or "{}"), sort_keys=True) != json.dumps(expected, sort_keys=True):
+                print(f"page {number}: JSON-LD decodes differently: {block[:200]!r}", file=sys.stderr)
+                return 1
+    print(f"{len(pages)} pages: fast scan matches BeautifulSoup ({fallbacks} fell back to it)")
+
+    size = sum(len(page) for page in pages) / len(pages)
+    fast_rate = _pages_per_second(scan, pages)
+    soup_rate = _pages_per_second(scan_page_soup, pages)
+    print(f"avg page {size / 1024:.1f} KiB")
+    print(f"fast:          {fast_rate:10.1f} pages/s")
+    print(f"BeautifulSoup: {soup_rate:10.1f} pages/s  (fast is x{fast_rate / soup_rate:.1f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1 @@
+# Lets tests import the worker package when pytest runs from the repository root
@@ -0,0 +1,35 @@
+import pathlib
+
+import pytest
+
+from worker.extract import UnsupportedMarkup, scan, scan_page
+
+FIXTURES = sorted((pathlib.Path(__file__).parent / "fixtures").glob("*.html"))
+
+
+def _read(path: pathlib.Path) -> str:
+    return path.read_text(encoding="utf-8")
+
+
+@pytest.mark.filterwarnings("ignore::bs4.XMLParsedAsHTMLWarning")
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda path: path.stem)
+def test_fast_scan_matches_soup(path):
+    page = _read(path)
+    assert scan(page, "fast") == scan(page, "soup")
+
+
+@pytest.mark.parametrize("path", [path for path in FIXTURES if not path.stem.startswith("fallback_")], ids=lambda path: path.stem)
+def test_fast_scan_handles_page_itself(path):
+    # Pages html.parser reads without error recovery must not fall back to BeautifulSoup
+    scan_page(_read(path))
+
+
+@pytest.mark.parametrize("path", [path for path in FIXTURES if path.stem.startswith("fallback_")], ids=lambda path: path.stem)
+def test_fast_scan_refuses_recovered_markup(path):
+    with pytest.raises(UnsupportedMarkup):
+        scan_page(_read(path))
+
+
+def test_links_inside_attribute_values_are_skipped():
+    page = "<div data-tpl='<a href=\"/in-template\">'></div><span title=\"<a href=x>\"></span><a href=\"/real\">r</a>"
+    assert scan_page(page).hrefs == ["/real"]
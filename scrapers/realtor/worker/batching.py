@@ -0,0 +1,111 @@
+import asyncio
+import random
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# SQS accepts at most 10 entries per *_batch call
+SQS_MAX_BATCH = 10
+
+# action -> SQS client method
+_ACTIONS = {
+    "delete": "delete_message_batch",
+    "send": "send_message_batch",
+}
+
+
+class SqsBatchError(Exception):
+    """An entry SQS rejected for good (sender fault) or that kept failing after retries."""
+
+
+class SqsBatcher:
+    """Groups per-message SQS deletes or sends into *_batch calls.
+
+    ``submit`` adds one entry (a ReceiptHandle for deletes, a MessageBody for
+    sends) and resolves once SQS has accepted it. Entries go out in batches
+    of 10, either as soon as 10 are waiting or ``linger_s`` after the first
+    one arrived. Entries that fail with a server-side error, and whole batches
+    whose call raised, are retried with jittered exponential backoff;
+    sender-fault failures (bad receipt handle, oversized body) are not.
+    """
+
+    def __init__(
+        self,
+        sqs,
+        queue_url: str,
+        action: str,
+        linger_s: float = 0.05,
+        max_retries: int = 5,
+        backoff_base_s: float = 0.25,
+    ) -> None:
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.method = _ACTIONS[action]
+        self.linger_s = linger_s
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.stats: Dict[str, int] = {"calls": 0, "entries": 0, "retried": 0, "failed": 0}
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    def submit(self, entry: Dict[str, Any]) -> "asyncio.Future":
+        """Queue one entry (without ``Id``); the returned future resolves when SQS accepted it."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((entry, future))
+        if len(self._pending) >= SQS_MAX_BATCH:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger_s, self._dispatch)
+        return future
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:SQS_MAX_BATCH], self._pending[SQS_MAX_BATCH:]
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retried"] += len(batch)
+                await asyncio.sleep(self.backoff_base_s * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+            entries = [{"Id": str(i), **entry} for i, (entry, _) in enumerate(batch)]
+            self.stats["calls"] += 1
+            try:
+                resp = await getattr(self.sqs, self.method)(QueueUrl=self.queue_url, Entries=entries)
+            except Exception as e:
+                error = e
+                continue
+            for ok in resp.get("Successful", []):
+                self._resolve(batch[int(ok["Id"])][1])
+            error = SqsBatchError("entries missing from response")
+            for failed in resp.get("Failed", []):
+                error = SqsBatchError(f"{failed.get('Code')}: {failed.get('Message')}")
+                if failed.get("SenderFault"):
+                    self._fail(batch[int(failed["Id"])][1], error)
+            # Everything not yet resolved (server-side failures) goes round again
+            batch = [(entry, future) for entry, future in batch if not future.done()]
+            if not batch:
+                return
+        for _, future in batch:
+            self._fail(future, SqsBatchError(f"{self.method} failed after {self.max_retries} retries: {error}"))
+
+    def _resolve(self, future: asyncio.Future) -> None:
+        self.stats["entries"] += 1
+        if not future.done():
+            future.set_result(None)
+
+    def _fail(self, future: asyncio.Future, error: Exception) -> None:
+        self.stats["failed"] += 1
+        if not future.done():
+            future.set_exception(error)
+
+    async def close(self) -> None:
+        """Send whatever is pending and wait for in-flight batches."""
+        self._dispatch()
+        if self._inflight:
+            await asyncio.wait(set(self._inflight))
@@ -15,9 +15,23 @@ class Settings:
     backoff_base_ms: int
     s3_prefix_records: str
     compress_codec: str
+    parse_workers: int
+    parse_queue_size: int
+    html_extractor: str
+    flush_max_in_flight: int
+    part_max_bytes: int
+    multipart_threshold_bytes: int
+    zstd_dict_path: str | None
+    spill_dir: str
+    sqs_batch_linger_ms: int
+    frontier_db_path: str
+    frontier_freshness_s: float
+    frontier_bloom_capacity: int
 
 
 def load_settings() -> Settings:
+    # Empty values fall back to defaults sized from the machine
+    parse_workers = int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1)
     return Settings(
         aws_region=os.getenv("AWS_REGION", "us-east-2"),
         sqs_queue_url=os.getenv("QUEUE_URL", ""),
@@ -30,6 +44,18 @@ def load_settings() -> Settings:
         backoff_base_ms=int(os.getenv("BACKOFF_BASE_MS", "250")),
         s3_prefix_records=os.getenv("S3_PREFIX_RECORDS", "records"),
         compress_codec=os.getenv("COMPRESS_CODEC", "zstd"),  # zstd|gzip
+        parse_workers=parse_workers,  # 0 = parse on the event loop
+        parse_queue_size=int(os.getenv("PARSE_QUEUE_SIZE") or max(1, parse_workers) * 4),
+        html_extractor=os.getenv("HTML_EXTRACTOR", "fast"),  # fast|soup
+        flush_max_in_flight=int(os.getenv("FLUSH_MAX_IN_FLIGHT", "4")),
+        part_max_bytes=int(os.getenv("PART_MAX_BYTES", str(64 * 1024 * 1024))),  # compressed
+        multipart_threshold_bytes=int(os.getenv("MULTIPART_THRESHOLD_BYTES", str(16 * 1024 * 1024))),
+        zstd_dict_path=os.getenv("ZSTD_DICT_PATH") or None,
+        spill_dir=os.getenv("SPILL_DIR", "spill"),  # empty = drop parts that fail every retry
+        sqs_batch_linger_ms=int(os.getenv("SQS_BATCH_LINGER_MS", "50")),
+        frontier_db_path=os.getenv("FRONTIER_DB_PATH", "frontier.sqlite3"),  # empty = no dedup
+        frontier_freshness_s=float(os.getenv("FRONTIER_FRESHNESS_S", str(24 * 3600))),
+        frontier_bloom_capacity=int(os.getenv("FRONTIER_BLOOM_CAPACITY", "2000000")),
     )
 
 
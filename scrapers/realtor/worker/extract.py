@@ -0,0 +1,167 @@
+import html as html_lib
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:
+    from bs4 import BeautifulSoup
+except Exception:  # pragma: no cover
+    BeautifulSoup = None
+
+
+LD_JSON_TYPE = "application/ld+json"
+
+
+@dataclass
+class PageScan:
+    """The parts of a page the rule-based parser and link discovery read."""
+
+    title: Optional[str] = None  # text of the first <title>, None when absent
+    ld_json: List[str] = field(default_factory=list)  # raw <script type="application/ld+json"> bodies
+    hrefs: List[str] = field(default_factory=list)  # href of every <a>, in document order
+
+
+# One left-to-right pass over the document that splits it into markup the
+# way html.parser (the "html.parser" BeautifulSoup builder) does. Every start
+# tag is matched with html.parser's own start tag grammar, so quoted attribute
+# values of any tag (data-tpl='<a href="...">') are consumed, never scanned.
+# Comments and script/style bodies are consumed whole, end tags, declarations
+# and processing instructions run to the next ">". What html.parser has to
+# recover from (unterminated markup, marked sections, a start tag its grammar
+# can't close) is left to BeautifulSoup.
+_NAME_END = r"(?=[\t\n\r\f />\x00])"
+# locatestarttagend_tolerant after the tag name, atomic like its .match()
+_START_TAG_REST = (
+    r"""(?>(?:[\s/]*(?:(?<=['"\s/])[^\s/>][^\s/=>]*(?:\s*=+\s*(?:'[^']*'|"[^"]*"|(?!['"])[^>\s]*)\s*)?"""
+    r"""(?:\s|/(?!>))*)*)?\s*)/?"""
+)
+# Text, end tags and quote-free start tags of other elements; html.parser's
+# grammar always runs such a tag to its first ">"
+_SKIP = (
+    r"(?:[^<]++"
+    r"|<(?!(?ai:a|title|script|style)" + _NAME_END + r")[a-zA-Z][^>'\"\x00]*>"
+    r"|</[^>]*>"
+    r"|<(?![a-zA-Z!/?]))*+"
+)
+_PAGE_RE = re.compile(
+    _SKIP + r"(?:"
+    r"<!--.*?(?P<comment_end>--\s*>|\Z)"
+    r"|<(?P<cdata>(?ai:script|style))" + _NAME_END + r"(?P<cdata_attrs>" + _START_TAG_REST + r")>"
+    r"(?P<body>.*?)(?P<cdata_end></\s*(?ai:(?P=cdata))\s*>|\Z)"
+    r"|<(?P<tag>(?ai:a|title))" + _NAME_END + r"(?P<attrs>" + _START_TAG_REST + r")>"
+    r"|<[a-zA-Z][^\t\n\r\f />\x00]*" + _START_TAG_REST + r">"
+    r"|<(?P<unsupported>!\[|[a-zA-Z])"
+    r"|</[^>]*(?P<end_tag_end>\Z)"
+    r"|<[!?][^>]*(?P<decl_end>>|\Z)"
+    r"|\Z)",
+    re.S,
+)
+# attrfind_tolerant; matched inside the page so its lookbehind sees the tag
+_ATTR_RE = re.compile(r"""((?<=['"\s/])[^\s/>][^\s/=>]*)(\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?(?:\s|/(?!>))*""")
+_TAG_NAME_END_RE = re.compile(r"(?:\s|/(?!>))*")
+_TITLE_END_RE = re.compile(r"</title\s*>", re.A | re.I)
+
+
+class UnsupportedMarkup(ValueError):
+    """The page needs a real parser's error recovery (see scan)."""
+
+
+def _attrs(html: str, start: int, end: int) -> dict:
+    """Attributes of the start tag whose text after the name is html[start:end], up to its ">"."""
+    # Lower-cased names, unescaped values; the last duplicate wins (BeautifulSoup's default)
+    attrs = {}
+    pos = _TAG_NAME_END_RE.match(html, start).end()
+    while pos < end:
+        match = _ATTR_RE.match(html, pos)
+        if not match:
+            break
+        name, rest, value = match.groups()
+        if not rest:
+            value = ""
+        elif value[:1] == value[-1:] and value[:1] in ("'", '"'):
+            value = value[1:-1]
+        attrs[name.lower()] = html_lib.unescape(value)
+        pos = match.end()
+    if html[pos : end + 1].strip() not in (">", "/>"):
+        # html.parser would keep the whole tag as text
+        raise UnsupportedMarkup(f"malformed start tag at offset {start}")
+    return attrs
+
+
+def scan_page(html: str) -> PageScan:
+    """Collect title, JSON-LD blocks and link targets with a regex scan, without building a DOM.
+
+    Raises:
+        UnsupportedMarkup: For unterminated markup, a marked section, a
+            self-closing title, script or style, or a title containing markup
+    """
+    scan = PageScan()
+    for match in _PAGE_RE.finditer(html):
+        group = match.group
+        if group("unsupported") is not None or "" in (
+            group("comment_end"),
+            group("cdata_end"),
+            group("end_tag_end"),
+            group("decl_end"),
+        ):
+            raise UnsupportedMarkup(f"unterminated markup at offset {match.start()}")
+        cdata, tag = group("cdata"), group("tag")
+        if cdata is not None:
+            attrs = _attrs(html, match.start("cdata_attrs"), match.end("cdata_attrs"))
+            # html.parser keeps parsing markup after <script/>
+            if group("cdata_attrs").endswith("/"):
+                raise UnsupportedMarkup(f"self-closing <{cdata}> at offset {match.start()}")
+            if cdata.lower() == "script" and attrs.get("type") == LD_JSON_TYPE:
+                scan.ld_json.append(group("body"))
+        elif tag is not None and tag.lower() == "a":
+            href = _attrs(html, match.start("attrs"), match.end("attrs")).get("href")
+            if href is not None:
+                scan.hrefs.append(href)
+        elif tag is not None and scan.title is None:
+            _attrs(html, match.start("attrs"), match.end("attrs"))
+            end = _TITLE_END_RE.search(html, match.end())
+            inner = html[match.end() : end.start()] if end else "<"
+            # A self-closing title, markup inside it or no closing tag needs real tree building
+            if group("attrs").endswith("/") or "<" in inner:
+                raise UnsupportedMarkup(f"markup inside <title> at offset {match.start()}")
+            scan.title = html_lib.unescape(inner)
+    return scan
+
+
+def scan_page_soup(html: str) -> PageScan:
+    """Reference implementation of scan_page on a full BeautifulSoup tree."""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.find("title")
+    return PageScan(
+        title=title.text if title is not None else None,
+        ld_json=[script.string or "" for script in soup.find_all("script", type=LD_JSON_TYPE)],
+        hrefs=[a["href"] for a in soup.find_all("a", href=True)],
+    )
+
+
+def scan(html: str, extractor: str = "fast") -> PageScan:
+    """Scan a page with the fast extractor, falling back to BeautifulSoup when it can't or when asked to."""
+    if extractor == "soup" and BeautifulSoup is not None:
+        return scan_page_soup(html)
+    try:
+        return scan_page(html)
+    except Exception:
+        if BeautifulSoup is None:
+            raise
+        return scan_page_soup(html)
+
+
+def loads_json(text: str) -> Any:
+    """Decode JSON with orjson, retrying with json for what it rejects (NaN, huge ints)."""
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
@@ -0,0 +1,463 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:
+    import zstandard as zstd  # type: ignore
+except Exception:  # pragma: no cover
+    zstd = None
+
+
+log = logging.getLogger("worker.flush")
+
+# Disambiguates part keys created in the same millisecond by concurrent uploads
+_PART_SEQUENCE = itertools.count()
+
+# S3 rejects multipart chunks under 5 MiB (except the last) and more than 10,000 of them
+MIN_MULTIPART_CHUNK = 5 * 1024 * 1024
+MAX_MULTIPART_CHUNKS = 10_000
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def load_zstd_dictionary(path: Optional[str]) -> Optional["zstd.ZstdCompressionDict"]:
+    if not path or zstd is None:
+        return None
+    with open(path, "rb") as f:
+        return zstd.ZstdCompressionDict(f.read())
+
+
+class PartWriter:
+    """Streams NDJSON records into one compressed in-memory part.
+
+    ``write`` serializes a record on the caller's thread and buffers the
+    line; every ``buffer_bytes`` the buffer is handed to the compressor. With
+    a ``feeder`` (a single-thread executor) compression runs there, in order,
+    so the caller (the event loop) never compresses; without one it runs
+    inline. ``finish`` must run on the feeder too, after the queued writes.
+    The part never exists uncompressed, and ``compressed_bytes`` (which lags
+    the queued writes) drives size-based rollover.
+    """
+
+    def __init__(
+        self,
+        codec: str,
+        level: int = 10,
+        dictionary: Optional["zstd.ZstdCompressionDict"] = None,
+        feeder: Optional[concurrent.futures.Executor] = None,
+        buffer_bytes: int = 128 * 1024,
+    ) -> None:
+        self._sink = io.BytesIO()
+        self.dictionary = None
+        if codec == "zstd" and zstd is not None:
+            self.codec = "zstd"
+            self.dictionary = dictionary
+            cctx = zstd.ZstdCompressor(level=level, dict_data=dictionary)
+            self._stream = cctx.stream_writer(self._sink, closefd=False)
+        else:
+            self.codec = "gzip"
+            self._stream = gzip.GzipFile(fileobj=self._sink, mode="wb", compresslevel=6)
+        self.feeder = feeder
+        self.buffer_bytes = buffer_bytes
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._feeds: List[concurrent.futures.Future] = []
+        self.records = 0
+        self.raw_bytes = 0
+
+    def __len__(self) -> int:
+        return self.records
+
+    @property
+    def compressed_bytes(self) -> int:
+        return self._sink.tell()
+
+    def write(self, record: Dict[str, Any]) -> Optional[Tuple[concurrent.futures.Future, int]]:
+        """Buffer one record; returns (future, bytes) when that handed a chunk to the feeder."""
+        line = _dumps(record) + b"\n"
+        self.records += 1
+        self.raw_bytes += len(line)
+        self._buffer.append(line)
+        self._buffered += len(line)
+        if self._buffered < self.buffer_bytes:
+            return None
+        chunk = b"".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        if self.feeder is None:
+            self._stream.write(chunk)
+            return None
+        future = self.feeder.submit(self._stream.write, chunk)
+        self._feeds.append(future)
+        return future, len(chunk)
+
+    def finish(self) -> bytes:
+        """End the compressed stream and return the part body."""
+        for future in self._feeds:
+            future.result()  # done already on the feeder; re-raises a failed write
+        if self._buffer:
+            self._stream.write(b"".join(self._buffer))
+            self._buffer = []
+        self._stream.close()
+        return self._sink.getvalue()
+
+
+def _part_key(settings, codec: str) -> str:
+    now = datetime.utcnow()
+    key = f"{settings.s3_prefix_records}/{now:%Y%m%d}/part-{now:%H%M%S}-{int(time.time()*1000)}-{next(_PART_SEQUENCE)}.ndjson"
+    return key + (".zst" if codec == "zstd" else ".gz")
+
+
+def dictionary_key(settings, dictionary: "zstd.ZstdCompressionDict") -> str:
+    """Where a part's zstd dictionary is shipped (readers look it up by the frame's dict id)."""
+    return f"{settings.s3_prefix_records}/_dictionaries/{dictionary.dict_id()}.zdict"
+
+
+@dataclass
+class FlushMetrics:
+    parts: int = 0
+    records: int = 0
+    raw_bytes: int = 0
+    bytes_uploaded: int = 0
+    multipart_parts: int = 0
+    retried_uploads: int = 0
+    spilled_parts: int = 0
+    failed_parts: int = 0
+    # Per-part latency from swap to uploaded, split into stream finish and upload
+    last_flush_s: float = 0.0
+    max_flush_s: float = 0.0
+    total_flush_s: float = 0.0
+    total_encode_s: float = 0.0
+    total_upload_s: float = 0.0
+    # Time producers waited to append or for the compressor to catch up, and
+    # the flusher waited for an upload slot
+    append_stall_s: float = 0.0
+    compress_stall_s: float = 0.0
+    upload_stall_s: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["avg_flush_s"] = self.total_flush_s / self.parts if self.parts else 0.0
+        out["compression_ratio"] = self.raw_bytes / self.bytes_uploaded if self.bytes_uploaded else 0.0
+        return out
+
+
+class FlushPipeline:
+    """Double-buffered record sink for the worker's S3 output.
+
+    Producers stream records into the active PartWriter under a lock that is
+    held for one record's serialization or an O(1) writer swap. Compression
+    runs on one feeder thread shared by every writer, so producers on the
+    event loop never compress. The tradeoff: level-10 zstd on one thread is
+    the pipeline's throughput ceiling, and once ``max_compress_backlog``
+    bytes are queued for it producers wait (``compress_stall_s``) rather
+    than let memory grow; a lower ``level`` raises the ceiling at the cost
+    of larger parts. Rollover reads the compressed size, which lags the
+    queue, so a part can overshoot ``part_max_bytes`` by up to the backlog.
+    A part is swapped out when ``flush`` is called or when it reaches
+    ``part_max_bytes`` compressed. Swapped-out parts are finished on the
+    feeder and uploaded concurrently (multipart above ``multipart_threshold``); at most
+    ``max_in_flight`` parts are finishing or uploading at once, after which
+    swapping waits for a slot while producers keep filling the new writer.
+
+    The SQS messages behind a part are already deleted when it uploads, so
+    a failed upload is retried with jittered exponential backoff, and a part
+    that still fails is written to ``spill_dir`` under its S3 key instead of
+    being dropped; ``upload_spilled`` sends those files on the next start.
+    """
+
+    def __init__(
+        self,
+        s3,
+        settings,
+        max_in_flight: int = 4,
+        part_max_bytes: int = 64 * 1024 * 1024,
+        multipart_threshold: int = 16 * 1024 * 1024,
+        multipart_chunk_bytes: int = 8 * 1024 * 1024,
+        dictionary: Optional["zstd.ZstdCompressionDict"] = None,
+        executor=None,
+        max_retries: int = 5,
+        backoff_base_s: float = 0.25,
+        spill_dir: Optional[str] = "spill",
+        level: int = 10,
+        max_compress_backlog: int = 8 * 1024 * 1024,
+    ) -> None:
+        self.s3 = s3
+        self.settings = settings
+        self.part_max_bytes = part_max_bytes
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunk_bytes = max(MIN_MULTIPART_CHUNK, multipart_chunk_bytes)
+        self.dictionary = dictionary
+        self.executor = executor  # None = the loop's default thread pool (spill file I/O)
+        self.level = level
+        self.max_compress_backlog = max_compress_backlog
+        self._feeder = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="flush-compress")
+        self._backlog: Deque[Tuple[concurrent.futures.Future, int]] = collections.deque()
+        self._backlog_bytes = 0
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.spill_dir = spill_dir
+        self.metrics = FlushMetrics()
+        self._active = self._new_writer()
+        self._lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._uploads: Set[asyncio.Task] = set()
+        self._dictionary_shipped = False
+
+    def _new_writer(self) -> PartWriter:
+        return PartWriter(self.settings.compress_codec, self.level, self.dictionary, feeder=self._feeder)
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    async def add(self, record: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        full = None
+        async with self._lock:
+            self.metrics.append_stall_s += time.perf_counter() - started
+            fed = self._active.write(record)
+            if self._active.compressed_bytes >= self.part_max_bytes:
+                full, self._active = self._active, self._new_writer()
+        if fed is not None:
+            await self._wait_for_compressor(*fed)
+        if full is not None:
+            await self._start_upload(full)
+
+    async def _wait_for_compressor(self, future: concurrent.futures.Future, size: int) -> None:
+        # Keep at most max_compress_backlog bytes queued on the feeder thread
+        self._backlog.append((future, size))
+        self._backlog_bytes += size
+        started = time.perf_counter()
+        while self._backlog and (self._backlog[0][0].done() or self._backlog_bytes > self.max_compress_backlog):
+            oldest, oldest_size = self._backlog.popleft()
+            self._backlog_bytes -= oldest_size
+            if not oldest.done():
+                await asyncio.wait([asyncio.wrap_future(oldest)])
+        self.metrics.compress_stall_s += time.perf_counter() - started
+
+    async def flush(self) -> int:
+        """Swap out the active part and start uploading it; returns the number of records."""
+        async with self._lock:
+            if not len(self._active):
+                return 0
+            part, self._active = self._active, self._new_writer()
+        await self._start_upload(part)
+        return len(part)
+
+    async def _start_upload(self, part: PartWriter) -> None:
+        swapped = time.perf_counter()
+        await self._slots.acquire()
+        self.metrics.upload_stall_s += time.perf_counter() - swapped
+        task = asyncio.create_task(self._upload(part, swapped))
+        self._uploads.add(task)
+        task.add_done_callback(self._uploads.discard)
+
+    async def _upload(self, part: PartWriter, swapped: float) -> None:
+        key = _part_key(self.settings, part.codec)
+        extra: Dict[str, Any] = {"ContentType": "application/x-ndjson", "ContentEncoding": part.codec}
+        loop = asyncio.get_running_loop()
+        try:
+            started = time.perf_counter()
+            try:
+                # On the feeder, behind this part's queued writes
+                body = await loop.run_in_executor(self._feeder, part.finish)
+            except Exception as e:
+                self.metrics.failed_parts += 1
+                log.error("encoding %d records failed, part lost: %s", len(part), e)
+                return
+            encoded = time.perf_counter()
+            if part.dictionary is not None:
+                extra["Metadata"] = {"zstd-dict-id": str(part.dictionary.dict_id())}
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.metrics.retried_uploads += 1
+                    await asyncio.sleep(self.backoff_base_s * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+                try:
+                    if part.dictionary is not None:
+                        await self._ship_dictionary(part.dictionary)
+                    if len(body) >= self.multipart_threshold:
+                        await self._put_multipart(key, body, extra)
+                        self.metrics.multipart_parts += 1
+                    else:
+                        await self.s3.put_object(Bucket=self.settings.s3_bucket, Key=key, Body=body, **extra)
+                    break
+                except Exception as e:
+                    log.warning("upload of %s failed (attempt %d/%d): %s", key, attempt + 1, self.max_retries + 1, e)
+            else:
+                await self._spill(key, body, len(part))
+                return
+            done = time.perf_counter()
+        finally:
+            self._slots.release()
+        m = self.metrics
+        m.parts += 1
+        m.records += len(part)
+        m.raw_bytes += part.raw_bytes
+        m.bytes_uploaded += len(body)
+        m.total_encode_s += encoded - started
+        m.total_upload_s += done - encoded
+        m.last_flush_s = done - swapped
+        m.max_flush_s = max(m.max_flush_s, m.last_flush_s)
+        m.total_flush_s += m.last_flush_s
+        log.info("uploaded %s: %d records, %d bytes in %.2fs", key, len(part), len(body), m.last_flush_s)
+
+    async def _spill(self, key: str, body: bytes, records: int) -> None:
+        if not self.spill_dir:
+            self.metrics.failed_parts += 1
+            log.error("upload of %s failed, %d records lost (no spill dir)", key, records)
+            return
+        path = os.path.join(self.spill_dir, key)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, _write_file, path, body)
+        except Exception as e:
+            self.metrics.failed_parts += 1
+            log.error("upload of %s failed and spilling it to %s failed too, %d records lost: %s", key, path, records, e)
+            return
+        self.metrics.spilled_parts += 1
+        log.error("upload of %s failed, %d records spilled to %s", key, records, path)
+
+    async def upload_spilled(self) -> int:
+        """Upload parts a previous run spilled to ``spill_dir`` and delete them; returns how many were sent."""
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return 0
+        loop = asyncio.get_running_loop()
+        sent = 0
+        for root, _, files in os.walk(self.spill_dir):
+            for name in sorted(files):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, self.spill_dir).replace(os.sep, "/")
+                codec = "zstd" if name.endswith(".zst") else "gzip"
+                body = await loop.run_in_executor(self.executor, _read_file, path)
+                try:
+                    await self.s3.put_object(
+                        Bucket=self.settings.s3_bucket, Key=key, Body=body, ContentType="application/x-ndjson", ContentEncoding=codec,
+                    )
+                except Exception as e:
+                    log.warning("re-upload of spilled %s failed, kept for the next start: %s", path, e)
+                    continue
+                os.remove(path)
+                sent += 1
+                log.info("uploaded spilled part %s (%d bytes)", key, len(body))
+        return sent
+
+    async def _put_multipart(self, key: str, body: bytes, extra: Dict[str, Any]) -> None:
+        bucket = self.settings.s3_bucket
+        chunk = max(self.multipart_chunk_bytes, -(-len(body) // MAX_MULTIPART_CHUNKS))
+        upload_id = (await self.s3.create_multipart_upload(Bucket=bucket, Key=key, **extra))["UploadId"]
+        view = memoryview(body)
+
+        async def upload_chunk(number: int, offset: int) -> Dict[str, Any]:
+            resp = await self.s3.upload_part(
+                Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=bytes(view[offset : offset + chunk]),
+            )
+            return {"ETag": resp["ETag"], "PartNumber": number}
+
+        try:
+            parts = await asyncio.gather(*(upload_chunk(i + 1, offset) for i, offset in enumerate(range(0, len(body), chunk))))
+            await self.s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": list(parts)})
+        except BaseException:
+            await self.s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+    async def _ship_dictionary(self, dictionary: "zstd.ZstdCompressionDict") -> None:
+        # Idempotent put, once per process, before the first part that needs it
+        if self._dictionary_shipped:
+            return
+        await self.s3.put_object(
+            Bucket=self.settings.s3_bucket, Key=dictionary_key(self.settings, dictionary),
+            Body=dictionary.as_bytes(), ContentType="application/octet-stream",
+        )
+        self._dictionary_shipped = True
+
+    async def close(self, timeout_s: Optional[float] = None) -> None:
+        """Flush what's buffered and wait for in-flight uploads."""
+        await self.flush()
+        if self._uploads:
+            await asyncio.wait(set(self._uploads), timeout=timeout_s)
+        self._feeder.shutdown(wait=False)
+
+
+def _write_file(path: str, body: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written under a temporary name so upload_spilled never sees half a part
+    with open(path + ".tmp", "wb") as f:
+        f.write(body)
+    os.replace(path + ".tmp", path)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _iter_ndjson_lines(paths: Iterable[str]) -> Iterator[bytes]:
+    for path in paths:
+        if path.endswith(".zst"):
+            fh = io.BufferedReader(zstd.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+        elif path.endswith(".gz"):
+            fh = gzip.open(path, "rb")
+        else:
+            fh = open(path, "rb")
+        with fh:
+            for line in fh:
+                if line.strip():
+                    yield line
+
+
+def train_zstd_dictionary(samples: Iterable[bytes], dict_size: int = 112 * 1024, max_samples: int = 100_000) -> "zstd.ZstdCompressionDict":
+    """Train a zstd dictionary on serialized records (one NDJSON line per sample)."""
+    if zstd is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    return zstd.train_dictionary(dict_size, list(itertools.islice(samples, max_samples)))
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Train a zstd dictionary from existing NDJSON parts (.ndjson, .gz, or .zst written without a dictionary)")
+    parser.add_argument("parts", nargs="+", help="local part files to sample records from")
+    parser.add_argument("--out", required=True, help="dictionary file to write (use it with ZSTD_DICT_PATH)")
+    parser.add_argument("--size", type=int, default=112 * 1024, help="dictionary size in bytes")
+    parser.add_argument("--max-samples", type=int, default=100_000)
+    parser.add_argument("--part-records", type=int, default=500, help="records per part when reporting the ratio")
+    args = parser.parse_args(argv)
+
+    samples = list(itertools.islice(_iter_ndjson_lines(args.parts), args.max_samples))
+    dictionary = train_zstd_dictionary(samples, args.size, args.max_samples)
+    with open(args.out, "wb") as f:
+        f.write(dictionary.as_bytes())
+
+    # Ratio on the training samples cut into worker-sized parts, with and without the dictionary
+    chunks = [b"".join(samples[i : i + args.part_records]) for i in range(0, len(samples), args.part_records)]
+    sizes = []
+    for d in (None, dictionary):
+        cctx = zstd.ZstdCompressor(level=10, dict_data=d)
+        sizes.append(sum(len(cctx.compress(chunk)) for chunk in chunks))
+    raw = sum(len(chunk) for chunk in chunks)
+    print(f"dict id {dictionary.dict_id()}: {len(samples)} samples, {raw} bytes in {len(chunks)} parts -> {sizes[0]} plain, {sizes[1]} with dictionary")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
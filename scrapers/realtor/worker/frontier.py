@@ -0,0 +1,187 @@
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+DETAIL_PATH = "/realestateandhomes-detail/"
+
+
+def canonicalize_url(url: str) -> str:
+    """One spelling per page: https, lower-case host (www.realtor.com), no query/fragment/trailing slash."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host == "realtor.com":
+        host = "www.realtor.com"
+    path = re.sub(r"/{2,}", "/", parts.path).rstrip("/") or "/"
+    return urlunsplit(("https", host, path, "", ""))
+
+
+def listing_key(canonical_url: str) -> str:
+    """Listing ID for detail pages (the trailing ``_M...`` segment), else the URL itself."""
+    path = urlsplit(canonical_url).path
+    if DETAIL_PATH in path and "_" in path:
+        return path.rsplit("_", 1)[-1]
+    return canonical_url
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: str) -> None:
+        for p in self._positions(key):
+            self._bits[p >> 3] |= 1 << (p & 7)
+
+
+@dataclass(frozen=True)
+class PageState:
+    """What the last full scrape of a listing page saw."""
+
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class Frontier:
+    """Drops discovered URLs that were enqueued or scraped within the freshness window.
+
+    URLs are canonicalized and keyed by listing ID. A Bloom filter answers
+    "never seen" without touching disk; keys it may have seen are checked
+    against a SQLite table of last-enqueued / last-scraped times, which
+    persists across runs (and is loaded into the filter at startup). The
+    same database keeps each listing page's last content hash and HTTP
+    validators for change detection. The store is local to one host.
+    Methods are blocking and thread-safe; the worker calls them through
+    ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path: str, freshness_s: float, bloom_capacity: int = 2_000_000, bloom_error_rate: float = 0.01) -> None:
+        self.freshness_s = freshness_s
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self.stats: Dict[str, int] = {"seen": 0, "duplicate": 0, "fresh": 0, "new": 0, "bloom_negative": 0, "released": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frontier (listing_id TEXT PRIMARY KEY, last_enqueued REAL, last_scraped REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (listing_id TEXT PRIMARY KEY, content_hash TEXT, etag TEXT, last_modified TEXT, updated_at REAL)"
+        )
+        cutoff = time.time() - freshness_s
+        for (key,) in self._db.execute(
+            "SELECT listing_id FROM frontier WHERE MAX(IFNULL(last_enqueued, 0), IFNULL(last_scraped, 0)) >= ?", (cutoff,)
+        ):
+            self.bloom.add(key)
+
+    def select_new(self, urls: Iterable[str], now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Claim each distinct URL not enqueued or scraped within the window.
+
+        Returns (canonical URL, listing key) pairs. The selected keys are marked
+        enqueued in the same transaction as the lookup, so two pages listing the
+        same IDs never both select them; ``release`` the keys whose send fails.
+        """
+        now = time.time() if now is None else now
+        candidates: Dict[str, str] = {}
+        seen = 0
+        for url in urls:
+            seen += 1
+            canonical = canonicalize_url(url)
+            candidates.setdefault(listing_key(canonical), canonical)
+        with self._lock:
+            maybe_seen = [key for key in candidates if key in self.bloom]
+            fresh = set()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(maybe_seen), 500):
+                    chunk = maybe_seen[start : start + 500]
+                    rows = self._db.execute(
+                        f"SELECT listing_id FROM frontier WHERE listing_id IN ({','.join('?' * len(chunk))})"
+                        " AND MAX(IFNULL(last_enqueued, 0), IFNULL(last_scraped, 0)) >= ?",
+                        (*chunk, now - self.freshness_s),
+                    )
+                    fresh.update(key for (key,) in rows)
+                selected = [(canonical, key) for key, canonical in candidates.items() if key not in fresh]
+                self._upsert("last_enqueued", [(key, now) for _, key in selected])
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            self.stats["seen"] += seen
+            self.stats["duplicate"] += seen - len(candidates)
+            self.stats["bloom_negative"] += len(candidates) - len(maybe_seen)
+            self.stats["fresh"] += len(fresh)
+            self.stats["new"] += len(selected)
+        return selected
+
+    def release(self, keys: Iterable[str]) -> None:
+        """Undo ``select_new``'s claim on keys that were not enqueued after all."""
+        keys = list(keys)
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("UPDATE frontier SET last_enqueued = NULL WHERE listing_id = ?", [(key,) for key in keys])
+            self._db.execute("COMMIT")
+            self.stats["released"] += len(keys)
+
+    def _upsert(self, column: str, rows: List[Tuple[str, float]]) -> None:
+        # Caller holds the lock and has a transaction open
+        self._db.executemany(
+            f"INSERT INTO frontier (listing_id, {column}) VALUES (?, ?) ON CONFLICT(listing_id) DO UPDATE SET {column} = excluded.{column}",
+            rows,
+        )
+        for key, _ in rows:
+            self.bloom.add(key)
+
+    def _mark(self, column: str, keys: Iterable[str], now: Optional[float]) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._upsert(column, [(key, now) for key in keys])
+            self._db.execute("COMMIT")
+
+    def mark_enqueued(self, keys: Iterable[str], now: Optional[float] = None) -> None:
+        self._mark("last_enqueued", keys, now)
+
+    def mark_scraped(self, url: str, now: Optional[float] = None) -> None:
+        self._mark("last_scraped", [listing_key(canonicalize_url(url))], now)
+
+    def page_state(self, url: str) -> Optional[PageState]:
+        """Last recorded state of the listing page at ``url``, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_hash, etag, last_modified FROM pages WHERE listing_id = ?", (listing_key(canonicalize_url(url)),)
+            ).fetchone()
+        return PageState(*row) if row else None
+
+    def record_page(self, url: str, state: PageState, now: Optional[float] = None) -> None:
+        """Remember a listing page's hash and validators, and mark it scraped."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (listing_id, content_hash, etag, last_modified, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (listing_key(canonicalize_url(url)), state.content_hash, state.etag, state.last_modified, now),
+            )
+        self.mark_scraped(url, now)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,26 +1,25 @@
 import asyncio
-import gzip
 import hashlib
 import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Iterable
+from typing import Any, Dict, Optional, Iterable
 import logging
 
 import aioboto3
 import httpx
-from bs4 import BeautifulSoup
 
 from .config import load_settings
+from .extract import PageScan, loads_json, scan
+from .batching import SqsBatcher
+from .flush import FlushPipeline, load_zstd_dictionary
+from .frontier import DETAIL_PATH, Frontier, PageState
 from .proxy import build_proxy_pool
 from .fingerprint import build_headers
 
-try:
-    import zstandard as zstd  # type: ignore
-except Exception:  # pragma: no cover
-    zstd = None
-
 
 def _content_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()
@@ -33,8 +32,8 @@ def _extract_listing_id(url: str) -> Optional[str]:
     return parts[-1] if len(parts) > 1 else None
 
 
-def parse_listing_with_rules(html: str) -> Dict[str, Any]:
-    soup = BeautifulSoup(html, "html.parser")
+def parse_listing_with_rules(html: str, page: Optional[PageScan] = None) -> Dict[str, Any]:
+    page = page if page is not None else scan(html)
     data: Dict[str, Any] = {
         "price": None,
         "beds": None,
@@ -52,13 +51,12 @@ def parse_listing_with_rules(html: str) -> Dict[str, Any]:
         "property_description": None,
     }
     # Basic fallbacks; rely on LLM when not found
-    title = soup.find("title")
-    if title and title.text:
-        data["property_description"] = title.text.strip()
+    if page.title:
+        data["property_description"] = page.title.strip()
     # Realtor often embeds JSON-LD; try that first
-    for script in soup.find_all("script", type="application/ld+json"):
+    for block in page.ld_json:
         try:
-            obj = json.loads(script.string or "{}")
+            obj = loads_json(block or "{}")
             if isinstance(obj, dict):
                 if "address" in obj:
                     addr = obj["address"]
@@ -115,24 +113,22 @@ async def call_gemini(html: str, settings) -> Optional[Dict[str, Any]]:
     return None
 
 
-def _compress_ndjson(records: List[Dict[str, Any]], codec: str) -> bytes:
-    payload = "\n".join(json.dumps(r, separators=(",", ":"), ensure_ascii=False) for r in records).encode("utf-8")
-    if codec == "zstd" and zstd is not None:
-        cctx = zstd.ZstdCompressor(level=10)
-        return cctx.compress(payload)
-    # fallback gzip
-    return gzip.compress(payload, compresslevel=6)
+async def fetch_url(client: httpx.AsyncClient, url: str, proxy: Optional[str], headers: Dict[str, str], timeout_s: float) -> str:
+    return (await fetch_response(client, url, proxy, headers, timeout_s)).text
 
 
-async def fetch_url(client: httpx.AsyncClient, url: str, proxy: Optional[str], headers: Dict[str, str], timeout_s: float) -> str:
+async def fetch_response(client: httpx.AsyncClient, url: str, proxy: Optional[str], headers: Dict[str, str], timeout_s: float) -> httpx.Response:
+    # Like fetch_url, but keeps the response: 304 Not Modified (conditional GET) is returned, not raised
     for attempt in range(5):
         try:
             resp = await client.get(url, proxy=proxy, headers=headers, timeout=timeout_s, follow_redirects=True)
             if resp.status_code in (429, 500, 502, 503, 504):
                 await asyncio.sleep(0.5 * (attempt + 1))
                 continue
+            if resp.status_code == 304:
+                return resp
             resp.raise_for_status()
-            return resp.text
+            return resp
         except Exception:
             if attempt == 4:
                 raise
@@ -140,10 +136,9 @@ async def fetch_url(client: httpx.AsyncClient, url: str, proxy: Optional[str], h
     raise RuntimeError("unreachable")
 
 
-def extract_listing_links(html: str) -> Iterable[str]:
-    soup = BeautifulSoup(html, "html.parser")
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
+def extract_listing_links(html: str, page: Optional[PageScan] = None) -> Iterable[str]:
+    page = page if page is not None else scan(html)
+    for href in page.hrefs:
         if not href:
             continue
         if "realtor.com" not in href:
@@ -152,35 +147,112 @@ def extract_listing_links(html: str) -> Iterable[str]:
             yield href
 
 
-async def handle_message(session_sqs, session_s3, client: httpx.AsyncClient, msg: Dict[str, Any], settings, proxy_pool) -> Optional[Dict[str, Any]]:
+def parse_page(html: str, is_search: bool, extractor: str = "fast", known_hash: Optional[str] = None) -> Dict[str, Any]:
+    # Runs in a parse worker process: one scan of the page serves links, record and hash
+    if is_search:
+        return {"links": list(extract_listing_links(html, scan(html, extractor)))}
+    content_hash = _content_hash(html)[:16]
+    if content_hash == known_hash:
+        # Same bytes as the last full scrape: skip parsing altogether
+        return {"unchanged": True, "content_hash": content_hash}
+    return {"record": parse_listing_with_rules(html, scan(html, extractor)), "content_hash": content_hash}
+
+
+class ParsePool:
+    """Process pool for CPU-bound HTML parsing, kept off the event loop.
+
+    At most ``queue_size`` pages are in the pool (running or queued) at once.
+    Callers beyond that wait in ``parse``, so fetch workers stop pulling new
+    messages while parsing is the bottleneck instead of piling up HTML.
+    """
+
+    def __init__(self, workers: int, queue_size: int, extractor: str = "fast") -> None:
+        self.workers = workers
+        self.extractor = extractor
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._slots = asyncio.Semaphore(max(1, queue_size))
+
+    async def parse(self, html: str, is_search: bool, known_hash: Optional[str] = None) -> Dict[str, Any]:
+        if self._executor is None:
+            return parse_page(html, is_search, self.extractor, known_hash)
+        async with self._slots:
+            executor = self._executor
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, parse_page, html, is_search, self.extractor, known_hash)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge page); replace the pool once and let SQS redeliver
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                raise
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def handle_message(session_sqs, session_s3, client: httpx.AsyncClient, msg: Dict[str, Any], settings, proxy_pool, parse_pool: Optional[ParsePool] = None, link_sender: Optional[SqsBatcher] = None, frontier: Optional[Frontier] = None) -> Optional[Dict[str, Any]]:
     body = json.loads(msg.get("Body", "{}"))
     url = body.get("url_to_scrape")
     if not url:
         return None
 
+    # Detail URLs also contain "/realestateandhomes"; everything else under it is a search/browse page
+    is_search = "/realestateandhomes-search/" in url or ("/realestateandhomes" in url and DETAIL_PATH not in url)
+    listing_id = _extract_listing_id(url) or _content_hash(url)[:12]
+
+    # Listing pages seen before: conditional GET, and skip parsing if the bytes are unchanged
+    state = await asyncio.to_thread(frontier.page_state, url) if frontier is not None and not is_search else None
     headers = build_headers()
+    if state is not None:
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
     proxy = proxy_pool.select_proxy()
-    html = await fetch_url(client, url, proxy=proxy, headers=headers, timeout_s=settings.request_timeout_s)
+    resp = await fetch_response(client, url, proxy=proxy, headers=headers, timeout_s=settings.request_timeout_s)
+    if resp.status_code == 304 and state is not None:
+        await asyncio.to_thread(frontier.mark_scraped, url)
+        return _heartbeat(listing_id, url, state.content_hash, "not_modified")
+    html = resp.text
+
+    if parse_pool is not None:
+        parsed = await parse_pool.parse(html, is_search, state.content_hash if state else None)
+    else:
+        parsed = parse_page(html, is_search, settings.html_extractor, state.content_hash if state else None)
+
+    validators = PageState(parsed.get("content_hash", ""), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    if parsed.get("unchanged"):
+        # Keep validators fresh: the server may have started sending them since the last scrape
+        await asyncio.to_thread(frontier.record_page, url, validators)
+        return _heartbeat(listing_id, url, parsed["content_hash"], "unchanged")
 
     # If this is a search/browse page, enqueue discovered listing URLs and return None
-    if "/realestateandhomes-search/" in url or "/realestateandhomes" in url:
-        links = list(extract_listing_links(html))
+    if is_search:
+        # Every distinct link not enqueued or scraped recently (claimed by select_new), through the shared batched sender
+        if frontier is not None:
+            selected = await asyncio.to_thread(frontier.select_new, parsed["links"])
+        else:
+            selected = [(l, l) for l in dict.fromkeys(parsed["links"])]
+        links = [l for l, _ in selected]
         if links:
-            entries = [
-                {
-                    "Id": str(i),
-                    "MessageBody": json.dumps({"url_to_scrape": l})
-                }
-                for i, l in enumerate(links[:10])  # batch enqueue a handful to avoid explosion
-            ]
-            try:
-                await session_sqs.send_message_batch(QueueUrl=settings.sqs_queue_url, Entries=entries)
-            except Exception:
-                pass
+            sender = link_sender or SqsBatcher(session_sqs, settings.sqs_queue_url, "send", max_retries=settings.retry_limit, backoff_base_s=settings.backoff_base_ms / 1000)
+            results = await asyncio.gather(
+                *(sender.submit({"MessageBody": json.dumps({"url_to_scrape": l})}) for l in links),
+                return_exceptions=True,
+            )
+            failed = [r for r in results if isinstance(r, Exception)]
+            if frontier is not None and failed:
+                # select_new already claimed these; let a later page enqueue them
+                unsent = [key for (_, key), r in zip(selected, results) if isinstance(r, Exception)]
+                await asyncio.to_thread(frontier.release, unsent)
+            if failed:
+                # Surfaced so the search page isn't acked and gets redelivered
+                raise RuntimeError(f"enqueued {len(links) - len(failed)}/{len(links)} links from {url}: {failed[0]}")
         return None
 
     # parse with rules first
-    record = parse_listing_with_rules(html)
+    record = parsed["record"]
 
     # If sparse, try Gemini inline
     if not any(v for v in record.values() if v):
@@ -188,34 +260,76 @@ async def handle_message(session_sqs, session_s3, client: httpx.AsyncClient, msg
         if llm_rec:
             record.update({k: llm_rec.get(k) for k in record.keys()})
 
-    listing_id = _extract_listing_id(url) or _content_hash(url)[:12]
     now = datetime.utcnow().isoformat() + "Z"
     out = {
+        "record_type": "listing",
         "listing_id": listing_id,
         "url": url,
         "ts": now,
-        "content_hash": _content_hash(html)[:16],
+        "content_hash": parsed["content_hash"],
         "parser_used": "rules+llm" if any(record.values()) else "rules",
         "confidence": 0.8 if any(record.values()) else 0.4,
         **record,
     }
+    if frontier is not None:
+        await asyncio.to_thread(frontier.record_page, url, validators)
     return out
 
 
+def _heartbeat(listing_id: str, url: str, content_hash: str, reason: str) -> Dict[str, Any]:
+    # Written in place of a full record when a listing page hasn't changed since its last scrape
+    return {
+        "record_type": "heartbeat",
+        "listing_id": listing_id,
+        "url": url,
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "content_hash": content_hash,
+        "reason": reason,  # unchanged | not_modified
+    }
+
+
 async def run_worker() -> None:
     settings = load_settings()
     logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
     log = logging.getLogger("worker")
     proxy_pool = build_proxy_pool()
 
-    buffer: List[Dict[str, Any]] = []
-    buffer_lock = asyncio.Lock()
     buffer_max = 500
     buffer_flush_s = 10
 
+    parse_pool = ParsePool(settings.parse_workers, settings.parse_queue_size, settings.html_extractor)
+    log.info("parsing with %d worker processes (queue %d)", settings.parse_workers, settings.parse_queue_size)
+
+    frontier = None
+    if settings.frontier_db_path:
+        frontier = Frontier(settings.frontier_db_path, settings.frontier_freshness_s, settings.frontier_bloom_capacity)
+        log.info("frontier %s, freshness %.0fs", settings.frontier_db_path, settings.frontier_freshness_s)
+
     session = aioboto3.Session()
     async with session.client("sqs", region_name=settings.aws_region) as sqs, session.client("s3", region_name=settings.aws_region) as s3, httpx.AsyncClient(http2=True) as client:
         queue: asyncio.Queue = asyncio.Queue(maxsize=settings.max_concurrency * 2)
+        # Deletes and discovered-link sends share one batching policy
+        batching = dict(
+            linger_s=settings.sqs_batch_linger_ms / 1000,
+            max_retries=settings.retry_limit,
+            backoff_base_s=settings.backoff_base_ms / 1000,
+        )
+        acks = SqsBatcher(sqs, settings.sqs_queue_url, "delete", **batching)
+        link_sender = SqsBatcher(sqs, settings.sqs_queue_url, "send", **batching)
+        pipeline = FlushPipeline(
+            s3,
+            settings,
+            max_in_flight=settings.flush_max_in_flight,
+            part_max_bytes=settings.part_max_bytes,
+            multipart_threshold=settings.multipart_threshold_bytes,
+            dictionary=load_zstd_dictionary(settings.zstd_dict_path),
+            max_retries=settings.retry_limit,
+            backoff_base_s=settings.backoff_base_ms / 1000,
+            spill_dir=settings.spill_dir,
+        )
+        spilled = await pipeline.upload_spilled()
+        if spilled:
+            log.info("re-uploaded %d spilled parts from %s", spilled, settings.spill_dir)
 
         async def receiver():
             while True:
@@ -237,19 +351,23 @@ async def run_worker() -> None:
                     log.warning("receive error: %s", e)
                     await asyncio.sleep(1.0)
 
+        def log_ack_error(ack: asyncio.Future) -> None:
+            # Deletes still pending when the batcher shuts down are cancelled, not failed
+            if ack.cancelled():
+                return
+            error = ack.exception()
+            if error is not None:
+                log.warning("delete error: %s", error)
+
         async def worker_task(worker_id: int):
             while True:
                 m = await queue.get()
                 try:
-                    rec = await handle_message(sqs, s3, client, m, settings, proxy_pool)
+                    rec = await handle_message(sqs, s3, client, m, settings, proxy_pool, parse_pool, link_sender, frontier)
                     if isinstance(rec, dict):
-                        async with buffer_lock:
-                            buffer.append(rec)
-                    # delete message after processing
-                    try:
-                        await sqs.delete_message(QueueUrl=settings.sqs_queue_url, ReceiptHandle=m["ReceiptHandle"])
-                    except Exception as e:
-                        log.warning("delete error: %s", e)
+                        await pipeline.add(rec)
+                    # delete message after processing; batched, so don't hold this worker for it
+                    acks.submit({"ReceiptHandle": m["ReceiptHandle"]}).add_done_callback(log_ack_error)
                 except Exception as e:
                     log.warning("worker %d error: %s", worker_id, e)
                 finally:
@@ -260,37 +378,26 @@ async def run_worker() -> None:
             while True:
                 await asyncio.sleep(1.0)
                 now = time.time()
-                async with buffer_lock:
-                    if buffer and (len(buffer) >= buffer_max or (now - last_flush) > buffer_flush_s):
-                        await flush_buffer(buffer, s3, settings)
-                        log.info("flushed %d records", len(buffer))
-                        buffer.clear()
-                        last_flush = now
+                if len(pipeline) and (len(pipeline) >= buffer_max or (now - last_flush) > buffer_flush_s):
+                    # Only the buffer swap happens here; encoding and upload run in the background
+                    flushed = await pipeline.flush()
+                    log.info("flushing %d records; metrics %s", flushed, pipeline.metrics.snapshot())
+                    last_flush = now
 
         recv_task = asyncio.create_task(receiver())
         workers = [asyncio.create_task(worker_task(i)) for i in range(settings.max_concurrency)]
         flush_task = asyncio.create_task(flusher())
 
-        await asyncio.gather(recv_task, *workers, flush_task)
-
-
-async def flush_buffer(buffer: List[Dict[str, Any]], s3, settings) -> None:
-    if not buffer:
-        return
-    day = datetime.utcnow().strftime("%Y%m%d")
-    ts = datetime.utcnow().strftime("%H%M%S")
-    key = f"{settings.s3_prefix_records}/{day}/part-{ts}-{int(time.time()*1000)}.ndjson"
-
-    blob = _compress_ndjson(buffer, settings.compress_codec)
-    extra = {"ContentType": "application/x-ndjson"}
-    if settings.compress_codec == "zstd" and zstd is not None:
-        extra["ContentEncoding"] = "zstd"
-        key += ".zst"
-    else:
-        extra["ContentEncoding"] = "gzip"
-        key += ".gz"
-
-    await s3.put_object(Bucket=settings.s3_bucket, Key=key, Body=blob, **extra)
+        try:
+            await asyncio.gather(recv_task, *workers, flush_task)
+        finally:
+            await link_sender.close()
+            await acks.close()
+            await pipeline.close(timeout_s=60)
+            parse_pool.close()
+            if frontier is not None:
+                log.info("frontier stats %s", frontier.stats)
+                frontier.close()
 
 
 def main() -> None:
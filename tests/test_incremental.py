@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Fixandflip import IncrementalAnalysis, run_fix_and_flip_analysis
+
+TAG_SETS = [
+	["arp_estimate", "roi_calc", "70_percent_method", "exclude_pending", "buying_from_realtor"],
+	["comps", "same_zip_only"],
+	["comps", "same_zip_only", "exclude_sold"],
+	["ppsf_analysis", "exclude_pending"],
+	["arp", "radius_miles:5"],
+	["renovation_cost"],
+]
+
+
+def make_listings(rng: np.random.Generator, n: int, start: int = 0) -> pd.DataFrame:
+	"""Listings in two states, two zips per city and a few missing values."""
+	df = pd.DataFrame({
+		"listingId": [f"L{i}" for i in range(start, start + n)],
+		"price": rng.integers(100_000, 900_000, n).astype(float),
+		"squareFeet": rng.integers(600, 3500, n).astype(float),
+		"bedrooms": rng.integers(1, 5, n).astype(float),
+		"bathrooms": rng.choice([1, 2, 3], n).astype(float),
+		"city": rng.choice(["Austin", "Dallas", "Portland", None], n),
+		"state": rng.choice(["TX", "OR"], n),
+		"zip": rng.choice(["78701", "78702"], n),
+		"status": rng.choice(["Active", "Pending", "Sold"], n),
+		"latitude": 40 + rng.normal(0, 0.2, n),
+		"longitude": -100 + rng.normal(0, 0.2, n),
+	})
+	for column in ("price", "squareFeet", "bedrooms"):
+		df.loc[rng.random(n) < 0.05, column] = np.nan
+	return df
+
+
+def assert_matches_full_run(state: IncrementalAnalysis) -> None:
+	full = run_fix_and_flip_analysis(state.listings, state.tags)
+	assert sorted(state.results.index) == sorted(full.index)
+	pd.testing.assert_frame_equal(state.results.loc[full.index, full.columns], full, check_dtype=False)
+
+
+@pytest.mark.parametrize("tags", TAG_SETS, ids=lambda tags: "+".join(tags))
+def test_apply_matches_full_recompute(tags):
+	rng = np.random.default_rng(7)
+	state = IncrementalAnalysis(make_listings(rng, 300), tags)
+	for step in range(4):
+		ids = state.listings.index.to_series().sample(20, random_state=step).tolist()
+		updates = state.listings.loc[ids[:10]].copy()
+		updates["price"] = updates["price"] * rng.uniform(0.8, 1.2, 10)
+		updates.iloc[:2, updates.columns.get_loc("city")] = "Dallas"
+		updates.iloc[2:4, updates.columns.get_loc("zip")] = "78703"
+		updates.iloc[4, updates.columns.get_loc("squareFeet")] = np.nan
+		inserts = make_listings(rng, 5, start=1000 + step * 10)
+		state.apply(pd.concat([updates, inserts]), deletes=ids[10:15])
+		assert_matches_full_run(state)
+
+
+@pytest.mark.parametrize(
+	"tags",
+	[["ppsf_analysis"], ["ppsf_analysis", "exclude_pending"], ["arp_estimate", "roi_calc", "exclude_sold"]],
+	ids=lambda tags: "+".join(tags),
+)
+def test_apply_without_location_columns(tags):
+	# Every listing falls back to the overall median, so any price change can move all of them
+	rng = np.random.default_rng(13)
+	state = IncrementalAnalysis(make_listings(rng, 200).drop(columns=["city", "state"]), tags)
+	for step in range(4):
+		ids = state.listings.index.to_series().sample(10, random_state=step).tolist()
+		updates = state.listings.loc[ids[:5]].copy()
+		updates["price"] = updates["price"] * rng.uniform(0.5, 1.5, 5)
+		updates.iloc[0, updates.columns.get_loc("status")] = "Pending"
+		inserts = make_listings(rng, 3, start=1000 + step * 10).drop(columns=["city", "state"])
+		state.apply(pd.concat([updates, inserts]), deletes=ids[5:8])
+		assert_matches_full_run(state)
+
+
+@pytest.mark.parametrize("tags", TAG_SETS, ids=lambda tags: "+".join(tags))
+def test_apply_duplicate_and_conflicting_ids(tags):
+	rng = np.random.default_rng(11)
+	state = IncrementalAnalysis(make_listings(rng, 200), tags)
+	listing_id, deleted_id = state.listings.index[:2]
+	first = state.listings.loc[[listing_id]].copy()
+	second = first.copy()
+	first["price"] = 1.0
+	second["price"] = 250_000.0
+	second["status"] = "Active"
+	# The last row for an id wins, and an upsert beats a delete of the same id
+	state.apply(pd.concat([first, second]), deletes=[listing_id, deleted_id])
+	assert state.listings.loc[listing_id, "price"] == 250_000.0
+	assert deleted_id not in state.listings.index
+	assert_matches_full_run(state)
+
+
+def test_apply_unchanged_rows_with_missing_values_rescore_nothing():
+	rng = np.random.default_rng(3)
+	df = make_listings(rng, 100)
+	df.loc[:9, "price"] = np.nan
+	state = IncrementalAnalysis(df, ["comps", "same_zip_only"])
+	assert state.apply(state.listings.iloc[:10].copy()).empty
+	assert_matches_full_run(state)
+
+
+def test_duplicate_ids_are_rejected():
+	rng = np.random.default_rng(5)
+	df = make_listings(rng, 10)
+	df.loc[1, "listingId"] = df.loc[0, "listingId"]
+	with pytest.raises(ValueError):
+		IncrementalAnalysis(df, ["comps"])
@@ -0,0 +1,37 @@
+import pandas as pd
+
+from Fixandflip import MarketIndex
+
+
+def _listings() -> pd.DataFrame:
+	return pd.DataFrame({
+		"mlsNumber": ["A", "B", "C"],
+		"price": [100_000.0, 200_000.0, 900_000.0],
+		"squareFeet": [1500.0, 1500.0, 1500.0],
+		"bedrooms": [3.0, 3.0, 3.0],
+		"bathrooms": [2.0, 2.0, 2.0],
+		"city": ["Austin"] * 3,
+		"state": ["TX"] * 3,
+	})
+
+
+def test_comps_exclude_the_listing_by_the_index_id_column(tmp_path):
+	df = _listings()
+	index = MarketIndex.from_frame(df, id_column="mlsNumber")
+	listing = df.iloc[2].to_dict()
+	# Only A and B are comps of C; counting C itself would pull the median up
+	assert index.comps_estimate(listing) == (150_000.0, 2)
+	
+	path = str(tmp_path / "index.json.gz")
+	index.save(path)
+	loaded = MarketIndex.load(path)
+	assert loaded.id_column == "mlsNumber"
+	assert loaded.comps_estimate(listing) == (150_000.0, 2)
+
+
+def test_indexes_saved_without_an_id_column_use_listing_id():
+	df = _listings().rename(columns={"mlsNumber": "listingId"})
+	data = MarketIndex.from_frame(df).to_dict()
+	del data["id_column"]
+	index = MarketIndex.from_dict(data)
+	assert index.comps_estimate(df.iloc[0].to_dict()) == (550_000.0, 2)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Fixandflip import rank_deals, run_fix_and_flip_analysis, run_fix_and_flip_analysis_parallel
+
+TYPO_TAGS = ["70_percent_method", "exclude_pendng"]
+
+
+@pytest.fixture
+def listings() -> pd.DataFrame:
+	rng = np.random.default_rng(1)
+	n = 400
+	return pd.DataFrame({
+		"listingId": [f"L{i}" for i in range(n)],
+		"price": rng.integers(100_000, 900_000, n).astype(float),
+		"squareFeet": rng.integers(600, 3500, n).astype(float),
+		"bedrooms": rng.integers(1, 5, n).astype(float),
+		"bathrooms": rng.choice([1, 2, 3], n).astype(float),
+		"city": rng.choice(["Austin", "Dallas", "Houston", "Portland"], n),
+		"state": rng.choice(["TX", "OR"], n),
+		"zip": rng.choice(["78701", "78702"], n),
+		"status": rng.choice(["Active", "Pending"], n),
+	})
+
+
+def test_serial_rejects_typo_tag(listings):
+	with pytest.raises(ValueError, match="exclude_pending"):
+		run_fix_and_flip_analysis(listings, TYPO_TAGS)
+
+
+def test_sharded_path_rejects_typo_tag(listings):
+	with pytest.raises(ValueError, match="exclude_pending"):
+		run_fix_and_flip_analysis_parallel(listings, TYPO_TAGS, workers=2)
+
+
+def test_rank_deals_rejects_typo_tag(listings):
+	with pytest.raises(ValueError, match="exclude_pending"):
+		rank_deals(listings, TYPO_TAGS, 10)
+
+
+def test_unknown_config_key_only_warns_on_every_path(listings):
+	tags = ["70_percent_method", "exclude_pending"]
+	config = {"realtor_commision": 0.05}
+	with pytest.warns(UserWarning, match="realtor_commision"):
+		serial = run_fix_and_flip_analysis(listings, tags, config)
+	with pytest.warns(UserWarning, match="realtor_commision"):
+		sharded = run_fix_and_flip_analysis_parallel(listings, tags, config, workers=2)
+	with pytest.warns(UserWarning, match="realtor_commision"):
+		rank_deals(listings, tags, 10, config=config)
+	pd.testing.assert_frame_equal(sharded, serial)